@@ -3,6 +3,9 @@
 from collections import namedtuple
 import os
 import sys
+import threading
+
+from six.moves import StringIO
 
 from hydrant.util import FIXEDPATHS
 
@@ -25,6 +28,41 @@ DockerSection = namedtuple('DockerSection', 'Registry Namespace Tag')
 TaskSubsection = namedtuple('TaskSubSection', ('Src', 'Image') +
                                               DockerSection._fields)
 
+# Text of each config file read, by path, with the (mtime, size) it was read
+# at, and the Config built for each (path, cli_cfg) with the (mtime, size) of
+# each of its layers, so that unchanged files are only read and merged once
+_TEXTS = dict()
+_SNAPSHOTS = dict()
+# Record types of [Task ...] subsections, by name and fields
+_SECTION_TYPES = dict()
+_LOCK = threading.Lock()
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+def _read_text(path, stamp):
+    with _LOCK:
+        cached = _TEXTS.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path) as cfg:
+        text = cfg.read()
+    with _LOCK:
+        _TEXTS[path] = (stamp, text)
+    return text
+
+def _section_type(name, fields):
+    with _LOCK:
+        section_type = _SECTION_TYPES.get((name, fields))
+        if section_type is None:
+            section_type = namedtuple(name, fields)
+            _SECTION_TYPES[(name, fields)] = section_type
+    return section_type
+
 class ConfigLoader(object):
     '''
     Takes a directory and loads config files
@@ -36,37 +74,50 @@ class ConfigLoader(object):
         '''
         if path is None:
             path = os.getcwd()
-        self._config = SafeConfigParser(allow_no_value=True)
-        self._config.optionxform = str
+        path = os.path.abspath(path)
+        if cli_cfg:
+            cli_cfg = os.path.abspath(cli_cfg)
         user_cfg = os.path.join(FIXEDPATHS.USERDIR, 'hydrant.cfg')
-        with open(user_cfg) as default_cfg:
-            if PY32:
-                self._config.read_file(self.readline_generator(default_cfg))
-            else:
-                self._config.readfp(default_cfg)
                 
         workflow_cfg = ''
         task_cfg = ''
         if os.path.exists(os.path.join(path, 'Dockerfile')):
             task_cfg = os.path.join(path, 'hydrant.cfg')
-            workflow_cfg = os.path.join(os.path.dirname(os.path.abspath(path)),
-                                        'hydrant.cfg')
+            workflow_cfg = os.path.join(os.path.dirname(path), 'hydrant.cfg')
         else:
             workflow_cfg = os.path.join(path, 'hydrant.cfg')
-        
-        self._config.read([workflow_cfg, task_cfg, cli_cfg])
-    
-    # from https://docs.python.org/3/library/configparser.html#configparser.ConfigParser.readfp
-    @staticmethod
-    def readline_generator(fp):
-        line = fp.readline()
-        while line:
-            yield line
-            line = fp.readline()
-    
+
+        layers = [user_cfg] + [cfg for cfg in (workflow_cfg, task_cfg, cli_cfg)
+                               if cfg]
+        stamps = tuple((cfg, _stamp(cfg)) for cfg in layers)
+        key = (path, cli_cfg)
+        with _LOCK:
+            cached = _SNAPSHOTS.get(key)
+        if cached is not None and cached[0] == stamps:
+            self._snapshot = cached[1]
+            return
+
+        self._config = SafeConfigParser(allow_no_value=True)
+        self._config.optionxform = str
+        for cfg, stamp in stamps:
+            # As with ConfigParser.read, only the user config must exist
+            if stamp is None and cfg != user_cfg:
+                continue
+            text = _read_text(cfg, stamp)
+            if PY32:
+                self._config.read_string(text, cfg)
+            else:
+                self._config.readfp(StringIO(text), cfg)
+        self._snapshot = self._build_config()
+        with _LOCK:
+            _SNAPSHOTS[key] = (stamps, self._snapshot)
+
     @property
     def config(self):
-        '''Build namedtuple version of config'''
+        '''Immutable namedtuple version of config'''
+        return self._snapshot
+
+    def _build_config(self):
         all_section  = self._get_section(AllSection, 'All')
         firecloud_section = self._get_section(FireCloudSection, 'FireCloud')
         docker_section = self._get_section(DockerSection, 'Docker')
@@ -91,9 +142,10 @@ class ConfigLoader(object):
                        if subsection.startswith(section_prefix)]
         if len(subsections) == 0:
             return None
-        Section = namedtuple(section_prefix + 's',
-                             [subsection.replace(section_prefix, '').strip() \
-                              for subsection in subsections])
+        Section = _section_type(section_prefix + 's',
+                                tuple(subsection.replace(section_prefix,
+                                                         '').strip()
+                                      for subsection in subsections))
         return Section._make(self._get_section(named_tuple_class, subsection)
                              for subsection in subsections)
         
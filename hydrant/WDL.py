@@ -1,82 +1,733 @@
 # encoding: utf-8
 
 '''
-Classes to assist in basic WDL parsing:
+Classes to assist in WDL parsing:
     Task: Holds single WDL task and basic information about it
     WDL:  Holds workflow and an OrderedDict of Tasks
+
+parse() tokenizes a WDL (draft-2 or 1.0) and returns a Document describing
+its imports, structs, tasks and workflow. Each node records the byte offsets
+of its source, so that values such as the docker runtime attribute can be
+rewritten in place.
+
+load_wdl() returns WDLs from a process-wide cache, so that each file is only
+parsed once until modified, and resolve_imports() loads a WDL along with
+everything it imports.
 '''
-from collections import OrderedDict
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+Document = namedtuple('Document', 'version imports structs tasks workflow')
+Import = namedtuple('Import', 'uri alias aliases start end')
+Struct = namedtuple('Struct', 'name members start end')
+# type and expression are None for draft-2 workflow outputs given as
+# references (e.g. task.output or task.*), which only have a name
+Declaration = namedtuple('Declaration', 'type name expression start end')
+# value is that of the expression when it is a plain string literal; the
+# offsets span the whole expression, including any quotes
+RuntimeAttribute = namedtuple('RuntimeAttribute',
+                              'key expression value start end')
+Call = namedtuple('Call', 'task alias inputs start end')
+Scatter = namedtuple('Scatter', 'variable expression body start end')
+Conditional = namedtuple('Conditional', 'expression body start end')
+Imports = namedtuple('Imports', 'root wdls graph tasks')
+_TaskNode = namedtuple('_TaskNode', 'name inputs declarations command ' +
+                                    'outputs runtime start end')
+
+class Workflow(namedtuple('Workflow', 'name inputs body outputs start end')):
+    @property
+    def calls(self):
+        '''All calls of the workflow, including those nested in scatter
+        and if blocks, in order of appearance'''
+        calls = []
+        pending = list(reversed(self.body))
+        while pending:
+            node = pending.pop()
+            if isinstance(node, Call):
+                calls.append(node)
+            elif isinstance(node, (Scatter, Conditional)):
+                pending.extend(reversed(node.body))
+        return calls
+
+class WDLSyntaxError(Exception):
+    def __init__(self, message, data, offset):
+        self.line = data.count(b'\n', 0, offset) + 1
+        super(WDLSyntaxError, self).__init__('{} (line {})'.format(message,
+                                                                  self.line))
+
+class WDLImportError(Exception):
+    pass
+
+def _str(value):
+    '''Native string of UTF-8 encoded bytes'''
+    return value if str is bytes else value.decode('utf-8')
+
+_SKIP = re.compile(br'(?:\s+|#[^\n]*)+')
+_TOKEN = re.compile(br'(?P<name>[A-Za-z_][A-Za-z0-9_]*)|'
+                    br'(?P<number>[0-9]+(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)|'
+                    br'(?P<op>==|!=|<=|>=|&&|\|\||[^\s\w"\'])|'
+                    br'(?P<string>["\'])')
+_STRING_STOP = {b'"': re.compile(br'["\\]|[$~]\{'),
+                b"'": re.compile(br"['\\]|[$~]\{")}
+_PLACEHOLDER_STOP = re.compile(br'[{}"\']')
+_COMMAND_START = re.compile(br'\s*(\{|<<<)')
+_COMMAND_STOP = re.compile(br'[$~]\{|[{}]')
+_PLACEHOLDER = re.compile(br'[$~]\{')
+
+def _scan_string(data, pos):
+    '''Offset just past the string literal starting at pos'''
+    start = pos
+    quote = data[pos:pos + 1]
+    stop = _STRING_STOP[quote]
+    pos += 1
+    while True:
+        match = stop.search(data, pos)
+        if match is None:
+            raise WDLSyntaxError('Unterminated string', data, start)
+        if match.group() == quote:
+            return match.end()
+        if match.group() == b'\\':
+            pos = match.end() + 1
+        else:
+            pos = _scan_placeholder(data, match.end())
+
+def _scan_placeholder(data, pos):
+    '''Offset just past the end of the placeholder whose body starts at pos'''
+    start = pos
+    depth = 1
+    while True:
+        match = _PLACEHOLDER_STOP.search(data, pos)
+        if match is None:
+            raise WDLSyntaxError('Unterminated placeholder', data, start)
+        char = match.group()
+        if char == b'{':
+            depth += 1
+            pos = match.end()
+        elif char == b'}':
+            depth -= 1
+            pos = match.end()
+            if depth == 0:
+                return pos
+        else:
+            pos = _scan_string(data, match.start())
+
+def _scan_command(data, pos, heredoc):
+    '''Offsets of the end of the command body starting at pos, and just past
+    its closing delimiter'''
+    if heredoc:
+        end = data.find(b'>>>', pos)
+        if end < 0:
+            raise WDLSyntaxError('Unterminated command', data, pos)
+        return end, end + 3
+    start = pos
+    depth = 1
+    while True:
+        match = _COMMAND_STOP.search(data, pos)
+        if match is None:
+            raise WDLSyntaxError('Unterminated command', data, start)
+        char = match.group()
+        if char == b'{':
+            depth += 1
+        elif char == b'}':
+            depth -= 1
+            if depth == 0:
+                return match.start(), match.end()
+        else:
+            pos = _scan_placeholder(data, match.end())
+            continue
+        pos = match.end()
+
+def tokenize(data):
+    '''
+    Split WDL source (bytes) into a list of (kind, value, start, end,
+    newline) tuples, where kind is one of name, number, op, string or
+    command (the raw body of a command section), and newline tells whether
+    a line break precedes the token.
+    '''
+    tokens = []
+    append = tokens.append
+    skip = _SKIP.match
+    token = _TOKEN.match
+    command_start = _COMMAND_START.match
+    pos = 0
+    size = len(data)
+    newline = True
+    while True:
+        match = skip(data, pos)
+        if match is not None:
+            newline = newline or b'\n' in match.group()
+            pos = match.end()
+        if pos >= size:
+            return tokens
+        match = token(data, pos)
+        kind = match.lastgroup
+        end = _scan_string(data, pos) if kind == 'string' else match.end()
+        value = data[pos:end]
+        append((kind, value, pos, end, newline))
+        newline = False
+        pos = end
+        if value == b'command':
+            match = command_start(data, pos)
+            if match is not None:
+                start = match.end()
+                end, pos = _scan_command(data, start,
+                                         match.group(1) == b'<<<')
+                append(('command', data[start:end], start, end, False))
+
+# Tokens after or before which an expression continues onto the next line
+_CONTINUATIONS = frozenset([b'+', b'-', b'*', b'/', b'%', b'==', b'!=', b'<',
+                            b'>', b'<=', b'>=', b'&&', b'||', b'!', b'.',
+                            b'=', b'if', b'then', b'else'])
+_OPENING = frozenset([b'(', b'[', b'{'])
+_CLOSING = frozenset([b')', b']', b'}'])
+
+class _Parser(object):
+    def __init__(self, data):
+        self.data = data
+        self.tokens = tokenize(data)
+        self.pos = 0
+        self.end = 0  # Offset just past the last token consumed
+        self.version = None
+        self.eof = ('eof', b'', len(data), len(data), True)
+
+    def error(self, message, token=None):
+        if token is None:
+            token = self.peek()
+        if token[0] == 'eof':
+            message += ', found end of file'
+        else:
+            message += ', found "{}"'.format(_str(token[1][:40]))
+        return WDLSyntaxError(message, self.data, token[2])
+
+    def peek(self, ahead=0):
+        pos = self.pos + ahead
+        return self.tokens[pos] if pos < len(self.tokens) else self.eof
+
+    def next(self):
+        token = self.peek()
+        if token[0] == 'eof':
+            raise self.error('Unexpected end of file', token)
+        self.pos += 1
+        self.end = token[3]
+        return token
+
+    def accept(self, value):
+        if self.peek()[1] == value:
+            return self.next()
+        return None
+
+    def expect(self, value):
+        token = self.accept(value)
+        if token is None:
+            raise self.error('Expected "{}"'.format(_str(value)))
+        return token
+
+    def name(self):
+        token = self.peek()
+        if token[0] != 'name':
+            raise self.error('Expected a name')
+        return _str(self.next()[1])
+
+    def is_section(self, keyword):
+        return self.peek()[1] == keyword and self.peek(1)[1] == b'{'
+
+    def skip_block(self):
+        '''Skip a balanced {...} block'''
+        self.expect(b'{')
+        depth = 1
+        while depth:
+            value = self.next()[1]
+            if value in _OPENING:
+                depth += 1
+            elif value in _CLOSING:
+                depth -= 1
+
+    def expression(self, stop_at_comma=False):
+        '''
+        Consume an expression, which ends at a closing bracket (or comma)
+        outside of any brackets, at a name starting a new line, unless
+        either line break is surrounded by an operator, or at a name
+        directly following an operand on the same line, which starts the
+        next entry (e.g. the "name :" of a runtime attribute, or the type
+        of a declaration).
+        Returns the text of the expression, its tokens, and its offsets.
+        '''
+        start = self.pos
+        depth = 0
+        previous = None
+        operand = False
+        while True:
+            token = self.peek()
+            value = token[1]
+            if token[0] == 'eof':
+                break
+            if depth == 0 and previous is not None:
+                if value in _CLOSING or (stop_at_comma and value == b','):
+                    break
+                if token[0] == 'name' and value not in _CONTINUATIONS and \
+                   (operand or (token[4] and previous not in _CONTINUATIONS)):
+                    break
+            if token[0] == 'op':
+                if value in _OPENING:
+                    depth += 1
+                elif value in _CLOSING:
+                    depth -= 1
+            operand = value in _CLOSING or (token[0] != 'op' and
+                                            value not in _CONTINUATIONS)
+            previous = self.next()[1]
+        if start == self.pos:
+            raise self.error('Expected an expression')
+        tokens = self.tokens[start:self.pos]
+        text = _str(self.data[tokens[0][2]:tokens[-1][3]])
+        return text, tokens, tokens[0][2], tokens[-1][3]
+
+    def declaration(self):
+        start = self.peek()[2]
+        self.name()
+        if self.peek()[1] == b'[':
+            depth = 0
+            while True:
+                value = self.next()[1]
+                if value == b'[':
+                    depth += 1
+                elif value == b']':
+                    depth -= 1
+                    if depth == 0:
+                        break
+        while self.peek()[1] in (b'?', b'+'):
+            self.next()
+        type_ = _str(self.data[start:self.end])
+        name = self.name()
+        expression = None
+        if self.accept(b'='):
+            expression = self.expression()[0]
+        return Declaration(type_, name, expression, start, self.end)
+
+    def declarations(self):
+        '''Declarations of a {...} section'''
+        self.expect(b'{')
+        declarations = []
+        while not self.accept(b'}'):
+            declarations.append(self.declaration())
+        return declarations
+
+    def outputs(self):
+        self.expect(b'{')
+        outputs = []
+        while not self.accept(b'}'):
+            following = self.peek(1)
+            if following[1] in (b'[', b'?', b'+') or \
+               (following[0] == 'name' and not following[4]):
+                outputs.append(self.declaration())
+            else:
+                # draft-2 reference to call outputs, e.g. task.* or task.out
+                start = self.peek()[2]
+                self.next()
+                while self.accept(b'.'):
+                    self.next()
+                outputs.append(Declaration(None, _str(self.data[start:
+                                                                self.end]),
+                                           None, start, self.end))
+                self.accept(b',')
+        return outputs
+
+    def runtime(self):
+        self.expect(b'{')
+        runtime = OrderedDict()
+        while not self.accept(b'}'):
+            key = self.name()
+            self.expect(b':')
+            text, tokens, start, end = self.expression()
+            value = None
+            if len(tokens) == 1 and tokens[0][0] == 'string' and \
+               _PLACEHOLDER.search(tokens[0][1]) is None:
+                value = _str(tokens[0][1][1:-1])
+            runtime[key] = RuntimeAttribute(key, text, value, start, end)
+        return runtime
+
+    def document(self):
+        imports = []
+        structs = OrderedDict()
+        tasks = OrderedDict()
+        workflow = None
+        if self.peek()[1] == b'version':
+            self.next()
+            start = self.peek()[2]
+            line_end = self.data.find(b'\n', start)
+            if line_end < 0:
+                line_end = len(self.data)
+            self.version = _str(self.data[start:line_end].split(b'#')[0]
+                                                          .strip())
+            while self.peek()[0] != 'eof' and self.peek()[2] < line_end:
+                self.next()
+        while self.peek()[0] != 'eof':
+            keyword = self.peek()[1]
+            if keyword == b'import':
+                imports.append(self.import_())
+            elif keyword == b'struct':
+                struct = self.struct()
+                structs[struct.name] = struct
+            elif keyword == b'task':
+                task = self.task()
+                tasks[task.name] = task
+            elif keyword == b'workflow':
+                if workflow is not None:
+                    raise self.error('Only one workflow is allowed')
+                workflow = self.workflow()
+            else:
+                raise self.error('Expected import, struct, task or workflow')
+        return Document(self.version, imports, structs, tasks, workflow)
+
+    def import_(self):
+        start = self.next()[2]
+        token = self.next()
+        if token[0] != 'string':
+            raise self.error('Expected the import URI as a string', token)
+        uri = _str(token[1][1:-1])
+        alias = None
+        aliases = OrderedDict()
+        if self.accept(b'as'):
+            alias = self.name()
+        while self.accept(b'alias'):
+            struct = self.name()
+            self.expect(b'as')
+            aliases[struct] = self.name()
+        return Import(uri, alias, aliases, start, self.end)
+
+    def struct(self):
+        start = self.next()[2]
+        name = self.name()
+        return Struct(name, self.declarations(), start, self.end)
+
+    def task(self):
+        start = self.next()[2]
+        name = self.name()
+        self.expect(b'{')
+        inputs = []
+        declarations = []
+        command = None
+        outputs = []
+        runtime = OrderedDict()
+        while not self.accept(b'}'):
+            keyword = self.peek()[1]
+            if self.is_section(b'input'):
+                self.next()
+                inputs.extend(self.declarations())
+            elif self.is_section(b'output'):
+                self.next()
+                outputs.extend(self.outputs())
+            elif self.is_section(b'runtime'):
+                self.next()
+                runtime.update(self.runtime())
+            elif keyword == b'command' and self.peek(1)[0] == 'command':
+                self.next()
+                command = _str(self.next()[1])
+            elif keyword in (b'meta', b'parameter_meta') and \
+                 self.peek(1)[1] == b'{':
+                self.next()
+                self.skip_block()
+            elif self.version is None:
+                # draft-2: all declarations are inputs
+                inputs.append(self.declaration())
+            else:
+                declarations.append(self.declaration())
+        node = _TaskNode(name, inputs, declarations, command, outputs, runtime,
+                         start, self.end)
+        return Task(_str(self.data[start:self.end]), node)
+
+    def workflow(self):
+        start = self.next()[2]
+        name = self.name()
+        self.expect(b'{')
+        inputs = []
+        body = []
+        outputs = []
+        while not self.accept(b'}'):
+            keyword = self.peek()[1]
+            if self.is_section(b'input'):
+                self.next()
+                inputs.extend(self.declarations())
+            elif self.is_section(b'output'):
+                self.next()
+                outputs.extend(self.outputs())
+            elif keyword in (b'meta', b'parameter_meta') and \
+                 self.peek(1)[1] == b'{':
+                self.next()
+                self.skip_block()
+            elif keyword in (b'call', b'scatter') or \
+                 (keyword == b'if' and self.peek(1)[1] == b'('):
+                body.append(self.statement())
+            elif self.version is None:
+                inputs.append(self.declaration())
+            else:
+                body.append(self.declaration())
+        return Workflow(name, inputs, body, outputs, start, self.end)
+
+    def statement(self):
+        '''A call, scatter, conditional or declaration in a workflow'''
+        keyword = self.peek()[1]
+        if keyword == b'call':
+            return self.call()
+        if keyword == b'scatter' or \
+           (keyword == b'if' and self.peek(1)[1] == b'('):
+            start = self.next()[2]
+            self.expect(b'(')
+            variable = None
+            if keyword == b'scatter':
+                variable = self.name()
+                self.expect(b'in')
+            expression = self.expression()[0]
+            self.expect(b')')
+            self.expect(b'{')
+            body = []
+            while not self.accept(b'}'):
+                body.append(self.statement())
+            if variable is None:
+                return Conditional(expression, body, start, self.end)
+            return Scatter(variable, expression, body, start, self.end)
+        return self.declaration()
+
+    def call(self):
+        start = self.next()[2]
+        task_start = self.peek()[2]
+        self.name()
+        while self.accept(b'.'):
+            self.name()
+        task = _str(self.data[task_start:self.end])
+        alias = None
+        if self.accept(b'as'):
+            alias = self.name()
+        inputs = OrderedDict()
+        if self.accept(b'{'):
+            if self.peek()[1] == b'input' and self.peek(1)[1] == b':':
+                self.next()
+                self.next()
+            while not self.accept(b'}'):
+                key = self.name()
+                if self.accept(b'='):
+                    inputs[key] = self.expression(stop_at_comma=True)[0]
+                else:
+                    inputs[key] = key
+                self.accept(b',')
+        return Call(task, alias, inputs, start, self.end)
+
+def parse(source):
+    '''Parse WDL source (bytes or text) into a Document'''
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    return _Parser(source).document()
 
-#TODO: enable parsing and manipulation of docker version string
 class Task(object):
     '''
     Hold Single WDL task and basic information about it.
     '''
 
-    def __init__(self, text):
+    def __init__(self, text, node=None):
         '''
         text: the text of a task section of a WDL
+        node: the parsed task, if already known
         '''
         self._text = text.rstrip()
-        self._name = self._parse_name()
-        
-    def _parse_version(self):
-        pass
-    
-    def _parse_name(self):
-        return self._text.split(None, 2)[1]
-    
+        if node is None:
+            node = next(iter(parse(self._text).tasks.values()))._node
+        self._node = node
+
     @property
     def name(self):
-        return self._name
-    
+        return self._node.name
+
     @property
     def text(self):
         return self._text
-        
-        
+
+    @property
+    def inputs(self):
+        return self._node.inputs
+
+    @property
+    def declarations(self):
+        '''Non-input declarations (WDL 1.0)'''
+        return self._node.declarations
+
+    @property
+    def command(self):
+        return self._node.command
+
+    @property
+    def outputs(self):
+        return self._node.outputs
+
+    @property
+    def runtime(self):
+        '''OrderedDict of RuntimeAttributes, by key'''
+        return self._node.runtime
+
+    @property
+    def docker(self):
+        '''The docker RuntimeAttribute, or None'''
+        return self._node.runtime.get('docker')
+
+    @property
+    def start(self):
+        return self._node.start
+
+    @property
+    def end(self):
+        return self._node.end
+
+
 class WDL(object):
     '''
     Hold the workflow text and an OrderedDict of Tasks.
     '''
 
-    def __init__(self, wdl_file):
+    def __init__(self, wdl_file, source=None):
         '''
         wdl_file: the path to a wdl
+        source:   its content, if already read
         '''
-        self._tasks = OrderedDict()
-        self._workflow = None
-        self._parse_wdl(wdl_file)
-    
-    def _parse_wdl(self, wdl_file):
-        task = None
-        with open(wdl_file, 'r') as wdl:
-            for line in wdl:
-                if line.startswith('task'):
-                    if task is not None:
-                        task = Task(task)
-                        self._tasks[task.name] = task
-                    task = line
-                elif line.startswith('workflow'):
-                    self._workflow = line
-                    if task is not None:
-                        task = Task(task)
-                        self._tasks[task.name] = task
-                elif self._workflow is None:
-                    task += line
-                else:
-                    self._workflow += line
+        if source is None:
+            with open(wdl_file, 'rb') as wdl:
+                source = wdl.read()
+        self._source = source
+        self._document = parse(self._source)
+
+    @property
+    def source(self):
+        '''The WDL as bytes'''
+        return self._source
+
+    @property
+    def document(self):
+        return self._document
 
     @property
     def tasks(self):
-        return self._tasks
+        return self._document.tasks
 
     @property
     def workflow(self):
-        return self._workflow
+        workflow = self._document.workflow
+        if workflow is None:
+            return None
+        return _str(self._source[workflow.start:workflow.end])
 
     def text(self):
-        tasks = ""
-        for task in self._tasks:
-            tasks += task.text + "\n\n"
-        return tasks + self._workflow
+        parts = [task.text + "\n\n" for task in self.tasks.values()]
+        parts.append(self.workflow or "")
+        return "".join(parts)
+
+# Parsed WDLs, most recently used last, keyed by path, size and mtime
+_WDL_CACHE = OrderedDict()
+_WDL_CACHE_LOCK = threading.Lock()
+WDL_CACHE_SIZE = 64
+IMPORT_TIMEOUT = 60  # seconds to wait for a server to send a url import
+
+def load_wdl(path):
+    '''
+    The WDL at path, reusing a previous parse of the file if its size and
+    modification time are unchanged. Parses are kept in a process-wide least
+    recently used cache. The WDL returned may be shared, and must not be
+    modified.
+    '''
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime)
+    with _WDL_CACHE_LOCK:
+        wdl = _WDL_CACHE.pop(key, None)
+        if wdl is not None:
+            _WDL_CACHE[key] = wdl
+            return wdl
+
+    wdl = WDL(path)
+
+    with _WDL_CACHE_LOCK:
+        _WDL_CACHE[key] = wdl
+        while len(_WDL_CACHE) > WDL_CACHE_SIZE:
+            _WDL_CACHE.popitem(last=False)
+    return wdl
+
+def _is_url(location):
+    return re.match(r'https?://', location) is not None
+
+def _locate(uri, importer):
+    '''Location of an import, relative to the location of the importer'''
+    if _is_url(uri):
+        return uri
+    if _is_url(importer):
+        from six.moves.urllib.parse import urljoin
+        return urljoin(importer, uri)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return os.path.normpath(os.path.join(os.path.dirname(importer), uri))
+
+def _load_import(location):
+    if _is_url(location):
+        import requests
+        response = requests.get(location, timeout=IMPORT_TIMEOUT)
+        response.raise_for_status()
+        return WDL(location, response.content)
+    return load_wdl(location)
+
+def resolve_imports(path, max_workers=8, fetch=True):
+    '''
+    Load the WDL at path and, recursively, the WDLs it imports, with up to
+    max_workers files being loaded at a time. Each file is loaded once,
+    however often it is imported. Unless fetch is True, WDLs imported by url
+    are not downloaded, and are only listed in the graph. Returns Imports of:
+        root:  the location of the WDL at path
+        wdls:  OrderedDict of WDLs by location, root first
+        graph: OrderedDict of the imports of each location, as lists of
+               (namespace, location)
+        tasks: OrderedDict of all Tasks, by name qualified with the
+               namespaces through which they are imported (e.g. task,
+               alias.task, alias.nested_alias.task)
+    Raises WDLImportError if a WDL cannot be loaded, or on import cycles.
+    '''
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    root = os.path.abspath(path)
+    loaded = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_load_import, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                location = pending.pop(future)
+                try:
+                    loaded[location] = wdl = future.result()
+                except Exception as e:
+                    raise WDLImportError("Unable to load {}: {}".format(
+                                                                location, e))
+                for wdl_import in wdl.document.imports:
+                    target = _locate(wdl_import.uri, location)
+                    if target not in loaded and \
+                       target not in pending.values() and \
+                       (fetch or not _is_url(target)):
+                        pending[executor.submit(_load_import, target)] = target
+
+    wdls = OrderedDict()
+    graph = OrderedDict()
+    tasks = OrderedDict()
+    def visit(location, prefix, chain):
+        if location in chain:
+            raise WDLImportError("Import cycle: " + " -> ".join(
+                                 chain[chain.index(location):] + [location]))
+        wdl = loaded.get(location)
+        if wdl is None:
+            return # Imported by url, and not fetched
+        if location not in graph:
+            wdls[location] = wdl
+            graph[location] = []
+            for wdl_import in wdl.document.imports:
+                namespace = wdl_import.alias or os.path.splitext(
+                                os.path.basename(wdl_import.uri))[0]
+                graph[location].append((namespace,
+                                        _locate(wdl_import.uri, location)))
+        for name, task in wdl.tasks.items():
+            tasks[prefix + name] = task
+        for namespace, target in graph[location]:
+            visit(target, prefix + namespace + '.', chain + [location])
+    visit(root, '', [])
+    return Imports(root, wdls, graph, tasks)
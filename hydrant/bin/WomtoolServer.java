@@ -0,0 +1,146 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.lang.reflect.Method;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.SelectionKey;
+import java.nio.channels.Selector;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+
+/**
+ * Long-lived womtool helper used by hydrant to avoid paying JVM startup and
+ * jar loading on every validation. Requires Java 16+ (for Unix domain
+ * sockets), and is launched as a single-file source program:
+ *
+ *     java -cp womtool.jar WomtoolServer.java <socket> <idle seconds>
+ *
+ * Each connection carries one request: the womtool arguments separated by
+ * NUL characters and terminated by a newline. The reply is womtool's return
+ * code on the first line, followed by its output (and anything it logged,
+ * if it failed). A request of "shutdown" stops the server, which otherwise
+ * exits after being idle for the given number of seconds.
+ */
+public class WomtoolServer {
+
+    private static Object womtool;
+    private static Method runWomtool;
+    private static Method wrapArgs;
+
+    public static void main(String[] args) throws Exception {
+        final Path socketPath = Paths.get(args[0]);
+        long idleMillis = Long.parseLong(args[1]) * 1000L;
+
+        // WomtoolMain is a Scala object extending App, so its body (which
+        // calls System.exit) only runs from main; runWomtool can be called
+        // directly on the module instance.
+        Class<?> module = Class.forName("womtool.WomtoolMain$");
+        womtool = module.getField("MODULE$").get(null);
+        for (Method method : module.getMethods()) {
+            if (method.getName().equals("runWomtool")
+                    && method.getParameterCount() == 1) {
+                runWomtool = method;
+            }
+        }
+        if (runWomtool == null) {
+            throw new NoSuchMethodException("womtool.WomtoolMain.runWomtool");
+        }
+        wrapArgs = Class.forName("scala.Predef")
+                        .getMethod("wrapRefArray", Object[].class);
+
+        Files.deleteIfExists(socketPath);
+        ServerSocketChannel server =
+            ServerSocketChannel.open(StandardProtocolFamily.UNIX);
+        server.bind(UnixDomainSocketAddress.of(socketPath));
+        server.configureBlocking(false);
+        Runtime.getRuntime().addShutdownHook(new Thread(() -> {
+            try {
+                Files.deleteIfExists(socketPath);
+            } catch (Exception e) {
+                // Nothing left to clean up
+            }
+        }));
+
+        Selector selector = Selector.open();
+        server.register(selector, SelectionKey.OP_ACCEPT);
+        boolean running = true;
+        while (running && selector.select(idleMillis) > 0) {
+            selector.selectedKeys().clear();
+            SocketChannel client = server.accept();
+            if (client == null) {
+                continue;
+            }
+            client.configureBlocking(true);
+            try {
+                running = handle(client);
+            } finally {
+                client.close();
+            }
+        }
+        server.close();
+        Files.deleteIfExists(socketPath);
+        System.exit(0);
+    }
+
+    private static boolean handle(SocketChannel client) throws Exception {
+        BufferedReader reader = new BufferedReader(new InputStreamReader(
+            Channels.newInputStream(client), StandardCharsets.UTF_8));
+        String request = reader.readLine();
+        OutputStream reply = Channels.newOutputStream(client);
+        if (request == null) {
+            return true;
+        }
+        if (request.equals("shutdown")) {
+            reply.write("0\n".getBytes(StandardCharsets.UTF_8));
+            return false;
+        }
+
+        int returnCode;
+        String output;
+        PrintStream stdout = System.out;
+        PrintStream stderr = System.err;
+        ByteArrayOutputStream captured = new ByteArrayOutputStream();
+        PrintStream capture = new PrintStream(captured, true, "UTF-8");
+        System.setOut(capture);
+        System.setErr(capture);
+        try {
+            Object wrapped = wrapArgs.invoke(null,
+                                             (Object) request.split("\0"));
+            Object termination = runWomtool.invoke(womtool, wrapped);
+            returnCode = (Integer) termination.getClass()
+                                              .getMethod("returnCode")
+                                              .invoke(termination);
+            output = (String) termination.getClass().getMethod("output")
+                                                    .invoke(termination);
+        } catch (Exception e) {
+            StringWriter trace = new StringWriter();
+            e.printStackTrace(new PrintWriter(trace));
+            returnCode = 1;
+            output = trace.toString();
+        } finally {
+            System.setOut(stdout);
+            System.setErr(stderr);
+        }
+        // As with stdout vs. stderr, anything womtool logged is only of
+        // interest if it failed
+        if (output == null) {
+            output = "";
+        }
+        if (returnCode != 0) {
+            output = captured.toString("UTF-8") + output;
+        }
+        reply.write((returnCode + "\n" + output)
+                    .getBytes(StandardCharsets.UTF_8));
+        return true;
+    }
+}
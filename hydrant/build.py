@@ -1,17 +1,28 @@
 #! /usr/bin/env python
 # encoding: utf-8
 
+import hashlib
 import json
 import logging
 import os
+import re
+import stat
 import sys
+from collections import deque
 
+from docker.errors import BuildError
+from docker.utils.build import exclude_paths
 from hydrant.ConfigLoader import ConfigLoader, SafeConfigParser
-from hydrant.util import ArgParser, add_default_arg, initialize_logging
-from hydrant.docker_utils import docker_repos, connect_to_daemon
+from hydrant.util import ArgParser, FIXEDPATHS, add_default_arg, \
+                         initialize_logging, log_table, run_parallel
+from hydrant.docker_utils import docker_repos, connect_to_daemon, \
+                                 configure_credential_helpers, image_index
 
 
 Description = "Build docker image defined in the local Dockerfile"
+MANIFESTS = os.path.join(FIXEDPATHS.USERDIR, 'builds')
+ERROR_LINES = 20  # last lines of build output kept for the report of a failure
+BUILT = re.compile(r'Successfully built ([0-9a-f]+)$')
 
 def get_full_tag(reg, namespc, repo, tag=None):
     full_tag = namespc + '/' + repo
@@ -30,26 +41,184 @@ def extract_full_tag(full_tag):
         reg = chunks[0]
     return reg, namespace, repo, tag
 
-def build_image(client, path, tag):
+def manifest_path(path):
+    '''Location of the build manifest for the given task directory'''
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(MANIFESTS, key + '.json')
+
+def load_manifest(path):
     try:
-        for result in client.images.build(path=path, tag=tag, rm=True)[1]:
-            logging.info(json.dumps(result).rstrip().replace(r'\n', ''))
-    except Exception as e:
-        logging.exception(str(e))
-        sys.exit(1)
-        
-    reg, namespace, _, tag = extract_full_tag(tag)
+        with open(manifest_path(path)) as manifest:
+            return json.load(manifest)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    if not os.path.isdir(MANIFESTS):
+        try:
+            os.makedirs(MANIFESTS)
+        except OSError:
+            if not os.path.isdir(MANIFESTS):
+                raise
+    local = manifest_path(path)
+    tmp = '{}.{}.tmp'.format(local, os.getpid())
+    with open(tmp, 'w') as manifest_file:
+        manifest_file.write(json.dumps(manifest, indent=2, sort_keys=True))
+    os.rename(tmp, local)
+
+def context_files(path):
+    '''Files in the build context of path, as filtered by .dockerignore'''
+    exclude = []
+    dockerignore = os.path.join(path, '.dockerignore')
+    if os.path.exists(dockerignore):
+        with open(dockerignore) as ignore:
+            exclude = [line.strip() for line in ignore.read().splitlines()
+                       if line.strip() and not line.strip().startswith('#')]
+    # hydrant.cfg is rewritten by every build, so it must not invalidate it
+    exclude.append('hydrant.cfg')
+    return sorted(relpath for relpath in exclude_paths(path, exclude)
+                  if not os.path.isdir(os.path.join(path, relpath)))
+
+def context_digest(path, tag, files=None):
+    '''
+    Hash the build context of path along with the tag being built. Files
+    whose mtime and size match those recorded in files (as returned from a
+    previous call) reuse the recorded hash instead of being read again.
+    Returns the digest and the updated file records.
+    '''
+    files = files or {}
+    records = {}
+    digest = hashlib.sha256((tag + '\n').encode('utf-8'))
+    for relpath in context_files(path):
+        st = os.lstat(os.path.join(path, relpath))
+        record = files.get(relpath)
+        if record is None or record[:3] != [st.st_mtime, st.st_size,
+                                            st.st_mode]:
+            file_hash = hashlib.sha256()
+            if stat.S_ISLNK(st.st_mode):
+                link = os.readlink(os.path.join(path, relpath))
+                file_hash.update(link.encode('utf-8'))
+            else:
+                with open(os.path.join(path, relpath), 'rb') as context_file:
+                    for chunk in iter(lambda: context_file.read(1 << 20), b''):
+                        file_hash.update(chunk)
+            record = [st.st_mtime, st.st_size, st.st_mode,
+                      file_hash.hexdigest()]
+        records[relpath] = record
+        digest.update('{}\0{:o}\0{}\n'.format(relpath, st.st_mode,
+                                               record[3]).encode('utf-8'))
+    return digest.hexdigest(), records
+
+def image_is_current(client, tag, manifest, digest):
+    '''True if tag was last built from this context and still exists'''
+    if manifest.get('digest') != digest:
+        return False
+    return image_index(client).image_id(tag) == manifest.get('image')
+
+def build_image(client, path, tag, force=False):
+    name = os.path.basename(path)
+    manifest = load_manifest(path)
+    digest, files = context_digest(path, tag, manifest.get('files'))
+    if not force and image_is_current(client, tag, manifest, digest):
+        logging.info("[%s] %s is up to date", name, tag)
+        return 'up to date'
+
+    image_id = stream_build(client, path, tag)
+    image_index(client).add(tag, image_id)
+
+    reg, namespace, _, version = extract_full_tag(tag)
     task_cfg = SafeConfigParser(allow_no_value=True)
     task_cfg.optionxform = str
     task_cfg.add_section('Docker')
     if reg is not None:
         task_cfg.set('Docker', 'Registry', reg)
     task_cfg.set('Docker', 'Namespace', namespace)
-    task_cfg.set('Docker', 'Tag', tag)
+    task_cfg.set('Docker', 'Tag', version)
     
     with open(os.path.join(path, 'hydrant.cfg'), 'w') as task_cfg_file:
         task_cfg.write(task_cfg_file)
-        
+
+    save_manifest(path, {'path': os.path.abspath(path), 'tag': tag,
+                         'digest': digest, 'image': image_id, 'files': files})
+    return 'built'
+
+def stream_build(client, path, tag):
+    '''
+    Build the image through the low-level API, logging its output as the
+    daemon produces it rather than once the build has finished. Only the
+    last ERROR_LINES lines are kept, for the BuildError raised if the build
+    fails. Returns the id of the image built.
+    '''
+    name = os.path.basename(path)
+    tail = deque(maxlen=ERROR_LINES)
+    built_id = []
+
+    def log_line(line):
+        line = line.rstrip()
+        if line:
+            tail.append(line)
+            logging.info("[%s] %s", name, line)
+            built = BUILT.match(line)
+            if built:
+                built_id.append(built.group(1))
+
+    image_id = None
+    # Output is split into events at arbitrary points, so the end of a
+    # line may only arrive with a later event
+    partial = ''
+    for event in client.api.build(path=path, tag=tag, rm=True, decode=True):
+        if 'error' in event:
+            log_line(partial)
+            raise BuildError(event['error'].strip(), list(tail))
+        aux = event.get('aux')
+        if isinstance(aux, dict) and 'ID' in aux:
+            image_id = aux['ID']
+        if 'stream' in event:
+            lines = (partial + event['stream']).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                log_line(line)
+        elif 'status' in event and 'progress' not in event:
+            # Pulls of base images, skipping their progress bars
+            log_line(': '.join(part for part in (event.get('id'),
+                                                 event['status']) if part))
+    log_line(partial)
+    if image_id is None and built_id:
+        image_id = built_id[0]
+    if image_id is None:
+        raise BuildError("No image id found in the build output", list(tail))
+    if not image_id.startswith('sha256:'):
+        # Only the short id is reported by older daemons
+        image_id = client.api.inspect_image(image_id)['Id']
+    return image_id
+
+def build_images(client, builds, jobs=1, fail_fast=False, force=False):
+    '''
+    Build (path, tag) pairs concurrently using up to jobs workers against the
+    same daemon, then summarize the outcome of each. Returns True if all
+    builds succeeded.
+    '''
+    image_index(client, [os.path.basename(path) for path, _ in builds])
+    results = run_parallel(build_image,
+                           [(os.path.basename(path), (client, path, tag, force))
+                            for path, tag in builds],
+                           jobs, fail_fast)
+    for (path, _), result in zip(builds, results):
+        if isinstance(result.error, BuildError):
+            # Output of concurrent builds is interleaved, so repeat the end
+            # of each failed one
+            logging.error("[%s] %s, last lines of output:",
+                          os.path.basename(path), result.error.msg)
+            for line in result.error.build_log:
+                logging.error("[%s]   %s", os.path.basename(path), line)
+    if len(results) > 1:
+        log_table(['Image', 'Duration', 'Result'],
+                  [(tag, '{:.1f}s'.format(result.duration),
+                    result.result if result.error is None else
+                    'cancelled' if result.error == 'cancelled' else 'FAILED')
+                   for (_, tag), result in zip(builds, results)])
+    return all(result.error is None for result in results)
+
 def main(args=None):
     repos = {repo: version for repo, version in docker_repos()}
     docker_cfg = ConfigLoader().config.Docker
@@ -97,42 +266,54 @@ def main(args=None):
     parser.add_argument('-r', '--repository', **repo_kwargs)
     parser.add_argument('-a', '--all', action='store_true',
                         help="Build all docker images.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of images to build concurrently " +
+                             "(default: %(default)s)")
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="Stop starting new builds once one has failed")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Rebuild images even if their build context " +
+                             "is unchanged since the last successful build")
 
     args = parser.parse_args(args)
     client = connect_to_daemon()
+    configure_credential_helpers()
     
+    builds = []
     if args.all:
         for repo, version in repos.items():
             tag = get_full_tag(args.registry, args.namespace,
                                os.path.basename(repo), version)
-            build_image(client, repo, tag)
+            builds.append((repo, tag))
     elif args.repository:
         all_repos = {os.path.basename(path): path for path in repos}
         if isinstance(args.repository, list):
             user_repos = [repo.split(':', 1)[0] for repo in args.repository]
             # Only build images if all user-specified ones are available
-            build_images = set(user_repos).issubset(set(all_repos.keys()))
+            all_found = set(user_repos).issubset(set(all_repos.keys()))
             for idx, repo in enumerate(args.repository):
                 tag = get_full_tag(args.registry, args.namespace, repo)
                 user_repo = user_repos[idx]
                 if user_repo in all_repos:
-                    if build_images:
-                        build_image(client, all_repos[user_repo],
-                                    tag)
+                    builds.append((all_repos[user_repo], tag))
                 else:
                     logging.error("Could not find a path for %s. Please ensure" + \
                                   " the directory containing the Dockerfile " + \
                                   "matches the name of the repository.", tag)
-            if not build_images:
+            if not all_found:
                 sys.exit(1)
         else:
             tag = get_full_tag(args.registry, args.namespace, args.repository)
             repo = args.repository.split(':', 1)[0]
-            build_image(client, all_repos[repo], tag)
+            builds.append((all_repos[repo], tag))
     else:
         logging.error("No repository specified.")
         sys.exit(1)
 
+    if not build_images(client, sorted(builds), args.jobs, args.fail_fast,
+                        args.force):
+        sys.exit(1)
+
 if __name__ == '__main__':
     initialize_logging()
     main()
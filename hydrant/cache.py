@@ -0,0 +1,101 @@
+# encoding: utf-8
+
+'''
+Small on-disk caches kept in the user directory (~/.hydrant/cache/<name>),
+holding one JSON file per entry and evicting the least recently used entries
+once more than max_entries are stored.
+'''
+
+import hashlib
+import json
+import os
+
+from hydrant.util import FIXEDPATHS, user_lock
+
+CACHEDIR = os.path.join(FIXEDPATHS.USERDIR, 'cache')
+
+def cache_key(*parts):
+    '''Hash any number of strings or byte strings into a cache key'''
+    key = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        key.update(hashlib.sha256(part).digest())
+    return key.hexdigest()
+
+def file_identity(path):
+    '''Absolute path, size and modification time of path, as a string'''
+    st = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), st.st_size, st.st_mtime)
+
+class FileCache(object):
+    '''
+    Least recently used cache of JSON-serializable values stored as files.
+    Reading an entry updates its modification time, which determines the
+    order of eviction.
+    '''
+
+    def __init__(self, name, max_entries=256):
+        self.name = name
+        self.path = os.path.join(CACHEDIR, name)
+        self.max_entries = max_entries
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        entry = self._entry(key)
+        try:
+            with open(entry) as entry_file:
+                value = json.load(entry_file)
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return value
+
+    def put(self, key, value):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+        entry = self._entry(key)
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        with open(tmp, 'w') as entry_file:
+            json.dump(value, entry_file)
+        # Eviction by concurrent writers could otherwise remove each other's
+        # new entries
+        with user_lock('cache-' + self.name):
+            os.rename(tmp, entry)
+            self.prune()
+
+    def entries(self):
+        '''Paths of all entries, least recently used first'''
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if name.endswith('.json'):
+                entry = os.path.join(self.path, name)
+                try:
+                    entries.append((os.path.getmtime(entry), entry))
+                except OSError:
+                    pass # Removed by another process
+        return [entry for _, entry in sorted(entries)]
+
+    def prune(self, max_entries=None):
+        '''Evict the least recently used entries beyond max_entries'''
+        if max_entries is None:
+            max_entries = self.max_entries
+        entries = self.entries()
+        for entry in entries[:max(0, len(entries) - max_entries)]:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+
+    def clear(self):
+        self.prune(0)
@@ -1,24 +1,61 @@
 #! /usr/bin/env python
 # encoding: utf-8
 
-import os
+from collections import OrderedDict
+import importlib
+import logging
+import sys
 
 from hydrant.ConfigLoader import ConfigLoader
-from hydrant.util import ArgParser, initialize_user_dir, initialize_logging, log_to_logfile, version
+from hydrant.util import ArgParser, LockTimeout, initialize_user_dir, initialize_logging, log_to_logfile, version
 
 
 __version__ = "TESTING"
 
+# Subcommand descriptions are kept here so that building the top-level parser
+# does not require importing every subcommand module (and with them docker,
+# firecloud, requests, etc.). Each must match the Description of its module.
+COMMANDS = OrderedDict([
+    ('init',     "Create dir & templates for authoring tasks & workflows"),
+    ('build',    "Build docker image defined in the local Dockerfile"),
+    ('push',     "Push local Docker image to remote repository"),
+    ('validate', "Verify syntax of WDL workflow and generate test json"),
+    ('test',     "Run local Cromwell on workflow, with each of tests/*.json"),
+    ('tutorial', "Show general flow of hydrant use cases, by example"),
+    ('sync',     "Update WDLs of local workflows which use this Docker"),
+    ('install',  "Installs workflow(s) into the FC method repository"),
+    ('config',   "Update FC method configurations for this workflow")
+])
+
+class LazyCommand(object):
+    '''
+    Stand-in for a subcommand's main function, which only imports the
+    subcommand module when it is actually run.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, argv=None):
+        mod = importlib.import_module('hydrant.' + self.name)
+        return mod.main(argv)
+
 def install_commands(parsers, commands):
-    import importlib
     for cmd in commands:
-        prefix = "." if os.path.exists(cmd + ".py") else "hydrant."
-        mod = importlib.import_module(prefix + cmd)
-        parser = parsers.add_parser(cmd, help=mod.Description, add_help=False)
-        parser.set_defaults(func=mod.main)
+        parser = parsers.add_parser(cmd, help=COMMANDS[cmd], add_help=False)
+        parser.set_defaults(func=LazyCommand(cmd))
 
 def main(args=None):
     initialize_logging()
+    try:
+        _main(args)
+    except LockTimeout as e:
+        logging.error("%s. Another hydrant process may be stuck, or has " +
+                      "been waiting on a slow download or build; try again " +
+                      "once it has finished.", e)
+        sys.exit(75) # sysexits.h TEMPFAIL exit status
+
+def _main(args):
     initialize_user_dir()
     logfile = ConfigLoader().config.All.Logfile
     if logfile is not None:
@@ -32,8 +69,7 @@ def main(args=None):
 
     subparsers = parser.add_subparsers(dest='subcmd')
     subparsers.required = True
-    install_commands(subparsers, ['init', 'build', 'push', 'validate', 'test'])
-    install_commands(subparsers, ['tutorial', 'sync', 'install', 'config'])
+    install_commands(subparsers, COMMANDS)
 
     args, argv = parser.parse_known_args(args)
     args.func(argv)
@@ -0,0 +1,328 @@
+# encoding: utf-8
+
+'''
+Run a local Cromwell in server mode, kept alive across hydrant invocations,
+and submit workflows to it through its REST API. The server runs detached in
+~/.hydrant/cromwell-server, which also holds its executions and log, and
+stays up until stop_server is called.
+
+Also manages the Cromwell configuration hydrant uses for call caching, which
+keeps its database in ~/.hydrant/call-cache.
+'''
+
+import errno
+import io
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import time
+import zipfile
+from contextlib import contextmanager
+
+from hydrant.util import FIXEDPATHS, LockTimeout, user_lock
+
+SERVER_DIR = os.path.join(FIXEDPATHS.USERDIR, 'cromwell-server')
+SERVER_STATE = os.path.join(SERVER_DIR, 'server.json')
+EXECUTIONS = os.path.join(SERVER_DIR, 'cromwell-executions')
+DEFAULT_PORT = 8000
+START_TIMEOUT = 180  # seconds to wait for a new server to accept requests
+STOP_TIMEOUT = 60    # seconds to wait for the server to exit before killing it
+POLL_INTERVAL = 5    # seconds between workflow status requests
+TERMINAL_STATES = ('Succeeded', 'Failed', 'Aborted')
+API = '/api/workflows/v1'
+
+CONFIG = os.path.join(FIXEDPATHS.USERDIR, 'cromwell.conf')
+CALL_CACHE_DIR = os.path.join(FIXEDPATHS.USERDIR, 'call-cache')
+CONFIG_TEMPLATE = '''# Generated by hydrant, changes will be overwritten
+include required(classpath("application"))
+
+call-caching {{
+  enabled = true
+  invalidate-bad-cache-results = true
+}}
+
+# Images are built locally, so hash them without consulting a registry
+docker.hash-lookup.method = "local"
+
+database {{
+  profile = "slick.jdbc.HsqldbProfile$"
+  db {{
+    driver = "org.hsqldb.jdbcDriver"
+    url = "jdbc:hsqldb:file:{database};shutdown=false;hsqldb.default_table_type=cached;hsqldb.tx=mvcc;hsqldb.result_max_memory_rows=10000;hsqldb.large_data=true;hsqldb.applog=1;hsqldb.lob_compressed=true;hsqldb.script_format=3"
+    connectionTimeout = 120000
+    numThreads = 1
+  }}
+}}
+'''
+
+class CromwellServerError(Exception):
+    pass
+
+def write_config():
+    '''Generate the call caching configuration, if not up to date, and
+    return its path'''
+    config = CONFIG_TEMPLATE.format(database=os.path.join(CALL_CACHE_DIR,
+                                                          'cromwell-db'))
+    try:
+        with open(CONFIG) as config_file:
+            if config_file.read() == config:
+                return CONFIG
+    except (IOError, OSError):
+        pass
+    with user_lock('cromwell-config'):
+        with open(CONFIG + '.tmp', 'w') as config_file:
+            config_file.write(config)
+        os.rename(CONFIG + '.tmp', CONFIG)
+    return CONFIG
+
+@contextmanager
+def call_cache_lock(needed=True):
+    '''
+    Hold the call cache database for a Cromwell run outside of the server,
+    as only one Cromwell can open it at a time. Yields whether it was
+    acquired, i.e. False if another process is using it (or not needed).
+    '''
+    if not needed:
+        yield False
+        return
+    lock = user_lock('call-cache', timeout=0)
+    try:
+        lock.__enter__()
+    except LockTimeout:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        lock.__exit__(None, None, None)
+
+def _disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def call_cache_size():
+    '''Bytes used by the call cache database and by the server executions
+    which cached results may be copied from'''
+    return _disk_usage(CALL_CACHE_DIR), _disk_usage(EXECUTIONS)
+
+def prune_call_cache():
+    '''Remove the call cache database and the server executions, stopping
+    the server first, as it holds the database open. Returns bytes freed.'''
+    # Keep ensure_server from starting another server until done
+    with user_lock('cromwell-server'):
+        stop_server()
+        freed = sum(call_cache_size())
+        for path in (CALL_CACHE_DIR, EXECUTIONS):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+    return freed
+
+def server_url(port=DEFAULT_PORT):
+    return 'http://localhost:{}'.format(port)
+
+def _get(url, path, **kwargs):
+    import requests
+    response = requests.get(url + path, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+def server_version(url):
+    '''Version of the Cromwell server at url, or None if not reachable'''
+    import requests
+    try:
+        return _get(url, '/engine/v1/version', timeout=5).get('cromwell')
+    except (requests.RequestException, ValueError):
+        return None
+
+def load_state():
+    try:
+        with open(SERVER_STATE) as state:
+            return json.load(state)
+    except (IOError, OSError, ValueError):
+        return None
+
+def start_server(jar, port=DEFAULT_PORT):
+    '''Launch a detached Cromwell server and wait until it accepts
+    requests, returning its url'''
+    url = server_url(port)
+    if not os.path.isdir(SERVER_DIR):
+        os.makedirs(SERVER_DIR)
+    command = ['java', '-Dconfig.file=' + write_config(),
+               '-Dwebservice.port={}'.format(port),
+               '-Dwebservice.interface=127.0.0.1', '-jar', jar, 'server']
+    logging.info("Starting Cromwell server on port %d (log: %s)", port,
+                 os.path.join(SERVER_DIR, 'server.log'))
+    with open(os.devnull, 'rb') as devnull, \
+         open(os.path.join(SERVER_DIR, 'server.log'), 'ab') as log:
+        server = subprocess.Popen(command, cwd=SERVER_DIR, stdin=devnull,
+                                  stdout=log, stderr=subprocess.STDOUT,
+                                  close_fds=True, preexec_fn=os.setsid)
+    with open(SERVER_STATE + '.tmp', 'w') as state:
+        json.dump({'pid': server.pid, 'port': port,
+                   'jar': os.path.abspath(jar)}, state)
+    os.rename(SERVER_STATE + '.tmp', SERVER_STATE)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline and server.poll() is None:
+        if server_version(url) is not None:
+            return url
+        time.sleep(1)
+    if server.poll() is None:
+        server.kill()
+    os.remove(SERVER_STATE)
+    raise CromwellServerError("Cromwell server did not start, see " +
+                              os.path.join(SERVER_DIR, 'server.log'))
+
+def running_server():
+    '''Url of the server started by hydrant, or None if not running'''
+    state = load_state()
+    if state is None or server_version(server_url(state['port'])) is None:
+        return None
+    return server_url(state['port'])
+
+def ensure_server(jar, port=DEFAULT_PORT):
+    '''Url of the running Cromwell server, starting one if necessary'''
+    url = server_url(port)
+    version = server_version(url)
+    if version is None:
+        # Only one process starts the server, the others wait and use it
+        with user_lock('cromwell-server'):
+            version = server_version(url)
+            if version is None:
+                return start_server(jar, port)
+    logging.info("Using Cromwell %s server at %s", version, url)
+    return url
+
+def _is_server(state):
+    '''Whether the process recorded in state is still the server hydrant
+    started, rather than a process which has since reused its pid'''
+    cmdline = '/proc/{}/cmdline'.format(state['pid'])
+    if os.path.exists('/proc/self/cmdline'):
+        try:
+            with open(cmdline, 'rb') as cmdline_file:
+                args = cmdline_file.read().split(b'\0')
+        except (IOError, OSError):
+            return False
+        return state['jar'].encode('utf-8') in args
+    return server_version(server_url(state['port'])) is not None
+
+def _wait_for_exit(pid, timeout):
+    '''Wait up to timeout seconds for pid to exit, returning whether it did'''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            # Reap the server, if started by this process
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return True
+        except OSError:
+            pass # Not a child of this process
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+
+def stop_server(timeout=STOP_TIMEOUT):
+    '''Shut down the server started by hydrant, if any, and wait for it to
+    exit, killing it if it has not within timeout seconds'''
+    state = load_state()
+    if state is None:
+        return
+    pid = state['pid']
+    if _is_server(state):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            if not _wait_for_exit(pid, timeout):
+                logging.warning("Cromwell server did not exit within %ds, " +
+                                "killing it", timeout)
+                os.kill(pid, signal.SIGKILL)
+                _wait_for_exit(pid, timeout)
+            logging.info("Stopped Cromwell server on port %d", state['port'])
+        except OSError:
+            pass # Already gone
+    os.remove(SERVER_STATE)
+
+def workflow_dependencies(wdl):
+    '''
+    Zip of the local WDLs imported by wdl, directly or not, at their paths
+    relative to its directory, from which the server resolves its imports.
+    Returns None if wdl imports no local WDLs (those imported by url are
+    fetched by the server itself).
+    '''
+    from hydrant.WDL import resolve_imports
+    imports = resolve_imports(wdl)
+    base = os.path.dirname(imports.root)
+    local = [location for location in imports.wdls
+             if location != imports.root and
+             not location.startswith(('http://', 'https://'))]
+    if not local:
+        return None
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as dependencies:
+        for location in local:
+            relpath = os.path.relpath(location, base)
+            if relpath.split(os.sep, 1)[0] == os.pardir:
+                raise CromwellServerError("{} imports {}, which is outside " \
+                                          "its directory and cannot be " \
+                                          "submitted to the server".format(
+                                          wdl, location))
+            dependencies.write(location, relpath)
+    return data.getvalue()
+
+def submit_workflow(url, wdl, inputs_json, options):
+    '''Submit a workflow, along with any WDLs it imports, to the server,
+    returning its id'''
+    import requests
+    dependencies = workflow_dependencies(wdl)
+    with open(wdl, 'rb') as source, open(inputs_json, 'rb') as inputs, \
+         open(options, 'rb') as opts:
+        files = {
+            'workflowSource': source,
+            'workflowInputs': inputs,
+            'workflowOptions': opts
+        }
+        if dependencies is not None:
+            files['workflowDependencies'] = ('dependencies.zip', dependencies,
+                                             'application/zip')
+        response = requests.post(url + API, files=files)
+    response.raise_for_status()
+    return response.json()['id']
+
+def workflow_status(url, workflow_id):
+    return _get(url, '{}/{}/status'.format(API, workflow_id))['status']
+
+def wait_for_workflow(url, workflow_id, interval=POLL_INTERVAL):
+    '''Poll the status of a workflow until it finishes, returning its
+    final status'''
+    status = workflow_status(url, workflow_id)
+    while status not in TERMINAL_STATES:
+        time.sleep(interval)
+        status = workflow_status(url, workflow_id)
+    return status
+
+def workflow_outputs(url, workflow_id):
+    return _get(url, '{}/{}/outputs'.format(API, workflow_id))['outputs']
+
+def workflow_metadata(url, workflow_id):
+    return _get(url, '{}/{}/metadata'.format(API, workflow_id),
+                params={'expandSubWorkflows': 'true'})
+
+def failure_messages(failures):
+    '''Flatten the nested failures of workflow metadata into messages'''
+    messages = []
+    for failure in failures or []:
+        if failure.get('message'):
+            messages.append(failure['message'])
+        messages.extend(failure_messages(failure.get('causedBy')))
+    return messages
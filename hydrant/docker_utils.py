@@ -1,27 +1,58 @@
 # encoding: utf-8
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from io import open
+import json
 import os
 import platform
 import subprocess
 import sys
 import time
 import logging
+from threading import Lock
 
 import docker
+from docker.utils.config import find_config_file
 from firecloud import which
 from hydrant.ConfigLoader import ConfigLoader
+from hydrant.util import FIXEDPATHS, user_lock
 from six import u
 
 # Convenient shorthands for readability
 from docker.errors import APIError as apiError
 from requests.exceptions import ConnectionError as connError
 
-# Add credential helpers if they're missing
-if which('docker') is not None:
-    credHelpers = docker.auth.load_config().get('credHelpers')
-    if not credHelpers or \
-       sum(helper.endswith('gcr.io') for helper in credHelpers) == 0:
+CREDENTIAL_CACHE = os.path.join(FIXEDPATHS.USERDIR, 'credential_helpers.json')
+
+def _docker_config_stamp():
+    '''Path and modification time of the Docker client config file'''
+    config_file = find_config_file()
+    if config_file is None:
+        return None, None
+    return config_file, os.path.getmtime(config_file)
+
+def configure_credential_helpers():
+    '''
+    Add credential helpers for gcr.io if they're missing. Success is cached
+    in the user directory, keyed by the Docker config file's modification
+    time, so the check is only repeated when the config changes. Failures
+    are not, so that installing or authenticating gcloud takes effect.
+    '''
+    if which('docker') is None:
+        return
+    config_file, mtime = _docker_config_stamp()
+    try:
+        with open(CREDENTIAL_CACHE) as cache_file:
+            cached = json.load(cache_file)
+        if cached['config'] == config_file and cached['mtime'] == mtime:
+            return cached['configured']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    credHelpers = docker.auth.load_config(config_file).get('credHelpers')
+    configured = bool(credHelpers) and \
+                 sum(helper.endswith('gcr.io') for helper in credHelpers) > 0
+    if not configured:
         logging.info("Credential helpers for gcr.io not found. Attempting to" +
                      " install.")
         try:
@@ -29,9 +60,122 @@ if which('docker') is not None:
                                               'configure-docker', '--quiet'],
                                              stderr=subprocess.STDOUT)
             logging.info(output.decode('utf-8'))
+            configured = True
         except subprocess.CalledProcessError as cpe:
             logging.warning(u' '.join(cpe.cmd) + u":\n\t" +
                             cpe.output.decode('utf-8'))
+        except OSError as e:
+            logging.warning("Unable to run gcloud: %s", e)
+        # gcloud may have created or modified the config
+        config_file, mtime = _docker_config_stamp()
+    if not configured:
+        return False
+
+    with user_lock('credential-helpers'):
+        with open(CREDENTIAL_CACHE + '.tmp', 'w') as cache_file:
+            cache_file.write(u(json.dumps({'config': config_file,
+                                           'mtime': mtime,
+                                           'configured': configured})))
+        os.rename(CREDENTIAL_CACHE + '.tmp', CREDENTIAL_CACHE)
+    return configured
+
+RepoImages = namedtuple('RepoImages', 'registries namespaces tags ids')
+
+# Registries which image names refer to implicitly when they have none
+DEFAULT_REGISTRIES = ('docker.io', 'index.docker.io',
+                      'registry.hub.docker.com')
+
+def split_tag(full_tag):
+    '''Split [registry/]namespace/repo[:tag] into name and tag (or None)'''
+    if ':' in full_tag.rsplit('/', 1)[-1]:
+        return tuple(full_tag.rsplit(':', 1))
+    return full_tag, None
+
+def split_full_tag(full_tag):
+    '''Split [registry/]namespace/repo[:tag] into its four components'''
+    name, tag = split_tag(full_tag)
+    chunks = name.split('/')
+    registry = chunks[0] if len(chunks) == 3 else None
+    namespace = chunks[-2] if len(chunks) > 1 else None
+    return registry, namespace, chunks[-1], tag
+
+def strip_default_registry(name):
+    '''Image name without any explicit default (Docker Hub) registry'''
+    registry, _, rest = name.partition('/')
+    if rest and registry in DEFAULT_REGISTRIES:
+        return rest
+    return name
+
+class ImageIndex(object):
+    '''
+    Index of locally tagged images by repository name. Images are listed from
+    the daemon filtered by reference, and only for repositories not already
+    covered by an earlier listing, so that hosts with thousands of cached
+    images need not be scanned repeatedly.
+    '''
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = Lock()
+        self._repos = defaultdict(dict)
+        self._covered = set()
+
+    def _list(self, repos):
+        references = [pattern % repo for repo in repos
+                      for pattern in ('*/%s', '*/*/%s')]
+        for image in self._client.api.images(filters={'reference':
+                                                      references}):
+            for full_tag in image.get('RepoTags') or []:
+                self._add(full_tag, image['Id'])
+
+    def _add(self, full_tag, image_id):
+        registry, namespace, repo, tag = split_full_tag(full_tag)
+        if namespace is not None and tag is not None:
+            self._repos[repo][full_tag] = (registry, namespace, image_id)
+
+    def add(self, full_tag, image_id):
+        '''Record a newly built or tagged image'''
+        with self._lock:
+            self._add(full_tag, image_id)
+
+    def update(self, repos):
+        '''Ensure that the given repositories have been indexed'''
+        with self._lock:
+            repos = set(repos) - self._covered
+            if repos:
+                self._list(sorted(repos))
+                self._covered.update(repos)
+
+    def lookup(self, repo):
+        '''RepoImages holding the local registries, namespaces, full tags
+        (mapped to image ids) and image ids of the given repository'''
+        self.update([repo])
+        with self._lock:
+            images = dict(self._repos.get(repo, {}))
+        return RepoImages(
+            set(registry for registry, _, _ in images.values()
+                if registry is not None),
+            set(namespace for _, namespace, _ in images.values()),
+            dict((full_tag, image_id) for full_tag, (_, _, image_id)
+                 in images.items()),
+            set(image_id for _, _, image_id in images.values()))
+
+    def image_id(self, full_tag):
+        '''Id of the image with the given full tag, or None if not local'''
+        return self.lookup(split_full_tag(full_tag)[2]).tags.get(full_tag)
+
+_IMAGE_INDEXES = dict()
+_IMAGE_INDEXES_LOCK = Lock()
+
+def image_index(client, repos=None):
+    '''Process-wide ImageIndex for client, covering at least repos'''
+    with _IMAGE_INDEXES_LOCK:
+        index = _IMAGE_INDEXES.get(id(client))
+        if index is None or index._client is not client:
+            index = _IMAGE_INDEXES[id(client)] = ImageIndex(client)
+    if repos:
+        index.update(repos)
+    return index
 
 def get_version(path):
     return ConfigLoader(path).config.Docker.Tag or 'latest'
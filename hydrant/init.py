@@ -9,7 +9,8 @@ from shutil import copy2 as cp, copytree as copydir
 import sys
 
 from hydrant.ConfigLoader import ConfigLoader, SafeConfigParser, DockerSection
-from hydrant.WDL import WDL
+from hydrant.WDL import WDLImportError, WDLSyntaxError, load_wdl, \
+                        resolve_imports
 from hydrant.util import ArgParser, FIXEDPATHS, initialize_logging
 
 sys.path.append(FIXEDPATHS.USERDIR)
@@ -28,14 +29,17 @@ def new_folder(folder_name):
 
 def user_task(flow_task):
     try:
-        flow, task = flow_task.split('.')
+        flow, task = flow_task.split('.', 1)
     except ValueError:
         raise ArgumentTypeError("{} is not in expected ".format(flow_task) +
-                                "format of <workflow>.<task|*>")
+                                "format of <workflow>.[<import>.]<task|*>")
     flow_path = os.path.join(os.getcwd(), flow, flow + '.wdl')
     if not os.path.exists(flow_path):
         raise ArgumentTypeError("Unable to locate {}".format(flow_path))
-    wdl = WDL(flow_path)
+    try:
+        wdl = load_wdl(flow_path)
+    except WDLSyntaxError as e:
+        raise ArgumentTypeError("Unable to parse {}: {}".format(flow_path, e))
     
     if task == '*':
         return UserTaskList(flow, wdl.tasks.values())
@@ -43,6 +47,21 @@ def user_task(flow_task):
     if task in wdl.tasks:
         return UserTaskList(flow, [wdl.tasks[task]])
     
+    if '.' in task:
+        # Task of an imported WDL, by namespace
+        try:
+            tasks = resolve_imports(flow_path).tasks
+        except WDLImportError as e:
+            raise ArgumentTypeError(str(e))
+        namespace, _, name = task.rpartition('.')
+        if name == '*':
+            matches = [imported for qualified, imported in tasks.items()
+                       if qualified.rpartition('.')[0] == namespace]
+            if matches:
+                return UserTaskList(flow, matches)
+        elif task in tasks:
+            return UserTaskList(flow, [tasks[task]])
+    
     raise ArgumentTypeError("Unable to locate {} in {}".format(task, flow))
 
 def task_config(cli_cfg):
@@ -277,7 +296,9 @@ def main(args=None):
                         help='Name of existing locally written task to ' +
                              'initialize with in the format of ' +
                              '<workflow>.<task|*>, with "<workflow>.*" ' +
-                             'indicating all tasks in <workflow>')
+                             'indicating all tasks in <workflow>; tasks ' +
+                             'of WDLs imported by <workflow> are given as ' +
+                             '<workflow>.<import alias>.<task|*>')
     
     args = parser.parse_args(args)
     user_tasks = process_user_tasks(args.task, args.workflow)
@@ -5,70 +5,193 @@ import os
 import sys
 import logging
 import json
+import time
+from collections import namedtuple
+from threading import Lock
+from docker.errors import APIError, ImageNotFound
 from six.moves import input
 from getpass import getpass
-from hydrant.util import ArgParser, add_default_arg, initialize_logging
-from hydrant.docker_utils import connect_to_daemon
+from hydrant.util import ArgParser, flush_logging, initialize_logging, \
+                         log_table, run_parallel
+from hydrant.docker_utils import docker_repos, connect_to_daemon, \
+                                 configure_credential_helpers, image_index, \
+                                 split_full_tag, strip_default_registry
 from hydrant.ConfigLoader import ConfigLoader
 
 Description = "Push local Docker image to remote repository"
 
+# Minimum number of seconds between aggregated progress messages per image
+PROGRESS_INTERVAL = 5
+
+# Only one push at a time may prompt the user for credentials, which are then
+# reused by the other pushes to the same registry (None for Docker Hub)
+_LOGIN_LOCK = Lock()
+_LOGINS = dict()
+
+PushedTag = namedtuple('PushedTag', 'tag digest size status')
+
+class PushError(Exception):
+    pass
+
 def find_registry_namespace(client, repo, config, error_on_fail=False):
     '''If a unique registry and/or namespace exists for the given repo in
     the locally tagged images, override any config settings'''
     # TODO: tag the image with user-set registry and/or namespace via either
     #       hydrant.cfg or CLI args before push
-    repo_images = [tag for image in client.images.list() \
-                   for tag in image.tags if '/' + repo + ':' in tag]
-    namespaces = set(image.split('/')[-2] for image in repo_images)
-    registries = set(image.split('/')[0] for image in repo_images
-                     if image.count('/') == 2)
+    repo_images = image_index(client).lookup(repo)
     registry = config.Registry
     namespace = config.Namespace
-    if len(registries) == 1:
-        registry = registries.pop()
-    if len(namespaces) == 1:
-        namespace = namespaces.pop()
+    if len(repo_images.registries) == 1:
+        registry = next(iter(repo_images.registries))
+    if len(repo_images.namespaces) == 1:
+        namespace = next(iter(repo_images.namespaces))
     return registry, namespace
 
-def push_image(client, repo, kwargs):
-    for line in client.images.push(repo, **kwargs):
-        line = line.decode('utf-8')
-        for result in line.splitlines():
-            if 'errorDetail' in result:
-                result = json.dumps(json.loads(result), indent=2)
-                error = ''
-                for err_line in result.splitlines(True):
-                    linebrk = err_line.find(r'errors:\n')
-                    if linebrk >= 0:
-                        brkcnt = err_line.count(r'\n')
-                        err_line = err_line.replace(r'\n', ' ', 1)
-                        err_line = err_line.replace(r'\n',
-                                                    '\n' + ' ' * (linebrk + 8),
-                                                    brkcnt - 2)
-                        err_line = err_line.replace(r'\n', '')
-                    error += err_line
-                logging.error(error)
-                if 'unauthorized' in error:
-                    logging.warning("No valid authentication credentials " +
-                                    "found for %s. Please enter credentials " +
-                                    "below. In order to avoid this in the " +
-                                    "future, please log in to your Docker " +
-                                    "Client.", repo)
-                    kwargs = docker_login(kwargs)
-                    push_image(client, repo, kwargs)
-            else:
-                logging.info(result)
+def format_error(result):
+    result = json.dumps(result, indent=2)
+    error = ''
+    for err_line in result.splitlines(True):
+        linebrk = err_line.find(r'errors:\n')
+        if linebrk >= 0:
+            brkcnt = err_line.count(r'\n')
+            err_line = err_line.replace(r'\n', ' ', 1)
+            err_line = err_line.replace(r'\n', '\n' + ' ' * (linebrk + 8),
+                                        brkcnt - 2)
+            err_line = err_line.replace(r'\n', '')
+        error += err_line
+    return error
+
+def remote_digest(client, repo, tag, auth_config=None):
+    '''Digest of repo:tag in its remote registry, or None if not found'''
+    try:
+        data = client.images.get_registry_data(repo + ':' + tag, auth_config)
+        return data.id
+    except APIError:
+        return None
+
+def up_to_date_digest(client, repo, tag, auth_config=None):
+    '''
+    If the local image repo:tag was previously pushed to or pulled from the
+    registry, and the remote tag still refers to that same image, return its
+    digest. Otherwise return None.
+    '''
+    try:
+        image = client.images.get(repo + ':' + tag)
+    except ImageNotFound:
+        return None
+    repo = strip_default_registry(repo)
+    local_digests = set(digest for name, _, digest in
+                        (repo_digest.partition('@') for repo_digest in
+                         image.attrs.get('RepoDigests') or [])
+                        if strip_default_registry(name) == repo)
+    if not local_digests:
+        return None
+    digest = remote_digest(client, repo, tag, auth_config)
+    return digest if digest in local_digests else None
+
+def push_image(client, repo, kwargs, force=False):
+    '''
+    Push repo, logging progress aggregated across its layers. Returns a list
+    of PushedTags, one for each tag pushed. Unless force is set, a tag which
+    the registry already holds is skipped and reported as up to date.
+    '''
+    name = repo.rsplit('/', 1)[-1]
+    if kwargs.get('tag'):
+        name += ':' + kwargs['tag']
+        if not force:
+            digest = up_to_date_digest(client, repo, kwargs['tag'],
+                                       kwargs.get('auth_config'))
+            if digest is not None:
+                logging.info("[%s] %s is up to date", name, digest)
+                return [PushedTag(kwargs['tag'], digest, None, 'up to date')]
+    layers = dict()
+    pushed = []
+    last_progress = time.time()
+    for result in client.images.push(repo, stream=True, decode=True,
+                                     **kwargs):
+        if 'errorDetail' in result:
+            error = format_error(result)
+            if 'unauthorized' in error:
+                registry = split_full_tag(strip_default_registry(repo))[0]
+                with _LOGIN_LOCK:
+                    auth_config = _LOGINS.get(registry)
+                    if auth_config is not None and \
+                       auth_config != kwargs.get('auth_config'):
+                        # Another push already logged in to the registry
+                        kwargs = dict(kwargs, auth_config=auth_config)
+                    else:
+                        logging.warning("No valid authentication " +
+                                        "credentials found for %s. Please " +
+                                        "enter credentials below. In order " +
+                                        "to avoid this in the future, please " +
+                                        "log in to your Docker Client.", repo)
+                        kwargs = docker_login(kwargs)
+                        _LOGINS[registry] = kwargs['auth_config']
+                return push_image(client, repo, kwargs, force)
+            raise PushError(error)
+        elif 'aux' in result:
+            aux = result['aux']
+            pushed.append(PushedTag(aux.get('Tag'), aux.get('Digest'),
+                                    aux.get('Size'), 'ok'))
+        elif 'id' in result:
+            # Layer event: only report changes in status, not every tick
+            layer = layers.setdefault(result['id'], {'status': None})
+            status = result.get('status')
+            if status != layer['status']:
+                layer['status'] = status
+                if status != 'Pushing':
+                    logging.info("[%s] %s: %s", name, result['id'], status)
+            progress = result.get('progressDetail') or {}
+            if 'total' in progress:
+                layer['current'] = progress.get('current', 0)
+                layer['total'] = progress['total']
+            if time.time() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.time()
+                current = sum(lyr.get('current', 0) for lyr in layers.values())
+                total = sum(lyr.get('total', 0) for lyr in layers.values())
+                if total:
+                    logging.info("[%s] pushed %.1f of %.1f MB", name,
+                                 current / 1e6, total / 1e6)
+        elif 'status' in result:
+            logging.info("[%s] %s", name, result['status'])
+    return pushed
 
 def docker_login(kwargs):
+    flush_logging()
     kwargs['auth_config'] = {'username': input("Username: "),
                              'email': input("Email: "),
                              'password': getpass()}
     return kwargs
 
+def push_images(client, pushes, jobs=1, fail_fast=False, force=False):
+    '''
+    Push (repo, tag) pairs concurrently with up to jobs pushes at a time, then
+    log a table of the resulting digests and sizes. A tag of None pushes all
+    local tags of the repo. Returns True if all pushes succeeded.
+    '''
+    results = run_parallel(push_image,
+                           [(repo, (client, repo,
+                                    {'tag': tag} if tag else {}, force))
+                            for repo, tag in pushes],
+                           jobs, fail_fast)
+    rows = []
+    for (repo, tag), result in zip(pushes, results):
+        if result.error is not None:
+            rows.append((repo, tag or '', '', '',
+                         '{:.1f}s'.format(result.duration),
+                         'cancelled' if result.error == 'cancelled' else
+                         'FAILED'))
+            continue
+        for pushed in result.result or [PushedTag(tag, '', '', 'ok')]:
+            rows.append((repo, pushed.tag or '', pushed.digest or '',
+                         pushed.size or '', '{:.1f}s'.format(result.duration),
+                         pushed.status))
+    log_table(['Image', 'Tag', 'Digest', 'Size', 'Duration', 'Result'], rows)
+    return all(result.error is None for result in results)
+
 def main(args=None):
-    # TODO: allow bulk pushes from the workspace level like with build
     docker_cfg = ConfigLoader().config.Docker
+    repos = {os.path.basename(path): path for path, _ in docker_repos()}
     parser = ArgParser(description=Description)
 
     # Because parser.prog is initialized to the name of the top-level calling
@@ -77,48 +200,65 @@ def main(args=None):
     # hydrant docker push rather than only hydrant)
     if __name__ != '__main__':
         parser.prog += " " + __name__.rsplit('.', 1)[-1]
-        
+
     repo = os.path.basename(os.getcwd())
-    
+
+    parser.add_argument('-R', '--registry',
+                        help="Host[:port] of registry if not at Docker Hub " +
+                             "(default: from local images, then hydrant.cfg)")
+    parser.add_argument('-n', '--namespace',
+                        help='Namespace under which the repository resides ' +
+                             '(default: from local images, then hydrant.cfg)')
+    parser.add_argument('-r', '--repository', nargs='+', default=[repo],
+                        help='Repository name(s)[:tag] (default: %(default)s)')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help="Push the images of all tasks in this workflow")
+    parser.add_argument('-t', '--tag', help="Version of the image or task, " + \
+                        "unless given with the repository (default: from " + \
+                        "each task's hydrant.cfg, else all local tags)")
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help="Number of images to push concurrently " +
+                             "(default: %(default)s)")
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="Stop starting new pushes once one has failed")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Push even if the registry already holds the " +
+                             "same image")
+
+    args = parser.parse_args(args)
+    user_repos = sorted(repos) if args.all else args.repository
+
     client = connect_to_daemon()
-    
-    try:
-        registry, namespace = find_registry_namespace(client, repo, docker_cfg)
-    except Exception as e:
-        logging.exception(str(e))
+    configure_credential_helpers()
+    image_index(client, [user_repo.partition(':')[0]
+                         for user_repo in user_repos])
+
+    pushes = []
+    for user_repo in user_repos:
+        repo, _, tag = user_repo.partition(':')
+        repo_cfg = docker_cfg
+        if repo in repos:
+            repo_cfg = ConfigLoader(repos[repo]).config.Docker
+        try:
+            registry, namespace = find_registry_namespace(client, repo,
+                                                          repo_cfg)
+        except Exception as e:
+            logging.exception(str(e))
+            sys.exit(1)
+        registry = args.registry or registry or repo_cfg.Registry
+        namespace = args.namespace or namespace or repo_cfg.Namespace
+        if namespace is None:
+            logging.error("No namespace found for %s. Please specify one " +
+                          "with -n or in hydrant.cfg.", repo)
+            sys.exit(1)
+
+        full_repo = namespace + '/' + repo
+        if registry is not None:
+            full_repo = registry + '/' + full_repo
+        pushes.append((full_repo, tag or args.tag or repo_cfg.Tag))
+
+    if not push_images(client, pushes, args.jobs, args.fail_fast, args.force):
         sys.exit(1)
-        
-    registry = registry or docker_cfg.Registry
-    namespace = namespace or docker_cfg.Namespace
-    
-    reg_kwargs = {'help': "Host[:port] of registry if not at Docker Hub"}
-    if registry is not None:
-        add_default_arg(registry, reg_kwargs)
-    parser.add_argument('-R', '--registry', **reg_kwargs)
-    
-    ns_kwargs = {'help': 'Namespace under which the repository resides'}
-    if namespace is None:
-        ns_kwargs['required'] = True
-    else:
-        add_default_arg(namespace, ns_kwargs)
-    parser.add_argument('-n', '--namespace', **ns_kwargs)
-    parser.add_argument('-r', '--repository', default=repo,
-                        help='Repository name (default: %(default)s)')
-    tag = docker_cfg.Tag
-    parser.add_argument('-t', '--tag', help="Version of the image or task " + \
-                        "(default: {})".format(tag or 'latest'), default=tag)
-    
-    args = parser.parse_args(args)
-    
-    repo = args.namespace + '/' + args.repository
-    if args.registry is not None:
-        repo = args.registry + '/' + repo
-    
-    push_kwargs = {'stream': True}
-    if args.tag is not None:
-        push_kwargs['tag'] = args.tag
-    
-    push_image(client, repo, push_kwargs)        
 
 if __name__ == '__main__':
     initialize_logging()
@@ -3,14 +3,220 @@
 
 import os
 import sys
+import json
+import shutil
+import hashlib
 import logging
-from hydrant.util import ArgParser, initialize_logging
-from argparse import ArgumentTypeError
+from collections import defaultdict
+from hydrant.util import ArgParser, FIXEDPATHS, initialize_logging, log_table
+from hydrant.ConfigLoader import ConfigLoader
+from hydrant.docker_utils import docker_repos, split_tag, \
+                                 strip_default_registry
+from hydrant.WDL import WDLSyntaxError, load_wdl
 
 Description = 'Update WDLs of local workflows which use this Docker'
 
-def sync():
-    logging.info("The sync command is not implemented yet")
+# Reverse indexes of the docker images used by the WDLs below a root
+# directory, one per root
+SYNC_DIR = os.path.join(FIXEDPATHS.USERDIR, 'sync')
+INDEX_FORMAT = 1
+# Directories which never hold workflows, but may hold many files
+SKIP_DIRS = frozenset(['cromwell-executions', 'cromwell-workflow-logs'])
+
+def index_path(root):
+    key = hashlib.sha1(root.encode('utf-8')).hexdigest()
+    return os.path.join(SYNC_DIR, key + '.json')
+
+def load_index(root):
+    try:
+        with open(index_path(root)) as index_file:
+            index = json.load(index_file)
+        if index.get('root') == root and index.get('format') == INDEX_FORMAT:
+            return index
+    except (IOError, OSError, ValueError):
+        pass
+    return {'root': root, 'format': INDEX_FORMAT, 'dirs': {}, 'files': {},
+            'images': {}}
+
+def save_index(index):
+    if not os.path.isdir(SYNC_DIR):
+        os.makedirs(SYNC_DIR)
+    path = index_path(index['root'])
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as index_file:
+        json.dump(index, index_file)
+    os.rename(tmp, path)
+
+def docker_references(wdl):
+    '''
+    [name, tag, start, end] of the docker runtime attribute of each task in
+    wdl given as a plain string, where start and end are the byte offsets of
+    the image within its quotes
+    '''
+    references = []
+    for task in load_wdl(wdl).tasks.values():
+        docker = task.docker
+        if docker is not None and docker.value is not None:
+            name, tag = split_tag(docker.value)
+            references.append([name, tag, docker.start + 1, docker.end - 1])
+    return references
+
+def update_index(root):
+    '''
+    Bring the index of the WDLs below root up to date and return it. The
+    contents of directories whose mtime is unchanged are taken from the
+    index rather than listed again, and only WDLs whose size or mtime has
+    changed are parsed again.
+    '''
+    index = load_index(root)
+    old_dirs, old_files = index['dirs'], index['files']
+    dirs = dict()
+    files = dict()
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        known = old_dirs.get(path)
+        if known is not None and known['mtime'] == mtime:
+            subdirs, wdls = known['dirs'], known['wdls']
+        else:
+            try:
+                names = sorted(os.listdir(path))
+            except OSError:
+                continue
+            subdirs, wdls = [], []
+            for name in names:
+                full_path = os.path.join(path, name)
+                if name.endswith('.wdl'):
+                    if os.path.isfile(full_path):
+                        wdls.append(name)
+                elif not name.startswith('.') and name not in SKIP_DIRS and \
+                     os.path.isdir(full_path) and \
+                     not os.path.islink(full_path):
+                    subdirs.append(name)
+        dirs[path] = {'mtime': mtime, 'dirs': subdirs, 'wdls': wdls}
+        pending.extend(os.path.join(path, name) for name in reversed(subdirs))
+
+        for name in wdls:
+            wdl = os.path.join(path, name)
+            try:
+                st = os.stat(wdl)
+            except OSError:
+                continue
+            known = old_files.get(wdl)
+            if known is not None and known['mtime'] == st.st_mtime and \
+               known['size'] == st.st_size:
+                files[wdl] = known
+                continue
+            try:
+                references = docker_references(wdl)
+            except (IOError, OSError, WDLSyntaxError) as e:
+                logging.warning("Unable to index %s: %s", wdl, e)
+                references = []
+            files[wdl] = {'mtime': st.st_mtime, 'size': st.st_size,
+                          'docker': references}
+
+    if dirs != old_dirs or files != old_files:
+        images = defaultdict(list)
+        for wdl in sorted(files):
+            for name, tag, start, end in files[wdl]['docker']:
+                images[strip_default_registry(name)].append(
+                    [wdl, name, tag, start, end])
+        index.update(dirs=dirs, files=files, images=images)
+        save_index(index)
+    return index
+
+def rewrite_docker(wdl, edits):
+    '''
+    Apply edits, a list of (start, end, old, new) byte offsets and values,
+    to wdl in place, skipping any whose current value is not old (i.e. the
+    file has changed since it was indexed). Returns the edits applied.
+    '''
+    with open(wdl, 'rb') as wdl_file:
+        data = wdl_file.read()
+    parts = []
+    applied = []
+    pos = 0
+    for start, end, old, new in sorted(edits):
+        if data[start:end] != old:
+            logging.warning("%s changed since it was indexed, not updating " +
+                            "%s", wdl, old.decode('utf-8'))
+            continue
+        parts.extend([data[pos:start], new])
+        pos = end
+        applied.append((start, end, old, new))
+    if applied:
+        parts.append(data[pos:])
+        tmp = '{}.{}.tmp'.format(wdl, os.getpid())
+        with open(tmp, 'wb') as wdl_file:
+            wdl_file.write(b''.join(parts))
+        shutil.copymode(wdl, tmp)
+        os.rename(tmp, wdl)
+    return applied
+
+def task_images(path):
+    '''Normalized image name and tag of each task at or below path'''
+    images = dict()
+    for task_path, version in docker_repos(path):
+        docker_cfg = ConfigLoader(task_path).config.Docker
+        if docker_cfg.Namespace is None:
+            logging.warning("No namespace found for %s in hydrant.cfg, " +
+                            "unable to sync it", os.path.basename(task_path))
+            continue
+        name = '/'.join(part for part in (docker_cfg.Registry,
+                                          docker_cfg.Namespace,
+                                          os.path.basename(task_path))
+                        if part)
+        images[strip_default_registry(name)] = version
+    return images
+
+def sync(path=None, root=None, dry_run=False):
+    '''
+    Update the docker runtime attributes of all WDLs below root which use
+    the image of a task at or below path (by default, the current directory)
+    to the tag in that task's hydrant.cfg. root defaults to the parent of
+    the workflow directory, so that sibling workflows are included.
+    '''
+    if path is None:
+        path = os.getcwd()
+    path = os.path.abspath(path)
+    images = task_images(path)
+    if not images:
+        logging.error("No tasks (directories containing a Dockerfile) found")
+        sys.exit(2)
+    if root is None:
+        workflow_dir = path
+        if os.path.isfile(os.path.join(path, 'Dockerfile')):
+            workflow_dir = os.path.dirname(path)
+        root = os.path.dirname(workflow_dir)
+    root = os.path.abspath(root)
+
+    index = update_index(root)
+    edits = defaultdict(list)
+    for image, tag in sorted(images.items()):
+        for wdl, name, old_tag, start, end in index['images'].get(image, []):
+            if old_tag == tag:
+                continue
+            old = name if old_tag is None else name + ':' + old_tag
+            edits[wdl].append((start, end, old.encode('utf-8'),
+                               (name + ':' + tag).encode('utf-8')))
+
+    rows = []
+    for wdl in sorted(edits):
+        applied = edits[wdl] if dry_run else rewrite_docker(wdl, edits[wdl])
+        for _, _, old, new in applied:
+            rows.append((os.path.relpath(wdl, root), old.decode('utf-8'),
+                         new.decode('utf-8')))
+    if not rows:
+        logging.info("All WDLs below %s are up to date", root)
+        return
+    log_table(['WDL', 'Image', 'Would update to' if dry_run else 'Updated to'],
+              rows)
+    if not dry_run:
+        update_index(root)
 
 def main(args=None):
     parser = ArgParser(description=Description + \
@@ -18,8 +224,14 @@ def main(args=None):
     if __name__ != '__main__':
         parser.prog += " " + __name__.rsplit('.', 1)[-1]
 
+    parser.add_argument('--root',
+                        help="Directory below which to update WDLs " +
+                             "(default: the parent of this workflow's " +
+                             "directory)")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Only report the updates that would be made")
     args = parser.parse_args(args)
-    sync()
+    sync(root=args.root, dry_run=args.dry_run)
 
 if __name__ == '__main__':
     initialize_logging()
@@ -2,47 +2,407 @@
 # encoding: utf-8
 
 import os
+import re
 import sys
 import logging
-from json import load as json_load
-from subprocess import check_call
-from hydrant.util import ArgParser, FIXEDPATHS, find_tool, initialize_logging
+import shutil
+import threading
+from collections import deque, OrderedDict
+from glob import glob
+from json import load as json_load, dump as json_dump
+from six import string_types
+from subprocess import Popen, PIPE, STDOUT
+from hydrant.util import ArgParser, FIXEDPATHS, find_tool, initialize_logging, \
+                         log_table, run_parallel
 from hydrant.ConfigLoader import ConfigLoader
+from hydrant.WDL import load_wdl
+from hydrant import cromwell as cromwell_server
 
-Description = "Run local Cromwell on workflow, with tests/inputs.json"
+Description = "Run local Cromwell on workflow, with each of tests/*.json"
 
-def test(wdl=None, inputs_json='tests/inputs.json'):
+WORKFLOW_SUBMITTED = re.compile(r'[Ww]orkflow ([a-f0-9]{8}-(?:[a-f0-9]{4}-){3}'
+                                r'[a-f0-9]{12}) submitted')
+ERROR_LINES = 500 # Most recent log lines kept for the error summary
+
+class CromwellError(Exception):
+    pass
+
+def is_summary_line(line):
+    '''Whether a line of Cromwell output is of interest if the run fails:
+    i.e. not info-level logging, nor the indented lines of stack traces'''
+    return '[info]' not in line and not line.startswith('java.lang') and \
+           not line[:1].isspace()
+
+class StderrTailer(threading.Thread):
+    '''
+    Follow the stderr files of running tasks, logging lines as they are
+    written, while only ever holding a partial line of each in memory.
+    '''
+
+    def __init__(self, paths, interval=1.0):
+        '''paths: dict of task names to their stderr files'''
+        super(StderrTailer, self).__init__()
+        self.daemon = True
+        self._paths = paths
+        self._offsets = dict((task, 0) for task in paths)
+        self._partial = dict((task, '') for task in paths)
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def poll(self):
+        for task, path in self._paths.items():
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'r') as stderr:
+                stderr.seek(self._offsets[task])
+                for line in iter(stderr.readline, ''):
+                    if not line.endswith('\n'):
+                        self._partial[task] += line
+                        break
+                    logging.warning("[%s] %s", task,
+                                    self._partial[task] + line.rstrip('\n'))
+                    self._partial[task] = ''
+                self._offsets[task] = stderr.tell()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.poll()
+        self.poll()
+        for task, partial in self._partial.items():
+            if partial:
+                logging.warning("[%s] %s", task, partial)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def link_task_dirs(flow_name, task_names, workflow_id, exec_dir, done_dir,
+                   name=None, executions='cromwell-executions'):
+    '''
+    Soft link the execution directory of each task into exec_dir, so that
+    long-running jobs can be inspected. Returns a dict of the task stderr
+    files, by task name (as name:task, if the run is named).
+    '''
+    prefix = '[{}] '.format(name) if name else ''
+    path_prefix = os.path.join(executions, flow_name, workflow_id)
+    logging.info("%s    ExecutionDir(s):", prefix)
+    stderr_paths = dict()
+    for task in task_names:
+        task_dir = os.path.join(path_prefix, 'call-' + task, 'execution')
+        logging.info("%s        %s", prefix, task_dir)
+        os.symlink(os.path.relpath(task_dir, exec_dir),
+                   os.path.join(exec_dir, task))
+        key = name + ':' + task if name else task
+        stderr_paths[key] = os.path.join(exec_dir, task, 'stderr')
+    logging.info("%s    (linked in ./%s during execution, then ./%s)", prefix,
+                 exec_dir, done_dir)
+    return stderr_paths
+
+def write_options(options, exec_dir, cache=False):
+    '''
+    Copy the Cromwell options file into exec_dir, pointing any output
+    directories under ./running at exec_dir instead, so that concurrent runs
+    keep their outputs apart. Paths are made absolute, as a Cromwell server
+    does not share our working directory. Reading and writing the call cache
+    is enabled according to cache. Returns the path of the copy.
+    '''
+    with open(options) as options_file:
+        values = json_load(options_file)
+    for key, value in values.items():
+        if isinstance(value, string_types) and \
+           value.split('/', 1)[0] == 'running':
+            values[key] = os.path.abspath(exec_dir + value[len('running'):])
+    values['read_from_cache'] = values['write_to_cache'] = cache
+    path = os.path.join(exec_dir, 'options.json')
+    with open(path, 'w') as options_file:
+        json_dump(values, options_file, indent=4)
+    return path
+
+def _absolute_paths(value):
+    if isinstance(value, list):
+        return [_absolute_paths(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _absolute_paths(item))
+                    for key, item in value.items())
+    if isinstance(value, string_types) and not os.path.isabs(value) and \
+       os.path.exists(value):
+        return os.path.abspath(value)
+    return value
+
+def write_inputs(inputs_json, exec_dir):
+    '''
+    Copy the inputs JSON into exec_dir for submission to a Cromwell server,
+    making any relative paths of existing files absolute. Returns the path of
+    the copy.
+    '''
+    with open(inputs_json) as inputs_file:
+        values = json_load(inputs_file, object_pairs_hook=OrderedDict)
+    path = os.path.join(exec_dir, 'inputs.json')
+    with open(path, 'w') as inputs_file:
+        json_dump(OrderedDict((key, _absolute_paths(value))
+                              for key, value in values.items()),
+                  inputs_file, indent=2)
+    return path
+
+def _start_run(wdl, exec_dir):
+    '''Name of the workflow and its tasks, and a fresh exec_dir'''
+    wdl_obj = load_wdl(wdl)
+    flow_name = wdl_obj.document.workflow.name
+    _remove(exec_dir)
+    os.mkdir(exec_dir)
+    return flow_name, list(wdl_obj.tasks)
+
+def _remove(path):
+    # Runs by earlier versions of hydrant left soft links to their directories
+    if os.path.islink(path):
+        os.remove(path)
+    elif os.path.lexists(path):
+        shutil.rmtree(path)
+
+def _finish_run(exec_dir, done_dir, prefix, error, summary):
+    # Replace the directory of the latest finished run with this run
+    _remove(done_dir)
+    os.rename(exec_dir, done_dir)
+
+    if error is None:
+        logging.info("%sSuccess: look in ./%s for artifacts generated " +
+                     "during this run", prefix, done_dir)
+        return
+    logging.error("%sError: see filtered log below (and stderr above, if " +
+                  "available)\n%s", prefix, '\n'.join('    ' + line
+                                                      for line in summary))
+    raise CromwellError(error)
+
+def run_cromwell(cromwell, wdl, inputs_json, options, exec_dir='running',
+                 done_dir='latest', name=None, cache=False):
+    '''
+    Run a workflow with command-line Cromwell, parsing its output as it
+    arrives rather than logging it to disk: the workflow id is detected to
+    link the task execution directories into exec_dir, task stderr is
+    followed live, and only the most recent lines of interest are kept for
+    the error summary. When done, exec_dir is moved to done_dir. If given,
+    name prefixes all messages logged for the run. With cache, the call
+    cache database in the user directory is used, which only one Cromwell
+    at a time can open.
+    '''
+    prefix = '[{}] '.format(name) if name else ''
+    flow_name, task_names = _start_run(wdl, exec_dir)
+    options = write_options(options, exec_dir, cache)
+    command = ['java']
+    if cache:
+        command.append('-Dconfig.file=' + cromwell_server.write_config())
+    command += ['-jar', cromwell, 'run', '-i', inputs_json, '-o', options,
+                wdl]
+    logging.info("%sRunning cromwell:\n    %s", prefix, ' '.join(command))
+
+    summary = deque(maxlen=ERROR_LINES)
+    tailer = None
+    proc = Popen(command, stdout=PIPE, stderr=STDOUT, universal_newlines=True)
+    try:
+        for line in iter(proc.stdout.readline, ''):
+            line = line.rstrip('\n')
+            if tailer is None:
+                match = WORKFLOW_SUBMITTED.search(line)
+                if match is not None:
+                    tailer = StderrTailer(link_task_dirs(flow_name,
+                                                         task_names,
+                                                         match.group(1),
+                                                         exec_dir, done_dir,
+                                                         name))
+                    tailer.start()
+            if is_summary_line(line):
+                summary.append(line)
+    finally:
+        returncode = proc.wait()
+        if tailer is not None:
+            tailer.stop()
+
+    error = None
+    if returncode != 0:
+        error = "Cromwell exited with status {}".format(returncode)
+    _finish_run(exec_dir, done_dir, prefix, error, summary)
+
+def run_on_server(url, wdl, inputs_json, options, exec_dir='running',
+                  done_dir='latest', name=None, cache=False):
+    '''
+    Like run_cromwell, but submit the workflow to the Cromwell server at url
+    and poll for its completion. The outputs and metadata of the workflow
+    are saved as outputs.json and metadata.json in done_dir.
+    '''
+    prefix = '[{}] '.format(name) if name else ''
+    flow_name, task_names = _start_run(wdl, exec_dir)
+    options = write_options(options, exec_dir, cache)
+    inputs_json = write_inputs(inputs_json, exec_dir)
+    wdl = os.path.abspath(wdl)
+    workflow_id = cromwell_server.submit_workflow(url, wdl, inputs_json,
+                                                  options)
+    logging.info("%sSubmitted workflow %s to %s", prefix, workflow_id, url)
+    tailer = StderrTailer(link_task_dirs(flow_name, task_names, workflow_id,
+                                         exec_dir, done_dir, name,
+                                         cromwell_server.EXECUTIONS))
+    tailer.start()
+    try:
+        status = cromwell_server.wait_for_workflow(url, workflow_id)
+    finally:
+        tailer.stop()
+
+    metadata = cromwell_server.workflow_metadata(url, workflow_id)
+    with open(os.path.join(exec_dir, 'metadata.json'), 'w') as metadata_file:
+        json_dump(metadata, metadata_file, indent=2)
+    error = None
+    if status == 'Succeeded':
+        with open(os.path.join(exec_dir, 'outputs.json'), 'w') as outputs:
+            json_dump(cromwell_server.workflow_outputs(url, workflow_id),
+                      outputs, indent=2)
+    else:
+        error = "Workflow {} {}".format(workflow_id, status.lower())
+    _finish_run(exec_dir, done_dir, prefix, error,
+                cromwell_server.failure_messages(metadata.get('failures')))
+
+def case_dirs(case):
+    '''Execution and output directories of a test case: the default case
+    (tests/inputs.json) uses ./running and ./latest, others get their own'''
+    if case == 'inputs':
+        return 'running', 'latest'
+    return 'running-' + case, 'latest-' + case
+
+def test(wdl=None, inputs=None, jobs=None, fail_fast=False, server=False,
+         port=cromwell_server.DEFAULT_PORT, cache=True):
+    '''
+    Run the workflow once for each inputs JSON file (by default, each of
+    tests/*.json), up to jobs runs at a time, and log a summary table if
+    there is more than one case. With server, the cases are submitted to a
+    local Cromwell server (started if need be, and left running), by default
+    all at once; otherwise each runs its own Cromwell, by default one at a
+    time. With cache, task results are reused from previous runs where
+    Cromwell's call caching allows.
+    '''
     if not wdl:
         wdl = os.path.basename(os.getcwd()) + ".wdl"
     if not os.path.exists(wdl):
         logging.error("WDL not found: " + wdl)
         sys.exit(2)
+    if not inputs:
+        inputs = sorted(glob(os.path.join('tests', '*.json')))
+        if not inputs:
+            logging.error("No inputs JSON found in tests/")
+            sys.exit(2)
 
     # Validate JSON syntax before incurring cost of launching Cromwell
-    try:
-        _ = json_load(open(inputs_json))
-    except:
-        (exc_type, exc_value) = sys.exc_info()[:2]
-        logging.error("validating JSON %s:\n\t%s (%s)", inputs_json,
-                      exc_type.__name__, exc_value)
-        sys.exit(3)
+    for inputs_json in inputs:
+        try:
+            with open(inputs_json) as inputs_file:
+                _ = json_load(inputs_file)
+        except:
+            (exc_type, exc_value) = sys.exc_info()[:2]
+            logging.error("validating JSON %s:\n\t%s (%s)", inputs_json,
+                          exc_type.__name__, exc_value)
+            sys.exit(3)
 
     config = ConfigLoader().config.All
-    runcromw = os.path.join(FIXEDPATHS.BIN, 'runcromw.sh')  # @UndefinedVariable
+    options = os.path.join(FIXEDPATHS.BIN, 'options.json')  # @UndefinedVariable
     CROMWELL = find_tool(config.Cromwell, "Command-line cromwell")
-    try:
-        check_call([runcromw, CROMWELL, wdl, inputs_json])
-    except:
-        logging.exception('Workflow test failed')
+
+    run, engine = run_cromwell, CROMWELL
+    if server:
+        try:
+            run = run_on_server
+            engine = cromwell_server.ensure_server(CROMWELL, port)
+        except cromwell_server.CromwellServerError as e:
+            logging.error(str(e))
+            sys.exit(1)
+    if jobs is None:
+        jobs = len(inputs) if server else 1
+    if cache and not server:
+        # The call cache database can only be opened by one Cromwell
+        if jobs > 1 and len(inputs) > 1:
+            logging.warning("Call caching is disabled when running test " +
+                            "cases concurrently without --server")
+            cache = False
+        elif cromwell_server.running_server() is not None:
+            logging.warning("Call caching is disabled without --server " +
+                            "while the Cromwell server is running, as it " +
+                            "holds the call cache")
+            cache = False
+
+    with cromwell_server.call_cache_lock(cache and not server) as cache_lock:
+        if cache and not server and not cache_lock:
+            logging.warning("Call caching is disabled while another " +
+                            "hydrant test is using the call cache")
+            cache = False
+        cases = []
+        for inputs_json in inputs:
+            case = os.path.splitext(os.path.basename(inputs_json))[0]
+            exec_dir, done_dir = case_dirs(case)
+            cases.append((case, (engine, wdl, inputs_json, options, exec_dir,
+                                 done_dir, case if len(inputs) > 1 else None,
+                                 cache)))
+        results = run_parallel(run, cases, jobs, fail_fast)
+
+    if len(cases) > 1:
+        log_table(['Case', 'Duration', 'Result', 'Output'],
+                  [(result.name, '{:.1f}s'.format(result.duration),
+                    'ok' if result.error is None else
+                    'cancelled' if result.error == 'cancelled' else 'FAILED',
+                    case_dirs(result.name)[1]) for result in results])
+    if any(result.error is not None for result in results):
+        logging.error('Workflow test failed')
         sys.exit(1)
 
 def main(args=None):
     parser = ArgParser(description=Description)
     if __name__ != '__main__':
         parser.prog += " " + __name__.rsplit('.', 1)[-1]
-    
+
+    parser.add_argument('inputs', nargs='*',
+                        help="Inputs JSON file(s), each run as a separate " +
+                             "test case (default: tests/*.json)")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="Number of test cases to run concurrently " +
+                             "(default: 1, or all of them with --server)")
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="Stop starting new test cases once one has " +
+                             "failed")
+    parser.add_argument('-s', '--server', action='store_true',
+                        help="Submit to a local Cromwell server, starting " +
+                             "one if needed and leaving it running for " +
+                             "later tests")
+    parser.add_argument('-p', '--port', type=int,
+                        default=cromwell_server.DEFAULT_PORT,
+                        help="Port of the Cromwell server " +
+                             "(default: %(default)s)")
+    parser.add_argument('--stop-server', action='store_true',
+                        help="Stop the Cromwell server and exit")
+    parser.add_argument('--cache', dest='cache', action='store_true',
+                        default=True,
+                        help="Reuse the results of tasks whose image and " +
+                             "inputs are unchanged since a previous run " +
+                             "(default)")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="Rerun every task")
+    parser.add_argument('--cache-size', action='store_true',
+                        help="Report the disk space used by the call cache " +
+                             "and exit")
+    parser.add_argument('--prune-cache', action='store_true',
+                        help="Delete the call cache (stopping the Cromwell " +
+                             "server) and exit")
     args = parser.parse_args(args)
-    test()
+    if args.stop_server:
+        cromwell_server.stop_server()
+        return
+    if args.cache_size:
+        database, executions = cromwell_server.call_cache_size()
+        log_table(['Call cache', 'Location', 'Size'],
+                  [('database', cromwell_server.CALL_CACHE_DIR,
+                    '{:.1f} MB'.format(database / 1e6)),
+                   ('server executions', cromwell_server.EXECUTIONS,
+                    '{:.1f} MB'.format(executions / 1e6))])
+        return
+    if args.prune_cache:
+        logging.info("Freed %.1f MB", cromwell_server.prune_call_cache() / 1e6)
+        return
+    test(inputs=args.inputs, jobs=args.jobs, fail_fast=args.fail_fast,
+         server=args.server, port=args.port, cache=args.cache)
 
 if __name__ == '__main__':
     initialize_logging()
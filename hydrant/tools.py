@@ -0,0 +1,158 @@
+# encoding: utf-8
+
+'''
+Store of the tools hydrant downloads (e.g. the Cromwell and womtool jars),
+kept in ~/.hydrant/tools/<hash of url>/<file name>, so that several versions
+of a tool with the same file name can be kept side by side.
+
+Downloads are streamed to a .part file next to their final path, which a
+later attempt resumes with an HTTP Range request, and are only renamed into
+place once complete: a tool present in the store is never truncated. A url
+may end with a #sha256=<hex digest> fragment, which the download is then
+verified against. Tools found where earlier versions of hydrant downloaded
+them, directly in ~/.hydrant, are moved into the store rather than
+downloaded again.
+'''
+
+import hashlib
+import logging
+import os
+import re
+
+from six.moves.urllib.parse import urldefrag
+
+from hydrant.util import FIXEDPATHS
+
+TOOLS_DIR = os.path.join(FIXEDPATHS.USERDIR, 'tools')
+CHUNK_SIZE = 1 << 20  # 1 MiB
+TIMEOUT = 60          # seconds to wait for the server to respond or send data
+ATTEMPTS = 3          # resumed on connection errors, before giving up
+CONTENT_RANGE = re.compile(r'bytes (?:(\d+)-\d+|\*)/(\d+)')
+
+class ToolDownloadError(IOError):
+    pass
+
+def split_url(url):
+    '''Url without its fragment, and the sha256 digest given in the fragment
+    (or None)'''
+    url, fragment = urldefrag(url)
+    sha256 = None
+    for param in fragment.split('&'):
+        key, _, value = param.partition('=')
+        if key == 'sha256' and value:
+            sha256 = value.lower()
+    return url, sha256
+
+def tool_path(url):
+    '''Path of the tool downloaded from url in the store'''
+    url = split_url(url)[0]
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(TOOLS_DIR, key, url.rsplit('/', 1)[-1])
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+def adopt_legacy(url, local):
+    '''Move the tool downloaded by earlier versions of hydrant to
+    ~/.hydrant/<file name> into the store at local, if present and matching
+    the sha256 digest in the url's fragment, if any. Returns whether it was.'''
+    url, sha256 = split_url(url)
+    legacy = os.path.join(FIXEDPATHS.USERDIR, url.rsplit('/', 1)[-1])
+    if not os.path.isfile(legacy):
+        return False
+    if sha256 is not None and _file_digest(legacy).hexdigest() != sha256:
+        logging.warning("Checksum mismatch for %s, downloading %s again",
+                        legacy, url)
+        return False
+    if not os.path.isdir(os.path.dirname(local)):
+        os.makedirs(os.path.dirname(local))
+    os.rename(legacy, local)
+    logging.info("Moved %s to %s", legacy, local)
+    return True
+
+def _fetch(url, part):
+    '''Download url to part, resuming from its current size, and return
+    whether it is complete'''
+    import requests
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    # Content-Length is only meaningful if the body is not re-encoded
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+    response = requests.get(url, headers=headers, stream=True,
+                            timeout=TIMEOUT)
+    with response:
+        content_range = CONTENT_RANGE.match(
+            response.headers.get('Content-Range', ''))
+        if response.status_code == 416:
+            # The part file is already complete, unless the file changed
+            if content_range and int(content_range.group(2)) == offset:
+                return True
+            os.remove(part)
+            return False
+        response.raise_for_status()
+        if response.status_code == 206 and content_range and \
+           content_range.group(1) is not None and \
+           int(content_range.group(1)) == offset:
+            logging.info("Resuming download of %s at %d bytes", url, offset)
+            mode = 'ab'
+            total = int(content_range.group(2))
+        else:
+            # Range not supported, start over
+            mode = 'wb'
+            offset = 0
+            total = response.headers.get('Content-Length')
+            total = int(total) if total is not None else None
+        with open(part, mode) as part_file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                part_file.write(chunk)
+            size = part_file.tell()
+    if total is not None and size != total:
+        raise ToolDownloadError("Incomplete download of {}: {} of {} " \
+                                "bytes".format(url, size, total))
+    return True
+
+def download(url, local):
+    '''
+    Download url to local, through local.part, verifying it against the
+    sha256 digest in the url's fragment, if any.
+
+    Downloads use the requests library (via the requests[security]
+    requirement in setup.py) rather than urllib, which uses whatever version
+    of OpenSSL is available locally. This simplifies usage on OS X and
+    Windows.
+    '''
+    import requests
+    url, sha256 = split_url(url)
+    part = local + '.part'
+    if not os.path.isdir(os.path.dirname(local)):
+        os.makedirs(os.path.dirname(local))
+    attempt = 1
+    while True:
+        try:
+            if _fetch(url, part):
+                break
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                ToolDownloadError) as e:
+            if attempt >= ATTEMPTS:
+                raise
+            logging.warning("Download of %s interrupted (%s), resuming", url,
+                            e)
+        attempt += 1
+    digest = _file_digest(part).hexdigest()
+    if sha256 is None:
+        logging.warning("No checksum given for %s, so only its size was " +
+                        "verified. To verify later downloads, append " +
+                        "#sha256=%s to its url in hydrant.cfg", url, digest)
+    elif digest != sha256:
+        os.remove(part)
+        raise ToolDownloadError("Checksum mismatch for {}: expected " \
+                                "sha256 {}, got {}".format(url, sha256,
+                                                           digest))
+    os.rename(part, local)
+    return local
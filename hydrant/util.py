@@ -3,26 +3,59 @@ import os
 import sys
 import logging
 import argparse
-import requests
+import atexit
+import copy
+import errno
+import json
+import time
+from contextlib import contextmanager
 from colorlog import ColoredFormatter
 from textwrap import TextWrapper
 from shutil import copy2 as cp
 from io import open
 from collections import namedtuple
-from pkg_resources import resource_filename, get_distribution
 from six import u
-from six.moves import input
-from six.moves.urllib.request import urlretrieve
+from six.moves import input, queue
 from gettext import gettext as _
 
+_PKGDIR = os.path.dirname(os.path.abspath(__file__))
+
 FixedPaths = namedtuple('FixedPaths', 'USERDIR BIN DEFAULTS')
+JobResult = namedtuple('JobResult', 'name result error duration')
 
 FIXEDPATHS = FixedPaths(
     USERDIR          = os.path.expanduser(os.path.join("~", ".hydrant")),
-    BIN              = resource_filename(__name__, 'bin'),
-    DEFAULTS         = resource_filename(__name__, 'defaults')
+    BIN              = os.path.join(_PKGDIR, 'bin'),
+    DEFAULTS         = os.path.join(_PKGDIR, 'defaults')
     )
 
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError: # Python 2
+    QueueHandler = QueueListener = None
+# Queue of records to log, and the thread writing them, once
+# initialize_logging has been called
+_LOG_QUEUE = None
+_LOG_LISTENER = None
+
+# Inter-process locks on resources in the user directory, which parallel
+# hydrant invocations would otherwise race to create or update
+LOCKDIR = os.path.join(FIXEDPATHS.USERDIR, 'locks')
+# Records the hydrant version and user directory mtime at which the user
+# directory was last found to be initialized, so that startup can skip
+# checking it again until either changes
+STARTUP_STAMP = os.path.join(FIXEDPATHS.USERDIR, '.startup')
+LOCK_TIMEOUT = 600     # seconds to wait for another process to finish
+LOCK_POLL_INTERVAL = 0.1
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# Whitespace which TextWrapper replaces with spaces
+_WRAP_WHITESPACE = frozenset('\t\n\x0b\x0c\r')
+
 # based on https://stackoverflow.com/a/25335783
 class WrappedColoredFormatter(ColoredFormatter):
     def __init__(self, fmt=None, datefmt=None, style='%', log_colors=None,
@@ -42,20 +75,62 @@ class WrappedColoredFormatter(ColoredFormatter):
         self.wrapper = TextWrapper(width=width, subsequent_indent=' '*indent,
                                    break_long_words=break_long_words,
                                    break_on_hyphens=break_on_hyphens)
-        
+        # Lines after the first are indented like continuation lines. A
+        # separate wrapper, rather than temporarily changing the indent of
+        # the first, keeps format safe to call from several threads.
+        self.continuation_wrapper = TextWrapper(
+            width=width, initial_indent=' '*indent,
+            subsequent_indent=' '*indent, break_long_words=break_long_words,
+            break_on_hyphens=break_on_hyphens)
+
+    @staticmethod
+    def _wrap(wrapper, line):
+        # Most lines fit, and need none of TextWrapper's work
+        if len(wrapper.initial_indent) + len(line) <= wrapper.width and \
+           line.strip() and not _WRAP_WHITESPACE.intersection(line):
+            return [wrapper.initial_indent + line.rstrip()]
+        return wrapper.wrap(line)
+
     def format(self, record):
         lines = super(WrappedColoredFormatter, self).format(record).splitlines()
         wrapped_lines = []
-        initial_indent = self.wrapper.initial_indent
-        for idx, line in enumerate(lines):
-            wrapped_lines.extend(self.wrapper.wrap(line))
-            if idx == 0:
-                self.wrapper.initial_indent = self.wrapper.subsequent_indent
-        
-        self.wrapper.initial_indent = initial_indent
-            
+        wrapper = self.wrapper
+        for line in lines:
+            wrapped_lines.extend(self._wrap(wrapper, line))
+            wrapper = self.continuation_wrapper
         return "\n".join(wrapped_lines)
 
+if QueueHandler is not None:
+    class TracebackQueueHandler(QueueHandler):
+        '''
+        QueueHandler which keeps the traceback of a record in exc_text, where
+        formatters expect it, rather than appending it to the message
+        '''
+        _formatter = logging.Formatter()
+
+        def prepare(self, record):
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info and not record.exc_text:
+                record.exc_text = self._formatter.formatException(
+                    record.exc_info)
+            # Tracebacks can't be pickled, and may hold objects in use
+            record.exc_info = None
+            return record
+
+class JSONFormatter(logging.Formatter):
+    '''Formats records as JSON objects, one per line'''
+    def format(self, record):
+        entry = {'time': self.formatTime(record, self.datefmt),
+                 'level': record.levelname, 'logger': record.name,
+                 'thread': record.threadName, 'message': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
 class ArgParser(argparse.ArgumentParser):
     def error(self, message):
         """error(message: string)
@@ -79,38 +154,132 @@ class ArgParser(argparse.ArgumentParser):
                                                    self.format_help()))
 
 def version():
-    return get_distribution(__name__.split('.', 1)[0]).version
-
-# derived from
-# https://github.com/requests/requests/issues/885#issuecomment-216838596
-def urlretrieve(url, local):
-    """
-    The urlretrieve function that is part of urllib uses whatever version of
-    OpenSSL is available locally. By using the requests library (via the
-    requests[security] requirement in setup.py), we bypass that in favor of the
-    latest version. This simplifies usage on OS X and Windows.
-    """
-    r = requests.get(url, stream=True)
-    with open(local, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            f.write(chunk)
+    # pkg_resources scans every installed distribution on import, so prefer
+    # the version setuptools_scm writes at install time, then the metadata
+    # of just this distribution
+    try:
+        from hydrant._version import version as scm_version
+        return scm_version
+    except ImportError:
+        pass
+    dist = __name__.split('.', 1)[0]
+    try:
+        from importlib.metadata import version as dist_version
+    except ImportError: # Python < 3.8
+        from pkg_resources import get_distribution
+        return get_distribution(dist).version
+    return dist_version(dist)
+
+class LockTimeout(Exception):
+    pass
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+@contextmanager
+def user_lock(name, timeout=LOCK_TIMEOUT):
+    '''
+    Hold an exclusive lock on the named resource across processes, waiting
+    up to timeout seconds (or forever, if None) for it. The lock is released
+    if its holder dies, so it can never be left stale.
+    '''
+    if fcntl is None:
+        yield
+        return
+    _makedirs(LOCKDIR)
+    path = os.path.join(LOCKDIR, name + '.lock')
+    lock_file = open(path, 'a')
+    try:
+        deadline = None if timeout is None else time.time() + timeout
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+            if deadline is not None and time.time() >= deadline:
+                raise LockTimeout("Timed out after {}s waiting for {} to " \
+                                  "be released".format(timeout, path))
+            if not waiting:
+                logging.info("Waiting for another hydrant process to " +
+                             "release %s", name)
+                waiting = True
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
 
 def add_default_arg(arg, kwargs):
     kwargs['default'] = arg
     kwargs['help'] += " (default: %(default)s)"
 
+def run_parallel(func, jobs, max_workers=1, fail_fast=False):
+    '''
+    Run func(*args) for each (name, args) in jobs using a pool of up to
+    max_workers threads. Exceptions raised by func are logged and recorded
+    rather than propagated; with fail_fast, the first failure cancels any
+    jobs that have not yet started (their error is 'cancelled'). Returns a
+    list of JobResults in the same order as jobs.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Event
+    jobs = list(jobs)
+    failed = Event()
+
+    def timed(name, args):
+        if fail_fast and failed.is_set():
+            return JobResult(name, None, 'cancelled', 0.0)
+        start = time.time()
+        try:
+            return JobResult(name, func(*args), None, time.time() - start)
+        except Exception as e:
+            logging.exception("%s failed", name)
+            failed.set()
+            return JobResult(name, None, e, time.time() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(timed, name, args) for name, args in jobs]
+    return [future.result() for future in futures]
+
+def log_table(header, rows, level=logging.INFO):
+    '''Log rows of values as a table with left-aligned columns'''
+    rows = [[str(value) for value in row] for row in [header] + list(rows)]
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    for idx, row in enumerate(rows):
+        logging.log(level, "  ".join(value.ljust(width) for value, width
+                                     in zip(row, widths)).rstrip())
+        if idx == 0:
+            logging.log(level, "  ".join('-' * width for width in widths))
+
 def find_tool(url, name):
     # Look for local instance of tool with given name, download if necessary
-    local = os.path.join(FIXEDPATHS.USERDIR, url.rsplit('/', 1)[-1])
-    if not os.path.exists(FIXEDPATHS.USERDIR):
-        logging.info("No path found for hydrant utilities, creating %s",
-                     FIXEDPATHS.USERDIR)
-        os.mkdir(FIXEDPATHS.USERDIR)
-    if not os.path.exists(local):
+    from hydrant.tools import ToolDownloadError, adopt_legacy, download, \
+        tool_path
+    local = tool_path(url)
+    if os.path.exists(local):
+        return local
+    # Only one process downloads, the others wait for it (however long a slow
+    # download takes) and reuse the tool
+    with user_lock('tool-' + os.path.basename(os.path.dirname(local)),
+                   timeout=None):
+        if os.path.exists(local) or adopt_legacy(url, local):
+            return local
         logging.info("%s not found. Downloading from %s to %s.",
                      name, url, local)
         try:
-            urlretrieve(url, local)
+            download(url, local)
+        except ToolDownloadError as e:
+            logging.error("Unable to download %s: %s", name, e)
+            sys.exit(74) # sysexits.h IOERR exit status
         except IOError:
             logging.exception('Unable to download %s. If the below exception' +
                               ' includes "%s", a TLS v1.2 compatible python ' +
@@ -128,38 +297,109 @@ def find_tool(url, name):
     return local
 
 def initialize_logging():
-    # Set root logger
-    
-    stream_formatter = WrappedColoredFormatter(
-        "%(log_color)s%(levelname)-8s%(reset)s%(white)s %(message)s"
-    )
+    '''
+    Set up the root logger to hand records to a queue, from which a
+    background thread formats and writes them, so that logging does not
+    slow down the threads producing the records. Output is wrapped and
+    colored only when stderr is a terminal.
+    '''
+    global _LOG_QUEUE, _LOG_LISTENER
     logger = logging.getLogger()
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(stream_formatter)
-    logger.addHandler(stream_handler)
     logger.setLevel(logging.INFO)
-    
-def log_to_logfile(logfile):
+    if _LOG_LISTENER is not None:
+        return
+
+    stream_handler = _stream_handler()
+    if QueueHandler is None: # Python 2
+        logger.addHandler(stream_handler)
+        return
+    _LOG_QUEUE = queue.Queue()
+    _LOG_LISTENER = QueueListener(_LOG_QUEUE, stream_handler,
+                                  respect_handler_level=True)
+    _LOG_LISTENER.start()
+    atexit.register(_LOG_LISTENER.stop)
+    logger.addHandler(TracebackQueueHandler(_LOG_QUEUE))
+
+def _stream_handler():
+    stream_handler = logging.StreamHandler()
+    if stream_handler.stream.isatty():
+        stream_handler.setFormatter(WrappedColoredFormatter(
+            "%(log_color)s%(levelname)-8s%(reset)s%(white)s %(message)s"
+        ))
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(levelname)-8s %(message)s"))
+    return stream_handler
+
+def initialize_worker_logging():
+    '''
+    Initializer for worker processes forked after initialize_logging, which
+    inherit the queue but not the thread writing its records, so log
+    directly to stderr instead
+    '''
+    global _LOG_QUEUE, _LOG_LISTENER
+    _LOG_QUEUE = _LOG_LISTENER = None
     logger = logging.getLogger()
-    file_formatter = WrappedColoredFormatter(
-        "%(asctime)s::%(log_color)s%(levelname)-8s%(reset)s%(white)s %(message)s",
-        datefmt='%Y-%m-%d %I:%M:%S',
-        indent = 30
-    )
+    for handler in logger.handlers[:]:
+        if QueueHandler is not None and isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(_stream_handler())
+
+def flush_logging():
+    '''Wait for queued records to be written, e.g. before prompting'''
+    if _LOG_QUEUE is not None:
+        _LOG_QUEUE.join()
+    for handler in _log_handlers():
+        handler.flush()
+
+def _log_handlers():
+    if _LOG_LISTENER is not None:
+        return _LOG_LISTENER.handlers
+    return logging.getLogger().handlers
+
+def log_to_logfile(logfile):
+    '''Also log to logfile, as JSON lines'''
     file_handler = logging.FileHandler(logfile, delay=True)
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
+    file_handler.setFormatter(JSONFormatter())
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.handlers += (file_handler,)
+    else:
+        logging.getLogger().addHandler(file_handler)
+
+def _startup_stamp(cur_version):
+    # Files added to or removed from the user directory change its mtime
+    return u('{}\n{!r}\n'.format(cur_version,
+                                  os.stat(FIXEDPATHS.USERDIR).st_mtime))
 
 def initialize_user_dir():
-    old_version = None
     cur_version = version()
+    try:
+        with open(STARTUP_STAMP) as stamp:
+            if stamp.read() == _startup_stamp(cur_version):
+                return
+    except (IOError, OSError):
+        pass
+
+    # Parallel first runs would otherwise all copy the same files
+    first_run = not os.path.isdir(FIXEDPATHS.USERDIR)
+    with user_lock('user-dir'):
+        _initialize_user_dir(first_run, cur_version)
+        if not os.path.exists(STARTUP_STAMP):
+            open(STARTUP_STAMP, 'w').close()
+        # Rewriting an existing file leaves the directory mtime unchanged
+        with open(STARTUP_STAMP, 'w') as stamp:
+            stamp.write(_startup_stamp(cur_version))
+
+def _initialize_user_dir(first_run, cur_version):
+    old_version = None
     version_file = os.path.join(FIXEDPATHS.USERDIR, 'VERSION')
     version_conflict_action = None
     
-    # Ensure custom Hydrant directory exists for user
-    if not os.path.isdir(FIXEDPATHS.USERDIR):
+    # Ensure custom Hydrant directory exists for user (another process may
+    # have created it while waiting for the lock, also on its first run)
+    if first_run and not os.path.isfile(version_file):
         logging.info("First run of hydrant, creating %s", FIXEDPATHS.USERDIR)
-        os.mkdir(FIXEDPATHS.USERDIR)
+        _makedirs(FIXEDPATHS.USERDIR)
         with open(version_file, 'w') as version_fp:
             version_fp.write(u(cur_version + "\n"))
 
@@ -173,6 +413,7 @@ def initialize_user_dir():
                      "version, and may need to be updated to ensure proper " +
                      "functionality.")
         while version_conflict_action is None:
+            flush_logging()
             version_conflict_action = \
                 input("(R)eplace, (B)ackup, (S)kip: ").strip()
             if version_conflict_action.lower() in ('r', 'replace'):
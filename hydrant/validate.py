@@ -1,84 +1,255 @@
 #! /usr/bin/env python
 # encoding: utf-8
 
+import json
 import os
+import re
 import sys
+import time
 import logging
+from collections import OrderedDict
 from io import open
-from subprocess import check_call, check_output
-from hydrant.util import ArgParser, find_tool, initialize_logging
+from multiprocessing import cpu_count
+from hydrant.util import ArgParser, find_tool, initialize_logging, \
+                         initialize_worker_logging, log_table
 from hydrant.ConfigLoader import ConfigLoader
-from six import u
+from hydrant.cache import FileCache, cache_key, file_identity
+from hydrant.womtool import WomtoolError, stop_server, womtool
+from hydrant.WDL import WDLImportError, resolve_imports
+from six import string_types, u
 
 Description = "Verify syntax of WDL workflow and generate test json"
 
-def validate(wdl=None, inputs_json='tests/inputs.json'):
-    if not wdl:
-        wdl = os.path.basename(os.getcwd()) + ".wdl"
-    if not os.path.exists(wdl):
-        logging.exception("WDL not found: " + wdl)
-        sys.exit(2)
-    config = ConfigLoader().config.All
-    WDLTOOL = find_tool(config.WDLtool, "wdltool")
+# Results of successful validations, keyed by WDL content and womtool jar
+VALIDATIONS = FileCache('validate', max_entries=512)
+
+# Placeholder values in womtool's inputs template, e.g. "File",
+# "(optional) Int?" or "Array[String]+", as opposed to values set by the user
+TYPE_PLACEHOLDER = re.compile(r'^(\(optional[^)]*\) )?' +
+                              r'(File|String|Int|Float|Boolean|Object|' +
+                              r'\w+\[.*\])\??\+?\??$')
+
+def is_placeholder(value):
+    return isinstance(value, string_types) and \
+           TYPE_PLACEHOLDER.match(value) is not None
+
+def merge_inputs(template, old_inputs=None):
+    '''
+    Merge the values the user set in old_inputs into womtool's inputs
+    template, dropping inputs no longer in the template. Workflow inputs are
+    ordered before task inputs.
+    '''
+    old_inputs = old_inputs or {}
+    inputs = OrderedDict()
+    for key in sorted(template, key=lambda key: (key.count('.'), key)):
+        value = template[key]
+        if key in old_inputs and not is_placeholder(old_inputs[key]):
+            # Restore value previously set by user
+            value = old_inputs[key]
+        elif key.endswith('.package') and value == 'Boolean':
+            # If using packaging code, turn it on for testing to avoid
+            # cromwell attempting to localize a google bucket file.
+            value = True
+        inputs[key] = value
+    return inputs
+
+def womtool_inputs(wdltool, wdl, server=False, use_cache=True):
+    '''
+    Validate wdl and return womtool's template of its inputs, reusing the
+    result of the last successful validation of identical WDL content (that
+    of wdl and of everything it imports) with the same womtool jar, unless
+    use_cache is False. WDLs imported by url are identified by their url,
+    rather than fetched on every run.
+    '''
+    key = None
+    if use_cache:
+        try:
+            imports = resolve_imports(wdl, fetch=False)
+            sources = [imported.source for imported in imports.wdls.values()]
+            urls = sorted(set(target for targets in imports.graph.values()
+                              for _, target in targets
+                              if target not in imports.wdls))
+            key = cache_key(*sources + urls + [file_identity(wdltool)])
+        except WDLImportError:
+            pass # Leave it to womtool to report the problem
+    cached = VALIDATIONS.get(key) if key is not None else None
+    if cached is not None:
+        logging.info('%s is unchanged since its last successful validation',
+                     wdl)
+        return cached['inputs']
+
+    # womtool inputs fails on any WDL which does not validate, so a single
+    # call both validates the WDL and generates the inputs template
+    inputs = womtool(wdltool, ['inputs', os.path.abspath(wdl)], server)
+    if key is not None:
+        VALIDATIONS.put(key, {'inputs': inputs})
+    return inputs
+
+def write_inputs(wdltool, wdl, inputs_json, server=False, use_cache=True):
+    '''
+    Validate wdl and write its inputs template to inputs_json, preserving any
+    values already set there. On failure, the previous inputs_json is
+    restored and the exception re-raised.
+    '''
     inputs_json_bak = None
     try:
-        check_call(['java', '-jar', WDLTOOL, 'validate', wdl])
+        inputs_template = womtool_inputs(wdltool, wdl, server, use_cache)
         logging.info('Success: %s syntax is correct', wdl)
+        old_inputs = None
         if os.path.exists(inputs_json):
             inputs_json_bak = inputs_json + '.bak'
             os.rename(inputs_json, inputs_json_bak)
-        with open(inputs_json, 'w') as inputs:
-            logging.info('Writing %s', inputs_json)
-            input_data = [datum.rstrip(',') for datum in \
-                          check_output(['java', '-jar', WDLTOOL, 'inputs', wdl],
-                                       universal_newlines=True).strip().split('\n')]
-            # Sort inputs with workflow inputs first, then task inputs 
-            input_data[1:-1] = sorted(input_data[1:-1],
-                                      key=lambda x: "{}{}".format(x.split(':')[0].count('.'), x))
             # Store values previously set by the user
-            old_data = dict()
-            if inputs_json_bak is not None:
+            try:
                 with open(inputs_json_bak, 'r') as old_data_file:
-                    wdl_types = ['File', 'String', 'Int', 'Float', 'Boolean',
-                                 'Object']
-                    for line in old_data_file:
-                        clean_line = line.rstrip().rstrip(',')
-                        old_datum = clean_line.split(': ')
-                        if len(old_datum) == 2:
-                            old_value = old_datum[1].strip().strip('"').replace('(optional) ', '').replace('?', '')
-                            if old_value not in wdl_types and \
-                                old_value.find('[') < 1:
-                                old_data[old_datum[0].strip()] = clean_line
-            
-            no_comma = len(input_data) - 1
-            for idx, datum in enumerate(input_data, 1):
-                if idx > 1 and idx < len(input_data):
-                    datum_key = datum.split(': ')[0].strip()
-                    # Restore value previously set by user
-                    if datum_key in old_data:
-                        datum = old_data[datum_key]
-                    if idx < no_comma:
-                        datum += ','
-                    # If using packaging code, turn it on for testing to avoid
-                    # cromwell attempting to localize a google bucket file.
-                    datum = datum.replace('.package": "Boolean"',
-                                          '.package": true')
-                inputs.write(u('{}'.format(datum + '\n')))
-        logging.info("Now edit %s to reflect input files etc, then run test",
-                     inputs_json)
+                    old_inputs = json.load(old_data_file)
+            except ValueError as e:
+                logging.warning("Unable to restore values from %s: %s",
+                                inputs_json_bak, e)
+        new_inputs = merge_inputs(json.loads(inputs_template,
+                                             object_pairs_hook=OrderedDict),
+                                  old_inputs)
+        with open(inputs_json, 'w') as inputs:
+            logging.info('Writing %s', inputs_json)
+            inputs.write(u(json.dumps(new_inputs, indent=2,
+                                      separators=(',', ': ')) + '\n'))
     except:
         if inputs_json_bak is not None:
             os.rename(inputs_json_bak, inputs_json)
+        raise
+
+def validate(wdl=None, inputs_json='tests/inputs.json', server=False,
+             use_cache=True):
+    if not wdl:
+        wdl = os.path.basename(os.getcwd()) + ".wdl"
+    if not os.path.exists(wdl):
+        logging.exception("WDL not found: " + wdl)
+        sys.exit(2)
+    config = ConfigLoader().config.All
+    WDLTOOL = find_tool(config.WDLtool, "wdltool")
+    try:
+        write_inputs(WDLTOOL, wdl, inputs_json, server, use_cache)
+    except WomtoolError as e:
+        logging.error("Unable to validate %s:\n%s", wdl, e.output)
+        sys.exit(1)
+    except:
         logging.exception("Unable to validate %s", wdl)
         sys.exit(1)
+    logging.info("Now edit %s to reflect input files etc, then run test",
+                 inputs_json)
+
+def workflow_dirs(path=None, max_depth=2):
+    '''
+    Find workflow directories (those containing <directory name>.wdl) at
+    most max_depth levels below path, without descending into them.
+    '''
+    if path is None:
+        path = os.getcwd()
+    path = os.path.abspath(path)
+    for root, dirs, _ in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if os.path.isfile(os.path.join(root, os.path.basename(root) +
+                                       '.wdl')):
+            del dirs[:]
+            yield root
+        elif root[len(path):].count(os.path.sep) >= max_depth:
+            del dirs[:]
+
+def validate_workflow(path, wdltool, server=False, use_cache=True):
+    '''
+    Validate the workflow in directory path and write its tests/inputs.json,
+    returning a report of the outcome rather than raising on failure, as
+    needed by the worker processes of validate_all.
+    '''
+    name = os.path.basename(path)
+    start = time.time()
+    error = None
+    try:
+        tests = os.path.join(path, 'tests')
+        if not os.path.isdir(tests):
+            os.mkdir(tests)
+        write_inputs(wdltool, os.path.join(path, name + '.wdl'),
+                     os.path.join(tests, 'inputs.json'), server, use_cache)
+    except WomtoolError as e:
+        error = e.output
+        logging.error("Unable to validate %s:\n%s", name, error)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        logging.error("Unable to validate %s: %s", name, error)
+    return OrderedDict([('workflow', name), ('path', path),
+                        ('status', 'fail' if error else 'pass'),
+                        ('duration', round(time.time() - start, 3)),
+                        ('error', error)])
+
+def validate_all(path=None, jobs=None, report=None, server=False,
+                 use_cache=True):
+    '''
+    Validate every workflow found under path using a pool of up to jobs
+    processes, then write a JSON report of each outcome to report (or
+    stdout). Exits with an error if any workflow failed validation.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    workflows = list(workflow_dirs(path))
+    if not workflows:
+        logging.error("No workflows found")
+        sys.exit(2)
+    WDLTOOL = find_tool(ConfigLoader().config.All.WDLtool, "wdltool")
+    pool_kwargs = {}
+    # Workers log through the queue of initialize_logging otherwise (the
+    # initializer argument is new in Python 3.7)
+    if sys.version_info >= (3, 7):
+        pool_kwargs['initializer'] = initialize_worker_logging
+    with ProcessPoolExecutor(max_workers=jobs or cpu_count(),
+                             **pool_kwargs) as executor:
+        futures = [executor.submit(validate_workflow, workflow, WDLTOOL,
+                                   server, use_cache)
+                   for workflow in workflows]
+        results = [future.result() for future in futures]
+
+    log_table(['Workflow', 'Duration', 'Result'],
+              [(result['workflow'], '{:.1f}s'.format(result['duration']),
+                result['status']) for result in results])
+    if report is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(report, 'w') as report_file:
+            report_file.write(u(json.dumps(results, indent=2) + '\n'))
+    if any(result['error'] for result in results):
+        sys.exit(1)
 
 def main(args=None):
     parser = ArgParser(description=Description)
     if __name__ != '__main__':
         parser.prog += " " + __name__.rsplit('.', 1)[-1]
     
+    parser.add_argument('-s', '--server', action='store_true',
+                        help='Run womtool through a long-lived helper JVM, ' +
+                             'starting one if necessary (requires Java 16+)')
+    parser.add_argument('--stop-server', action='store_true',
+                        help='Stop the womtool helper JVM and exit')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Rerun womtool even if the WDL is unchanged ' +
+                             'since its last successful validation')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='Validate all workflows below the current ' +
+                             'directory, and report the outcome as JSON')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of workflows to validate concurrently ' +
+                             'with --all (default: number of CPUs)')
+    parser.add_argument('--report', metavar='FILE',
+                        help='Write the --all report to FILE instead of ' +
+                             'stdout')
+
     args = parser.parse_args(args)
-    validate()
+    if args.stop_server:
+        stop_server(find_tool(ConfigLoader().config.All.WDLtool, "wdltool"))
+        return
+    if args.all:
+        validate_all(jobs=args.jobs, report=args.report, server=args.server,
+                     use_cache=args.use_cache)
+    else:
+        validate(server=args.server, use_cache=args.use_cache)
 
 if __name__ == '__main__':
     initialize_logging()
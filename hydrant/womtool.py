@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+'''
+Run womtool, either as a fresh JVM per call or through a long-lived helper
+JVM (bin/WomtoolServer.java) which is started on demand, shared by all
+hydrant invocations via a Unix socket in the user directory, and exits on
+its own after being idle for a while.
+'''
+
+import errno
+import hashlib
+import logging
+import os
+import socket
+import subprocess
+import time
+
+from hydrant.util import FIXEDPATHS, user_lock
+
+SERVER_SOURCE = os.path.join(FIXEDPATHS.BIN, 'WomtoolServer.java')
+IDLE_TIMEOUT = 900  # seconds before an unused server exits
+START_TIMEOUT = 60  # seconds to wait for a new server to accept requests
+
+class WomtoolError(Exception):
+    def __init__(self, returncode, output):
+        super(WomtoolError, self).__init__(output)
+        self.returncode = returncode
+        self.output = output
+
+def socket_path(jar):
+    '''Location of the socket of the helper serving the given womtool jar'''
+    key = hashlib.sha1(os.path.abspath(jar).encode('utf-8')).hexdigest()
+    return os.path.join(FIXEDPATHS.USERDIR, 'womtool-' + key[:12] + '.sock')
+
+def _request(sock, args):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(sock)
+        client.sendall(('\0'.join(args) + '\n').encode('utf-8'))
+        chunks = []
+        chunk = client.recv(65536)
+        while chunk:
+            chunks.append(chunk)
+            chunk = client.recv(65536)
+    finally:
+        client.close()
+    returncode, _, output = b''.join(chunks).decode('utf-8').partition('\n')
+    return int(returncode), output
+
+def start_server(jar, idle_timeout=IDLE_TIMEOUT):
+    '''Launch a detached helper for jar and wait until it accepts requests'''
+    sock = socket_path(jar)
+    if os.path.exists(sock):
+        os.remove(sock)
+    logging.info("Starting womtool server for %s", jar)
+    with open(os.devnull, 'rb') as devnull, \
+         open(sock[:-len('.sock')] + '.log', 'ab') as log:
+        server = subprocess.Popen(['java', '-cp', jar, SERVER_SOURCE, sock,
+                                   str(idle_timeout)],
+                                  stdin=devnull, stdout=log,
+                                  stderr=subprocess.STDOUT, close_fds=True,
+                                  preexec_fn=os.setsid)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline and server.poll() is None:
+        if os.path.exists(sock):
+            return sock
+        time.sleep(0.1)
+    if server.poll() is None:
+        server.kill()
+    raise WomtoolError(server.poll(), "womtool server did not start, see " +
+                       sock[:-len('.sock')] + '.log')
+
+def stop_server(jar):
+    '''Ask the helper serving jar, if any, to shut down'''
+    sock = socket_path(jar)
+    try:
+        _request(sock, ['shutdown'])
+        logging.info("Stopped womtool server for %s", jar)
+    except socket.error:
+        pass
+
+def run_womtool(jar, args, server=False):
+    '''
+    Run womtool with the given arguments, returning its return code and its
+    output (which includes stderr only if it failed). File arguments should
+    be absolute paths when using the server, as it does not share the
+    caller's working directory. If the server cannot be reached or started,
+    womtool is run directly.
+    '''
+    if server:
+        sock = socket_path(jar)
+        try:
+            return _request(sock, args)
+        except socket.error as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+        try:
+            with user_lock(os.path.basename(sock)[:-len('.sock')]):
+                try:
+                    # Started by another process while waiting for the lock
+                    return _request(sock, args)
+                except socket.error:
+                    pass
+                return _request(start_server(jar), args)
+        except (socket.error, WomtoolError, OSError) as e:
+            logging.warning("Unable to use womtool server (%s), running " +
+                            "womtool directly", e)
+    proc = subprocess.Popen(['java', '-jar', jar] + list(args),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    output, errors = proc.communicate()
+    if proc.returncode != 0:
+        output = errors + output
+    return proc.returncode, output
+
+def womtool(jar, args, server=False):
+    '''Like run_womtool, but returns only the output, and raises a
+    WomtoolError if womtool fails'''
+    returncode, output = run_womtool(jar, args, server)
+    if returncode != 0:
+        raise WomtoolError(returncode, output)
+    return output
@@ -19,15 +19,16 @@ setup(
         ]
     },
     package_data = {'hydrant': ['bin/*', 'defaults/*']},
-    use_scm_version=True,
+    use_scm_version={'write_to': 'hydrant/_version.py'},
     setup_requires=['setuptools_scm', 'pytest-runner'],
     tests_require = ['pytest'],
     install_requires = [
         'firecloud>=0.16.14',
         'requests[security]',
-        'docker[tls]>=3.0.1',
+        'docker[tls]>=3.6.0',
         'six',
-        'colorlog'
+        'colorlog',
+        'futures; python_version < "3"'
     ],
     classifiers = [
         "Development Status :: 3 - Alpha",
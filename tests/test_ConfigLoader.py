@@ -1 +1,46 @@
 # encoding: utf-8
+
+import os
+from hydrant import ConfigLoader as config_module
+from hydrant.ConfigLoader import ConfigLoader
+from hydrant.docker_utils import docker_repos
+
+def workflow(tmpdir, num_tasks):
+    tmpdir.join('hydrant.cfg').write('[Docker]\nNamespace = test\n')
+    for num in range(num_tasks):
+        task = tmpdir.mkdir('task_{}'.format(num))
+        task.join('Dockerfile').write('FROM ubuntu\n')
+        task.join('hydrant.cfg').write('[Docker]\nTag = {}\n'.format(num))
+    return tmpdir
+
+def test_snapshot(tmpdir, monkeypatch):
+    monkeypatch.setattr(config_module, '_SNAPSHOTS', dict())
+    flow = workflow(tmpdir, 1)
+    config = ConfigLoader(str(flow)).config
+    assert config.Docker.Namespace == 'test'
+    assert ConfigLoader(str(flow)).config is config
+    task_config = ConfigLoader(str(flow.join('task_0'))).config
+    assert task_config.Docker.Tag == '0'
+
+    # A changed layer invalidates the snapshot
+    flow.join('hydrant.cfg').write('[Docker]\nNamespace = other\n')
+    os.utime(str(flow.join('hydrant.cfg')), (0, 0))
+    assert ConfigLoader(str(flow)).config.Docker.Namespace == 'other'
+    assert ConfigLoader(str(flow.join('task_0'))).config.Docker.Namespace == \
+           'other'
+
+def test_each_file_read_once(tmpdir, monkeypatch):
+    monkeypatch.setattr(config_module, '_TEXTS', dict())
+    monkeypatch.setattr(config_module, '_SNAPSHOTS', dict())
+    flow = workflow(tmpdir, 50)
+    reads = []
+    def counting_open(path, *args):
+        reads.append(path)
+        return open(path, *args)
+    monkeypatch.setattr(config_module, 'open', counting_open, raising=False)
+    versions = dict(docker_repos(str(flow)))
+    assert len(versions) == 50
+    # User, workflow and each task config
+    assert len(reads) == len(set(reads)) == 52
+    assert dict(docker_repos(str(flow))) == versions
+    assert len(reads) == 52
@@ -1 +1,257 @@
 # encoding: utf-8
+
+import os
+import time
+import pytest
+from hydrant import WDL as wdl_module
+from hydrant.WDL import WDL, Task, Call, Scatter, Conditional, parse, \
+                        WDLImportError, WDLSyntaxError, load_wdl, \
+                        resolve_imports
+
+SMOKETEST = os.path.join('tests', 'smoketest', 'smoketest.wdl')
+
+WDL_1_0 = '''version 1.0  # comment
+
+import "lib/tools.wdl" as tools alias Sample as ToolSample
+
+struct Sample {
+    String id
+    Array[File]+ reads
+}
+
+task align {
+    input {
+        Sample sample
+        Map[String, Int] sizes = {"a": 1}
+        Int threads = 4
+    }
+    Int mem = threads *
+        2
+    command <<<
+        bwa mem -t ~{threads} ref.fa ~{sep=" " sample.reads} > out.sam
+        echo "}" >&2
+    >>>
+    output {
+        File sam = "out.sam"
+    }
+    runtime {
+        docker: "biocontainers/bwa:0.7.17"
+        memory: "~{mem} GB"
+    }
+    parameter_meta {
+        sample: { help: "command { not a command" }
+    }
+}
+
+workflow align_all {
+    input {
+        Array[Sample] samples
+        Boolean qc = true
+    }
+    scatter (sample in samples) {
+        call align { input: sample = sample, threads = 8 }
+        if (qc) {
+            call tools.check as check_sam { input: sam = align.sam }
+        }
+    }
+    output {
+        Array[File] sams = align.sam
+    }
+}
+'''
+
+def test_smoketest():
+    wdl = WDL(SMOKETEST)
+    assert list(wdl.tasks) == ['smoketest_task', 'smoketest_report']
+    task = wdl.tasks['smoketest_task']
+    assert task.text.startswith('task smoketest_task {')
+    assert task.text.endswith('}')
+    assert [decl.name for decl in task.inputs][:3] == ['package', 'null_file',
+                                                       'package_name']
+    assert task.inputs[3].expression == '"${package_name}.zip"'
+    assert [decl.name for decl in task.outputs] == ['smoketest_pkg',
+                                                    'outputs']
+    assert task.command.strip().startswith('set -euo pipefail')
+    assert list(task.runtime) == ['docker', 'disks', 'preemptible']
+    assert task.docker.value == 'broadgdac/firecloud-ubuntu:16.04'
+    with open(SMOKETEST, 'rb') as source:
+        assert source.read()[task.docker.start:task.docker.end] == \
+               b'"broadgdac/firecloud-ubuntu:16.04"'
+    workflow = wdl.document.workflow
+    assert workflow.name == 'smoketest'
+    assert [call.task for call in workflow.calls] == ['smoketest_task',
+                                                      'smoketest_report']
+    assert workflow.calls[1].inputs['files_archive'] == \
+           'smoketest_task.outputs'
+    assert [output.name for output in workflow.outputs] == \
+           ['smoketest_report.smoketest_pkg', 'smoketest_report.results']
+    assert wdl.workflow.startswith('workflow smoketest {')
+
+def test_text():
+    wdl = WDL(SMOKETEST)
+    text = wdl.text()
+    assert text.startswith('task smoketest_task {')
+    assert '}\n\ntask smoketest_report {' in text
+    assert text.endswith(wdl.workflow)
+    assert Task(wdl.tasks['smoketest_report'].text).name == 'smoketest_report'
+
+def test_version_1_0():
+    document = parse(WDL_1_0)
+    assert document.version == '1.0'
+    assert document.imports[0].uri == 'lib/tools.wdl'
+    assert document.imports[0].alias == 'tools'
+    assert document.imports[0].aliases == {'Sample': 'ToolSample'}
+    assert [(member.type, member.name) for member in
+            document.structs['Sample'].members] == [('String', 'id'),
+                                                    ('Array[File]+', 'reads')]
+    task = document.tasks['align']
+    assert [decl.type for decl in task.inputs] == ['Sample',
+                                                   'Map[String, Int]', 'Int']
+    assert [(decl.name, decl.expression) for decl in task.declarations] == \
+           [('mem', 'threads *\n        2')]
+    assert task.command.strip().endswith('echo "}" >&2')
+    assert task.docker.value == 'biocontainers/bwa:0.7.17'
+    assert task.runtime['memory'].value is None
+    workflow = document.workflow
+    scatter = workflow.body[0]
+    assert isinstance(scatter, Scatter) and scatter.variable == 'sample'
+    assert isinstance(scatter.body[1], Conditional)
+    assert [(call.task, call.alias) for call in workflow.calls] == \
+           [('align', None), ('tools.check', 'check_sam')]
+    assert workflow.calls[0].inputs == {'sample': 'sample', 'threads': '8'}
+    assert isinstance(workflow.calls[1], Call)
+    assert workflow.outputs[0].expression == 'align.sam'
+
+def test_syntax_error():
+    with pytest.raises(WDLSyntaxError) as excinfo:
+        parse('task broken {\n    String x = "unterminated\n}\n')
+    assert excinfo.value.line == 2
+
+def test_single_line_runtime():
+    task = parse('task t {\n    command { true }\n'
+                 '    runtime { docker: "u:1" cpu: 1 memory: "2 GB" }\n}\n'
+                 ).tasks['t']
+    assert task.docker.value == 'u:1'
+    assert [(attr.key, attr.expression) for attr in task.runtime.values()] == \
+           [('docker', '"u:1"'), ('cpu', '1'), ('memory', '"2 GB"')]
+
+def test_single_line_declarations():
+    task = parse('version 1.0\ntask t {\n'
+                 '    input { String s = "x" Int? n Array[File]+ f = [a, b] }\n'
+                 '    command { true }\n'
+                 '    output { Int o = if defined(n) then n else 1 File g = "g" }\n'
+                 '}\n').tasks['t']
+    assert [(decl.type, decl.name, decl.expression)
+            for decl in task.inputs] == [('String', 's', '"x"'),
+                                         ('Int?', 'n', None),
+                                         ('Array[File]+', 'f', '[a, b]')]
+    assert [(decl.name, decl.expression) for decl in task.outputs] == \
+           [('o', 'if defined(n) then n else 1'), ('g', '"g"')]
+
+def synthetic_wdl(num_tasks):
+    task = '''
+task task_{0} {{
+    File input_{0}
+    String prefix = "out_{0}"
+    Int? cpus
+    command {{
+        set -euo pipefail
+        tool --input ${{input_{0}}} --cpus ${{default=1 cpus}} \\
+             --output ${{prefix}}.txt
+        for i in 1 2 3; do echo "${{prefix}} $i" >> log.txt; done
+    }}
+    output {{
+        File result = "${{prefix}}.txt"
+    }}
+    runtime {{
+        docker: "example/task_{0}:1"
+        preemptible: "${{if defined(cpus) then cpus else '1'}}"
+    }}
+}}
+'''
+    calls = ''.join('    call task_{0} {{ input: input_{0} = input_file }}\n'
+                    .format(num) for num in range(num_tasks))
+    return ''.join([task.format(num) for num in range(num_tasks)] +
+                   ['workflow synthetic {\n    File input_file\n', calls,
+                    '}\n'])
+
+def test_parse_benchmark():
+    source = synthetic_wdl(500)
+    start = time.time()
+    document = parse(source)
+    elapsed = time.time() - start
+    assert len(document.tasks) == 500
+    assert len(document.workflow.calls) == 500
+    assert document.tasks['task_499'].docker.value == 'example/task_499:1'
+    # Generous bound, to catch only quadratic behavior on slow machines
+    assert elapsed < 2.0, "parsed 500 tasks in {:.3f}s".format(elapsed)
+
+def test_load_wdl(tmpdir, monkeypatch):
+    path = tmpdir.join('flow.wdl')
+    path.write(synthetic_wdl(2))
+    wdl = load_wdl(str(path))
+    assert load_wdl(str(path)) is wdl
+    path.write(synthetic_wdl(3))
+    path.setmtime(path.mtime() + 10)
+    assert len(load_wdl(str(path)).tasks) == 3
+
+    # Least recently used parses are evicted from the process-wide cache
+    monkeypatch.setattr(wdl_module, 'WDL_CACHE_SIZE', 1)
+    monkeypatch.setattr(wdl_module, '_WDL_CACHE', wdl_module.OrderedDict())
+    other = tmpdir.join('other.wdl')
+    other.write(synthetic_wdl(1))
+    wdl = load_wdl(str(path))
+    load_wdl(str(other))
+    assert load_wdl(str(path)) is not wdl
+
+def import_graph(tmpdir, imports):
+    '''Write a WDL for each name with a task and the given imports'''
+    for name, imported in imports.items():
+        tmpdir.join(name + '.wdl').write(''.join(
+            'import "{}.wdl"\n'.format(other) for other in imported) +
+            'task {0}_task {{\n    command {{ echo {0} }}\n}}\n'.format(name))
+
+def test_resolve_imports(tmpdir, monkeypatch):
+    # Diamond: flow imports left and right, which both import base
+    import_graph(tmpdir.mkdir('lib'), {'left': ['base'], 'right': ['base'],
+                                       'base': []})
+    tmpdir.join('flow.wdl').write('version 1.0\n'
+                                  'import "lib/left.wdl"\n'
+                                  'import "lib/right.wdl" as r\n'
+                                  'task own {\n    command { true }\n}\n')
+    loads = []
+    def counting_load(path):
+        loads.append(path)
+        return WDL(path)
+    monkeypatch.setattr(wdl_module, 'load_wdl', counting_load)
+    imports = resolve_imports(str(tmpdir.join('flow.wdl')))
+    assert sorted(loads) == sorted(set(loads)) and len(loads) == 4
+    assert list(imports.tasks) == ['own', 'left.left_task',
+                                   'left.base.base_task', 'r.right_task',
+                                   'r.base.base_task']
+    assert imports.tasks['r.base.base_task'] is \
+           imports.tasks['left.base.base_task']
+    assert [os.path.basename(location) for location in imports.wdls] == \
+           ['flow.wdl', 'left.wdl', 'base.wdl', 'right.wdl']
+
+def test_resolve_url_imports(tmpdir, monkeypatch):
+    url = 'https://example.com/lib/remote.wdl'
+    import_graph(tmpdir, {'flow': [url[:-len('.wdl')]]})
+    def load_import(location):
+        assert location != url, "url imports should not be fetched"
+        return WDL(location)
+    monkeypatch.setattr(wdl_module, '_load_import', load_import)
+    imports = resolve_imports(str(tmpdir.join('flow.wdl')), fetch=False)
+    assert list(imports.wdls) == [str(tmpdir.join('flow.wdl'))]
+    assert list(imports.graph.values()) == [[('remote', url)]]
+    assert list(imports.tasks) == ['flow_task']
+
+def test_import_cycle(tmpdir):
+    import_graph(tmpdir, {'a': ['b'], 'b': ['c'], 'c': ['b']})
+    with pytest.raises(WDLImportError) as excinfo:
+        resolve_imports(str(tmpdir.join('a.wdl')))
+    assert str(excinfo.value).endswith('b.wdl -> ' + str(tmpdir.join('c.wdl'))
+                                       + ' -> ' + str(tmpdir.join('b.wdl')))
+    import_graph(tmpdir, {'d': ['missing']})
+    with pytest.raises(WDLImportError):
+        resolve_imports(str(tmpdir.join('d.wdl')))
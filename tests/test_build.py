@@ -1,6 +1,8 @@
 # encoding: utf-8
 
+import logging
 import pytest
+from docker.errors import BuildError
 from hydrant import build
 
 def test_main():
@@ -11,3 +13,82 @@ def test_main():
 def test_smoketest_report(workflows_dir):
     with workflows_dir.join('smoketest', 'smoketest_report').as_cwd():
         build.main()
+
+def test_context_digest(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM scratch\nCOPY src /src\n')
+    tmpdir.join('.dockerignore').write('*\n!src\n!Dockerfile\n')
+    tmpdir.mkdir('src').join('tool.sh').write('echo hello\n')
+    digest, files = build.context_digest(str(tmpdir), 'ns/repo:1')
+    assert sorted(files) == ['.dockerignore', 'Dockerfile', 'src/tool.sh']
+    assert build.context_digest(str(tmpdir), 'ns/repo:1', files) == \
+           (digest, files)
+    # Files excluded from the build context don't affect the digest
+    tmpdir.join('notes.txt').write('not part of the image\n')
+    assert build.context_digest(str(tmpdir), 'ns/repo:1', files)[0] == digest
+    assert build.context_digest(str(tmpdir), 'ns/repo:2', files)[0] != digest
+    tmpdir.join('src', 'tool.sh').write('echo goodbye\n')
+    assert build.context_digest(str(tmpdir), 'ns/repo:1')[0] != digest
+
+class FakeAPI(object):
+    def __init__(self, events):
+        self.events = events
+
+    def build(self, **kwargs):
+        assert kwargs['decode']
+        for event in self.events:
+            yield event
+
+    def inspect_image(self, image):
+        return {'Id': 'sha256:' + image + '0' * 52}
+
+class FakeClient(object):
+    def __init__(self, events):
+        self.api = FakeAPI(events)
+
+def test_stream_build(caplog):
+    caplog.set_level(logging.INFO)
+    events = [{'stream': 'Step 1/2 : FROM ubuntu'}, {'stream': '\n'},
+              {'status': 'Pulling fs layer', 'id': 'abc'},
+              {'status': 'Downloading', 'id': 'abc', 'progress': '[=>  ]'},
+              {'stream': ' ---> 0123456789ab\n'},
+              {'stream': 'Step 2/2 : RUN true\n'},
+              {'aux': {'ID': 'sha256:' + 'f' * 64}},
+              {'stream': 'Successfully built ffffffffffff\n'}]
+    assert build.stream_build(FakeClient(events), '/tasks/task', 'ns/task:1') \
+           == 'sha256:' + 'f' * 64
+    assert [record.getMessage() for record in caplog.records] == [
+        '[task] Step 1/2 : FROM ubuntu', '[task] abc: Pulling fs layer',
+        '[task]  ---> 0123456789ab', '[task] Step 2/2 : RUN true',
+        '[task] Successfully built ffffffffffff']
+
+    # Older daemons only report the short id
+    events = [{'stream': 'Successfully built 0123456789ab\n'}]
+    assert build.stream_build(FakeClient(events), '/tasks/task', 'ns/task:1') \
+           == 'sha256:0123456789ab' + '0' * 52
+
+def test_stream_build_error():
+    events = [{'stream': 'line {}\n'.format(num)} for num in range(100)]
+    events.append({'error': 'The command returned a non-zero code: 1\n'})
+    with pytest.raises(BuildError) as excinfo:
+        build.stream_build(FakeClient(events), '/tasks/task', 'ns/task:1')
+    assert excinfo.value.msg == 'The command returned a non-zero code: 1'
+    assert excinfo.value.build_log == ['line {}'.format(num) for num in
+                                       range(100 - build.ERROR_LINES, 100)]
+
+def test_stream_build_partial_lines(caplog):
+    caplog.set_level(logging.INFO)
+    events = [{'stream': 'Step 1/1 : RUN echo hel'}, {'stream': 'lo wor'},
+              {'stream': 'ld\n ---> Running in 0123'},
+              {'stream': '456789ab\n'},
+              {'stream': 'Successfully built 0123456789ab'}]
+    build.stream_build(FakeClient(events), '/tasks/task', 'ns/task:1')
+    assert [record.getMessage() for record in caplog.records] == [
+        '[task] Step 1/1 : RUN echo hello world',
+        '[task]  ---> Running in 0123456789ab',
+        '[task] Successfully built 0123456789ab']
+
+    events = [{'stream': 'compiling '}, {'stream': 'package'},
+              {'error': 'The command returned a non-zero code: 1'}]
+    with pytest.raises(BuildError) as excinfo:
+        build.stream_build(FakeClient(events), '/tasks/task', 'ns/task:1')
+    assert excinfo.value.build_log == ['compiling package']
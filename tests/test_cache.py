@@ -0,0 +1,29 @@
+# encoding: utf-8
+
+import os
+import pytest
+from hydrant.cache import FileCache, cache_key
+
+@pytest.fixture
+def file_cache(tmpdir):
+    cache = FileCache('test', max_entries=2)
+    cache.path = str(tmpdir)
+    return cache
+
+def test_cache_key():
+    assert cache_key('a', 'bc') != cache_key('ab', 'c')
+    assert cache_key(b'abc') == cache_key(u'abc')
+
+def test_lru_eviction(file_cache):
+    file_cache.put('a', {'value': 1})
+    file_cache.put('b', {'value': 2})
+    # Age the entries, then use 'a' so that 'b' is least recently used
+    for idx, entry in enumerate(file_cache.entries()):
+        os.utime(entry, (idx, idx))
+    assert file_cache.get('a') == {'value': 1}
+    file_cache.put('c', {'value': 3})
+    assert file_cache.get('b') is None
+    assert file_cache.get('a') == {'value': 1}
+    assert file_cache.get('c') == {'value': 3}
+    file_cache.clear()
+    assert file_cache.entries() == []
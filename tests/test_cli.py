@@ -1,7 +1,16 @@
 # encoding: utf-8
+import importlib
+import subprocess
+import sys
+import time
 import pytest
 from hydrant import cli
 
+# Wall-clock budget (in seconds) for lightweight commands, which should never
+# need to import any of the heavy dependencies
+STARTUP_BUDGET = 2.0
+HEAVY_MODULES = ('docker', 'firecloud', 'requests')
+
 def test_main():
     with pytest.raises(SystemExit) as excinfo:
         cli.main()
@@ -16,3 +25,39 @@ def test_help(hydrant_func):
     with pytest.raises(SystemExit) as excinfo:
         cli.main([hydrant_func, '-h'])
     assert str(excinfo.value) == '0'
+
+def test_lock_timeout(monkeypatch):
+    def initialize_user_dir():
+        raise cli.LockTimeout("Timed out")
+    monkeypatch.setattr(cli, 'initialize_user_dir', initialize_user_dir)
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(['--version'])
+    assert str(excinfo.value) == '75'
+
+def test_command_descriptions():
+    for cmd, description in cli.COMMANDS.items():
+        mod = importlib.import_module('hydrant.' + cmd)
+        assert mod.Description == description
+
+def run_hydrant(args):
+    '''Run hydrant in a fresh interpreter with -X importtime, returning the
+    elapsed wall-clock time and the set of top-level packages imported'''
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-m',
+                             'hydrant.cli'] + args, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    _, stderr = proc.communicate()
+    elapsed = time.time() - start
+    imported = set(line.rsplit('|', 1)[-1].strip().split('.', 1)[0]
+                   for line in stderr.splitlines()
+                   if line.startswith('import time:'))
+    return proc.returncode, elapsed, imported
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="Requires -X importtime")
+@pytest.mark.parametrize('args', [['--version'], ['tutorial']])
+def test_startup_time(args):
+    returncode, elapsed, imported = run_hydrant(args)
+    assert returncode == 0
+    assert imported.isdisjoint(HEAVY_MODULES)
+    assert elapsed < STARTUP_BUDGET
@@ -0,0 +1,94 @@
+# encoding: utf-8
+
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import zipfile
+import pytest
+from hydrant import cromwell
+from hydrant.util import LockTimeout, user_lock
+
+def test_write_config():
+    config = cromwell.write_config()
+    mtime = os.path.getmtime(config)
+    with open(config) as config_file:
+        text = config_file.read()
+    assert 'call-caching {\n  enabled = true' in text
+    assert 'jdbc:hsqldb:file:' + os.path.join(cromwell.CALL_CACHE_DIR,
+                                              'cromwell-db;') in text
+    os.utime(config, (mtime - 10, mtime - 10))
+    assert cromwell.write_config() == config
+    assert os.path.getmtime(config) == mtime - 10
+
+def test_prune_call_cache(monkeypatch):
+    def stop_server():
+        # The server cannot be restarted while pruning
+        with pytest.raises(LockTimeout):
+            with user_lock('cromwell-server', timeout=0):
+                pass
+    monkeypatch.setattr(cromwell, 'stop_server', stop_server)
+    os.makedirs(cromwell.CALL_CACHE_DIR)
+    with open(os.path.join(cromwell.CALL_CACHE_DIR, 'cromwell-db.data'),
+              'wb') as db:
+        db.write(b'\0' * 1000)
+    assert cromwell.call_cache_size() == (1000, 0)
+    assert cromwell.prune_call_cache() == 1000
+    assert cromwell.call_cache_size() == (0, 0)
+
+def _server_state(args, jar):
+    process = subprocess.Popen([sys.executable, '-c',
+                                'import time; time.sleep(60)'] + args)
+    # Wait for the exec to complete
+    cmdline = '/proc/{}/cmdline'.format(process.pid)
+    while True:
+        with open(cmdline, 'rb') as cmdline_file:
+            if b'time.sleep' in cmdline_file.read():
+                break
+        time.sleep(0.01)
+    if not os.path.isdir(cromwell.SERVER_DIR):
+        os.makedirs(cromwell.SERVER_DIR)
+    with open(cromwell.SERVER_STATE, 'w') as state:
+        json.dump({'pid': process.pid, 'port': 1, 'jar': jar}, state)
+    return process
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/cmdline'),
+                    reason="requires /proc")
+def test_stop_server(tmpdir):
+    jar = str(tmpdir.join('cromwell.jar'))
+    server = _server_state(['-jar', jar], jar)
+    cromwell.stop_server()
+    assert server.poll() is not None
+    assert cromwell.load_state() is None
+
+    # A process which has since reused the pid is left alone
+    other = _server_state([], jar)
+    try:
+        cromwell.stop_server()
+        assert other.poll() is None
+        assert cromwell.load_state() is None
+    finally:
+        other.kill()
+        other.wait()
+
+def test_workflow_dependencies(tmpdir):
+    lib = tmpdir.mkdir('flow').mkdir('lib')
+    lib.join('tools.wdl').write('task tool {\n    command { true }\n}\n')
+    wdl = tmpdir.join('flow', 'flow.wdl')
+    wdl.write('import "lib/tools.wdl"\n'
+              'workflow flow {\n    call tools.tool\n}\n')
+    data = cromwell.workflow_dependencies(str(wdl))
+    with zipfile.ZipFile(io.BytesIO(data)) as dependencies:
+        assert dependencies.namelist() == ['lib/tools.wdl']
+        assert dependencies.read('lib/tools.wdl') == \
+               lib.join('tools.wdl').read_binary()
+
+    wdl.write('workflow flow {}\n')
+    assert cromwell.workflow_dependencies(str(wdl)) is None
+    tmpdir.join('outside.wdl').write('task outside {\n'
+                                     '    command { true }\n}\n')
+    wdl.write('import "../outside.wdl"\nworkflow flow {}\n')
+    with pytest.raises(cromwell.CromwellServerError):
+        cromwell.workflow_dependencies(str(wdl))
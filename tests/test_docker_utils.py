@@ -0,0 +1,94 @@
+# encoding: utf-8
+
+import json
+import os
+import pytest
+from hydrant import docker_utils
+
+@pytest.fixture
+def docker_config(tmpdir, monkeypatch):
+    config = tmpdir.join('config.json')
+    config.write(json.dumps({'credHelpers': {'gcr.io': 'gcloud'}}))
+    monkeypatch.setenv('DOCKER_CONFIG', str(tmpdir))
+    monkeypatch.setattr(docker_utils, 'which', lambda cmd: '/usr/bin/' + cmd)
+    monkeypatch.setattr(docker_utils, 'CREDENTIAL_CACHE',
+                        str(tmpdir.join('credential_helpers.json')))
+    return config
+
+def test_credential_helpers_cached(docker_config, monkeypatch):
+    assert docker_utils.configure_credential_helpers()
+    with open(docker_utils.CREDENTIAL_CACHE) as cache_file:
+        cached = json.load(cache_file)
+    assert cached['config'] == str(docker_config)
+    assert cached['mtime'] == os.path.getmtime(str(docker_config))
+
+    # Unchanged config should not be reloaded
+    def load_config(*args, **kwargs):
+        raise AssertionError("Docker config reloaded")
+    monkeypatch.setattr(docker_utils.docker.auth, 'load_config', load_config)
+    assert docker_utils.configure_credential_helpers()
+
+def test_credential_helpers_config_changed(docker_config, monkeypatch):
+    assert docker_utils.configure_credential_helpers()
+    docker_config.write(json.dumps({'credHelpers': {'quay.io': 'quay'}}))
+    os.utime(str(docker_config), (0, 0))
+
+    runs = []
+    def check_output(*args, **kwargs):
+        runs.append(args)
+        raise OSError("gcloud not found")
+    monkeypatch.setattr(docker_utils.subprocess, 'check_output', check_output)
+    assert not docker_utils.configure_credential_helpers()
+    # Failures are retried, e.g. once gcloud is installed
+    assert not docker_utils.configure_credential_helpers()
+    assert len(runs) == 2
+
+class FakeAPI(object):
+    def __init__(self, images):
+        self.images_list = images
+        self.calls = []
+
+    def images(self, filters=None):
+        self.calls.append(filters)
+        return self.images_list
+
+class FakeClient(object):
+    def __init__(self, images):
+        self.api = FakeAPI(images)
+
+def test_split_full_tag():
+    assert docker_utils.split_full_tag('gcr.io/proj/repo:1') == \
+           ('gcr.io', 'proj', 'repo', '1')
+    assert docker_utils.split_full_tag('localhost:5000/ns/repo') == \
+           ('localhost:5000', 'ns', 'repo', None)
+    assert docker_utils.split_full_tag('ubuntu:16.04') == \
+           (None, None, 'ubuntu', '16.04')
+
+def test_image_index():
+    client = FakeClient([
+        {'Id': 'sha256:1', 'RepoTags': ['broadgdac/smoketest_report:1',
+                                        'gcr.io/proj/smoketest_report:1']},
+        {'Id': 'sha256:2', 'RepoTags': ['broadgdac/smoketest_report:2']},
+        {'Id': 'sha256:3', 'RepoTags': None}])
+    index = docker_utils.image_index(client, ['smoketest_report'])
+    assert client.api.calls == [{'reference': ['*/smoketest_report',
+                                               '*/*/smoketest_report']}]
+    images = index.lookup('smoketest_report')
+    assert images.registries == {'gcr.io'}
+    assert images.namespaces == {'broadgdac', 'proj'}
+    assert images.ids == {'sha256:1', 'sha256:2'}
+    assert index.image_id('broadgdac/smoketest_report:2') == 'sha256:2'
+    # Already indexed repositories are not listed again
+    assert docker_utils.image_index(client) is index
+    index.add('broadgdac/smoketest_report:3', 'sha256:4')
+    assert index.image_id('broadgdac/smoketest_report:3') == 'sha256:4'
+    assert len(client.api.calls) == 1
+
+def test_strip_default_registry():
+    assert docker_utils.strip_default_registry('docker.io/ns/repo') == \
+           'ns/repo'
+    assert docker_utils.strip_default_registry(
+        'registry.hub.docker.com/ns/repo') == 'ns/repo'
+    assert docker_utils.strip_default_registry('gcr.io/ns/repo') == \
+           'gcr.io/ns/repo'
+    assert docker_utils.strip_default_registry('docker.io') == 'docker.io'
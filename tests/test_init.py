@@ -42,3 +42,23 @@ def test_cli_cfg(workflows_dir):
             else:
                 assert not os.path.isdir(taskdir)
                     
+
+def test_user_task_import(tmpdir):
+    flow = tmpdir.mkdir('flow')
+    flow.join('lib.wdl').write('task lib_a {\n    command { true }\n}\n' +
+                               'task lib_b {\n    command { true }\n}\n')
+    flow.join('flow.wdl').write('import "lib.wdl" as tools\n' +
+                                'workflow flow {\n    call tools.lib_a\n}\n')
+    with tmpdir.as_cwd():
+        assert [task.name for task in
+                init.user_task('flow.tools.lib_b').tasks] == ['lib_b']
+        assert [task.name for task in
+                init.user_task('flow.tools.*').tasks] == ['lib_a', 'lib_b']
+        with pytest.raises(init.ArgumentTypeError):
+            init.user_task('flow.other.lib_a')
+
+def test_user_task_syntax_error(tmpdir):
+    tmpdir.mkdir('flow').join('flow.wdl').write('task t {\n    command {\n')
+    with tmpdir.as_cwd():
+        with pytest.raises(init.ArgumentTypeError):
+            init.user_task('flow.t')
@@ -1,9 +1,117 @@
 # encoding: utf-8
 
 import pytest
+from collections import namedtuple
+import docker
+from docker.errors import ImageNotFound, NotFound
+from firecloud import which
 from hydrant import push
 
 def test_main():
     with pytest.raises(SystemExit) as excinfo:
         push.main()
     assert str(excinfo.value) == '2'
+
+FakeImage = namedtuple('FakeImage', 'id attrs')
+
+class FakeImages(object):
+    def __init__(self, events, local=None, remote=None):
+        self.events = events
+        self.local = local or {}
+        self.remote = remote or {}
+        self.auth_config = None
+
+    def push(self, repo, **kwargs):
+        assert kwargs['stream'] and kwargs['decode']
+        if self.auth_config is not None and \
+           kwargs.get('auth_config') != self.auth_config:
+            return iter([{'errorDetail': {'message': 'unauthorized'}}])
+        return iter(self.events)
+
+    def get(self, name):
+        if name not in self.local:
+            raise ImageNotFound(name)
+        return self.local[name]
+
+    def get_registry_data(self, name, auth_config=None):
+        if name not in self.remote:
+            raise NotFound(name)
+        return FakeImage(self.remote[name], {})
+
+class FakeClient(object):
+    def __init__(self, events, local=None, remote=None):
+        self.images = FakeImages(events, local, remote)
+
+def test_push_image():
+    events = [{'status': 'The push refers to repository [docker.io/ns/repo]'},
+              {'status': 'Preparing', 'id': 'abc'},
+              {'status': 'Pushing', 'id': 'abc',
+               'progressDetail': {'current': 512, 'total': 1024}},
+              {'status': 'Pushed', 'id': 'abc', 'progressDetail': {}},
+              {'status': '1: digest: sha256:0123 size: 527'},
+              {'progressDetail': {},
+               'aux': {'Tag': '1', 'Digest': 'sha256:0123', 'Size': 527}}]
+    pushed = push.push_image(FakeClient(events), 'ns/repo', {'tag': '1'})
+    assert pushed == [('1', 'sha256:0123', 527, 'ok')]
+
+def test_push_image_login(monkeypatch):
+    client = FakeClient([{'progressDetail': {}, 'aux': {'Tag': '1'}}])
+    client.images.auth_config = {'username': 'user'}
+    monkeypatch.setattr(push, '_LOGINS', {})
+    logins = []
+    def docker_login(kwargs):
+        logins.append(kwargs)
+        kwargs['auth_config'] = {'username': 'user'}
+        return kwargs
+    monkeypatch.setattr(push, 'docker_login', docker_login)
+    assert push.push_image(client, 'ns/repo', {})[0].tag == '1'
+    # Later pushes to the same registry reuse the credentials entered
+    assert push.push_image(client, 'docker.io/ns/other', {})[0].tag == '1'
+    assert len(logins) == 1
+    push.push_image(client, 'gcr.io/ns/repo', {})
+    assert len(logins) == 2
+
+def test_push_image_up_to_date():
+    local = {'ns/repo:1': FakeImage('sha256:abcd', {
+        'RepoDigests': ['docker.io/ns/repo@sha256:0123',
+                        'other/repo@sha256:4567']})}
+    client = FakeClient([], local, {'ns/repo:1': 'sha256:0123'})
+    pushed = push.push_image(client, 'ns/repo', {'tag': '1'})
+    assert pushed == [('1', 'sha256:0123', None, 'up to date')]
+    # A different remote digest means the local image must be pushed
+    client = FakeClient([], local, {'ns/repo:1': 'sha256:89ab'})
+    assert push.push_image(client, 'ns/repo', {'tag': '1'}) == []
+
+def test_push_images_failure():
+    events = [{'errorDetail': {'message': 'denied'}, 'error': 'denied'}]
+    assert not push.push_images(FakeClient(events), [('ns/repo', '1')])
+
+@pytest.fixture(scope='module')
+def local_registry():
+    '''Throwaway registry:2 container standing in for a remote registry'''
+    if which('docker') is None:
+        pytest.skip("Docker not installed")
+    try:
+        client = docker.from_env()
+        client.ping()
+    except Exception:
+        pytest.skip("Docker daemon not available")
+    container = client.containers.run('registry:2', detach=True,
+                                      ports={'5000/tcp': None})
+    try:
+        container.reload()
+        port = container.ports['5000/tcp'][0]['HostPort']
+        yield client, 'localhost:' + port
+    finally:
+        container.remove(force=True)
+
+def test_push_to_local_registry(local_registry, tmpdir):
+    client, registry = local_registry
+    tmpdir.join('Dockerfile').write('FROM scratch\nCOPY data /data\n')
+    tmpdir.join('data').write('hydrant\n')
+    repo = registry + '/hydrant/push_test'
+    client.images.build(path=str(tmpdir), tag=repo + ':1', rm=True)
+    first = push.push_image(client, repo, {'tag': '1'})
+    assert [pushed.status for pushed in first] == ['ok']
+    second = push.push_image(client, repo, {'tag': '1'})
+    assert second == [('1', first[0].digest, None, 'up to date')]
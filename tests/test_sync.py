@@ -1 +1,81 @@
 # encoding: utf-8
+
+import os
+import pytest
+from hydrant import sync
+
+TASK = '''task {name} {{
+    command {{ {name} }}
+    runtime {{
+        docker: "{image}"
+    }}
+}}
+'''
+
+def write_wdl(path, *images):
+    path.write(''.join(TASK.format(name='task_{}'.format(idx), image=image)
+                       for idx, image in enumerate(images)))
+
+@pytest.fixture
+def workspace(tmpdir):
+    '''Two workflows using ns/tool, whose Dockerfile is in flow_a'''
+    tool = tmpdir.mkdir('flow_a').mkdir('tool')
+    tool.join('Dockerfile').write('FROM ubuntu\n')
+    tool.join('hydrant.cfg').write('[Docker]\nNamespace=ns\nTag=2\n')
+    write_wdl(tmpdir.join('flow_a', 'flow_a.wdl'), 'ns/tool:1')
+    write_wdl(tmpdir.mkdir('flow_b').join('flow_b.wdl'), 'other/image:1',
+              'docker.io/ns/tool:1', 'ns/tool:2')
+    tmpdir.mkdir('flow_b', 'cromwell-executions')
+    return tmpdir
+
+def test_sync(workspace):
+    flow_b = workspace.join('flow_b', 'flow_b.wdl')
+    original = flow_b.read()
+    sync.sync(str(workspace.join('flow_a', 'tool')), dry_run=True)
+    assert flow_b.read() == original
+
+    sync.sync(str(workspace.join('flow_a', 'tool')))
+    assert '"ns/tool:2"' in workspace.join('flow_a', 'flow_a.wdl').read()
+    assert flow_b.read() == original.replace('docker.io/ns/tool:1',
+                                             'docker.io/ns/tool:2')
+    index = sync.load_index(str(workspace))
+    assert [entry[2] for entry in index['images']['ns/tool']] == ['2'] * 3
+
+def test_incremental_index(workspace, monkeypatch):
+    root = str(workspace)
+    index = sync.update_index(root)
+    assert sorted(index['files']) == [
+        str(workspace.join('flow_a', 'flow_a.wdl')),
+        str(workspace.join('flow_b', 'flow_b.wdl'))]
+    assert str(workspace.join('flow_b', 'cromwell-executions')) not in \
+           index['dirs']
+
+    parsed = []
+    docker_references = sync.docker_references
+    def counting_references(wdl):
+        parsed.append(wdl)
+        return docker_references(wdl)
+    monkeypatch.setattr(sync, 'docker_references', counting_references)
+    listed = []
+    listdir = os.listdir
+    def counting_listdir(path):
+        listed.append(path)
+        return listdir(path)
+    monkeypatch.setattr(sync.os, 'listdir', counting_listdir)
+
+    assert sync.update_index(root) == index
+    assert parsed == [] and listed == []
+
+    # A modified WDL is parsed again, a new one is found by listing only
+    # its (modified) directory
+    flow_b = workspace.join('flow_b', 'flow_b.wdl')
+    write_wdl(flow_b, 'ns/tool:3')
+    flow_b.setmtime(flow_b.mtime() + 10)
+    write_wdl(workspace.mkdir('flow_c').join('flow_c.wdl'), 'ns/tool:4')
+    workspace.setmtime(workspace.mtime() + 10)
+    index = sync.update_index(root)
+    assert sorted(parsed) == [str(flow_b),
+                              str(workspace.join('flow_c', 'flow_c.wdl'))]
+    assert listed == [root, str(workspace.join('flow_c'))]
+    assert [entry[2] for entry in index['images']['ns/tool']] == \
+           ['1', '3', '4']
@@ -1,7 +1,12 @@
 # encoding: utf-8
 
+import os
+import json
+import logging
+import shutil
 import pytest
-from hydrant import test
+from hydrant import test, cromwell
+from hydrant.util import FIXEDPATHS, user_lock
 
 def test_main():
     with pytest.raises(SystemExit) as excinfo:
@@ -10,4 +15,125 @@ def test_main():
 
 def test_valid_smoketest(workflows_dir):
     with workflows_dir.join('smoketest').as_cwd():
-        test.main()
\ No newline at end of file
+        test.main()
+
+FAKE_CROMWELL = '''#! /bin/sh
+# Stand-in for "java -jar cromwell.jar run ..." in the smoketest directory
+id=0123abcd-0123-4567-89ab-0123456789ab
+dir=cromwell-executions/smoketest/$id/call-smoketest_task/execution
+echo "[info] starting"
+echo "[info] Workflow $id submitted"
+mkdir -p $dir
+sleep 1
+echo "task complaint" > $dir/stderr
+echo "ERROR: task failed"
+echo "    at stack.trace"
+sleep 1
+exit 1
+'''
+
+OPTIONS = os.path.join(FIXEDPATHS.BIN, 'options.json')
+
+def fake_java(tmpdir, monkeypatch, script):
+    fake_bin = tmpdir.mkdir('bin')
+    fake_bin.join('java').write(script)
+    fake_bin.join('java').chmod(0o755)
+    monkeypatch.setenv('PATH', str(fake_bin) + os.pathsep + os.environ['PATH'])
+
+def test_run_cromwell_failure(workflows_dir, tmpdir, monkeypatch, caplog):
+    fake_java(tmpdir, monkeypatch, FAKE_CROMWELL)
+    with workflows_dir.join('smoketest').as_cwd():
+        with pytest.raises(test.CromwellError):
+            test.run_cromwell('cromwell.jar', 'smoketest.wdl',
+                              'tests/inputs.json', OPTIONS, 'running-fake',
+                              'latest-fake')
+        assert not os.path.exists('running-fake')
+        assert os.path.islink(os.path.join('latest-fake', 'smoketest_task'))
+    messages = [record.getMessage() for record in caplog.records]
+    assert '[smoketest_task] task complaint' in messages
+    summary = messages[-1]
+    assert 'ERROR: task failed' in summary
+    assert '[info]' not in summary and 'stack.trace' not in summary
+
+def test_matrix(tmpdir, monkeypatch, caplog):
+    caplog.set_level(logging.INFO)
+    fake_java(tmpdir, monkeypatch, FAKE_CROMWELL.replace('exit 1', 'exit 0'))
+    monkeypatch.setattr(test, 'find_tool', lambda url, name: 'cromwell.jar')
+    smoketest = tmpdir.join('smoketest')
+    shutil.copytree(os.path.join('tests', 'smoketest'), str(smoketest))
+    smoketest.join('tests', 'inputs.json').copy(smoketest.join('tests',
+                                                               'more.json'))
+    with smoketest.as_cwd():
+        test.main(['--jobs', '2'])
+        for done_dir in ('latest', 'latest-more'):
+            assert os.path.islink(os.path.join(done_dir, 'smoketest_task'))
+            with open(os.path.join(done_dir, 'options.json')) as options:
+                options = json.load(options)
+            assert options['final_workflow_outputs_dir'] == \
+                   os.path.abspath(done_dir.replace('latest', 'running') +
+                                   '/outputs')
+            # Concurrent command-line Cromwells can't share the call cache
+            assert options['read_from_cache'] is False
+    messages = [record.getMessage() for record in caplog.records]
+    assert '[more:smoketest_task] task complaint' in messages
+    rows = [message.split() for message in messages]
+    assert ['more', 'ok', 'latest-more'] in [row[:1] + row[2:] for row in rows]
+
+def test_call_cache_in_use(tmpdir, monkeypatch):
+    fake_java(tmpdir, monkeypatch, FAKE_CROMWELL.replace('exit 1', 'exit 0'))
+    monkeypatch.setattr(test, 'find_tool', lambda url, name: 'cromwell.jar')
+    monkeypatch.setattr(cromwell, 'running_server', lambda: None)
+    smoketest = tmpdir.join('smoketest')
+    shutil.copytree(os.path.join('tests', 'smoketest'), str(smoketest))
+    # As held by another hydrant test process
+    with smoketest.as_cwd(), user_lock('call-cache'):
+        test.main([])
+        with open(os.path.join('latest', 'options.json')) as options:
+            assert json.load(options)['read_from_cache'] is False
+    with smoketest.as_cwd():
+        test.main([])
+        with open(os.path.join('latest', 'options.json')) as options:
+            assert json.load(options)['read_from_cache'] is True
+
+def test_server_mode(tmpdir, monkeypatch, caplog):
+    submitted = {}
+    def submit_workflow(url, wdl, inputs_json, options):
+        with open(inputs_json) as inputs:
+            submitted.update(json.load(inputs))
+        return '0123abcd-0123-4567-89ab-0123456789ab'
+    monkeypatch.setattr(test, 'find_tool', lambda url, name: 'cromwell.jar')
+    monkeypatch.setattr(cromwell, 'EXECUTIONS', str(tmpdir))
+    monkeypatch.setattr(cromwell, 'ensure_server',
+                        lambda jar, port: 'http://localhost:8000')
+    monkeypatch.setattr(cromwell, 'submit_workflow', submit_workflow)
+    monkeypatch.setattr(cromwell, 'wait_for_workflow',
+                        lambda url, workflow_id: 'Failed')
+    monkeypatch.setattr(cromwell, 'workflow_metadata',
+                        lambda url, workflow_id: {'failures': [
+                            {'message': 'Workflow failed', 'causedBy': [
+                                {'message': 'Task exited with 1',
+                                 'causedBy': []}]}]})
+    smoketest = tmpdir.join('smoketest')
+    shutil.copytree(os.path.join('tests', 'smoketest'), str(smoketest))
+    with smoketest.as_cwd():
+        with pytest.raises(SystemExit) as excinfo:
+            test.main(['--server'])
+        assert str(excinfo.value) == '1'
+        assert os.path.isfile(os.path.join('latest', 'metadata.json'))
+        assert submitted['smoketest.smoketest_task.inputPlot'] == \
+               os.path.abspath(os.path.join('tests', 'plot.png'))
+    summary = [record.getMessage() for record in caplog.records
+               if record.getMessage().startswith('Error:')][0]
+    assert 'Workflow failed' in summary and 'Task exited with 1' in summary
+
+def test_finish_run_replaces_link(tmpdir):
+    # As left behind by runcromw.sh
+    tmpdir.mkdir('cromwell-executions').mkdir('old')
+    os.symlink(os.path.join('cromwell-executions', 'old'),
+               str(tmpdir.join('latest')))
+    tmpdir.mkdir('running').join('out.txt').write('output')
+    with tmpdir.as_cwd():
+        test._finish_run('running', 'latest', '', None, None)
+    assert not tmpdir.join('latest').islink()
+    assert tmpdir.join('latest', 'out.txt').read() == 'output'
+    assert tmpdir.join('cromwell-executions', 'old').isdir()
@@ -0,0 +1,136 @@
+# encoding: utf-8
+
+import hashlib
+import os
+import threading
+import pytest
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from hydrant import tools
+from hydrant.tools import ToolDownloadError, adopt_legacy, download, \
+    tool_path
+
+PAYLOAD = os.urandom(3 * tools.CHUNK_SIZE + 123)
+
+class RangeHandler(BaseHTTPRequestHandler):
+    '''Serves PAYLOAD, honoring Range requests, and truncates the first
+    response if the server's truncate flag is set'''
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(PAYLOAD)))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(PAYLOAD) - 1, len(PAYLOAD)))
+        else:
+            self.send_response(200)
+        body = PAYLOAD[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.truncate:
+            self.server.truncate = False
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.requests = []
+    httpd.truncate = False
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{}/tool.jar'.format(httpd.server_port)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_tool_path():
+    one = tool_path('https://example.com/1/tool.jar')
+    assert os.path.basename(one) == 'tool.jar'
+    assert one.startswith(tools.TOOLS_DIR)
+    assert tool_path('https://example.com/2/tool.jar') != one
+    assert tool_path('https://example.com/1/tool.jar#sha256=abc') == one
+
+def test_download(server, tmpdir):
+    local = str(tmpdir.join('tool.jar'))
+    digest = hashlib.sha256(PAYLOAD).hexdigest()
+    download(server.url + '#sha256=' + digest, local)
+    with open(local, 'rb') as tool:
+        assert tool.read() == PAYLOAD
+    assert not os.path.exists(local + '.part')
+    assert server.requests == [None]
+
+def test_resume(server, tmpdir):
+    local = str(tmpdir.join('tool.jar'))
+    with open(local + '.part', 'wb') as part:
+        part.write(PAYLOAD[:1000])
+    download(server.url, local)
+    with open(local, 'rb') as tool:
+        assert tool.read() == PAYLOAD
+    assert server.requests == ['bytes=1000-']
+
+    # Interrupted downloads are resumed
+    os.remove(local)
+    server.requests = []
+    server.truncate = True
+    download(server.url, local)
+    with open(local, 'rb') as tool:
+        assert tool.read() == PAYLOAD
+    # From the last complete chunk written
+    assert server.requests == [None, 'bytes={}-'.format(tools.CHUNK_SIZE)]
+
+    # A complete part file left by an earlier run is only renamed
+    os.rename(local, local + '.part')
+    server.requests = []
+    download(server.url, local)
+    assert os.path.getsize(local) == len(PAYLOAD)
+    assert server.requests == ['bytes={}-'.format(len(PAYLOAD))]
+
+def test_checksum_mismatch(server, tmpdir):
+    local = str(tmpdir.join('tool.jar'))
+    with pytest.raises(ToolDownloadError):
+        download(server.url + '#sha256=' + '0' * 64, local)
+    assert not os.path.exists(local)
+    assert not os.path.exists(local + '.part')
+
+    # A corrupt part file is removed rather than resumed again
+    with open(local + '.part', 'wb') as part:
+        part.write(b'\0' * 1000)
+    digest = hashlib.sha256(PAYLOAD).hexdigest()
+    with pytest.raises(ToolDownloadError):
+        download(server.url + '#sha256=' + digest, local)
+    assert not os.path.exists(local + '.part')
+    download(server.url + '#sha256=' + digest, local)
+    assert server.requests == [None, 'bytes=1000-', None]
+
+def test_adopt_legacy(tmpdir):
+    url = 'https://example.com/legacy/legacy-tool.jar'
+    local = str(tmpdir.join('tools', 'legacy-tool.jar'))
+    legacy = os.path.join(tools.FIXEDPATHS.USERDIR, 'legacy-tool.jar')
+    assert not adopt_legacy(url, local)
+    if not os.path.isdir(tools.FIXEDPATHS.USERDIR):
+        os.makedirs(tools.FIXEDPATHS.USERDIR)
+    with open(legacy, 'wb') as tool:
+        tool.write(PAYLOAD)
+    assert not adopt_legacy(url + '#sha256=' + '0' * 64, local)
+    assert os.path.exists(legacy)
+    digest = hashlib.sha256(PAYLOAD).hexdigest()
+    assert adopt_legacy(url + '#sha256=' + digest, local)
+    assert not os.path.exists(legacy)
+    with open(local, 'rb') as tool:
+        assert tool.read() == PAYLOAD
+
+def test_unverified_download(server, tmpdir, caplog):
+    download(server.url, str(tmpdir.join('tool.jar')))
+    assert '#sha256=' + hashlib.sha256(PAYLOAD).hexdigest() in caplog.text
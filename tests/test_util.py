@@ -1,9 +1,19 @@
 # encoding: utf-8
 
+import json
+import logging
+import os
 import pytest
 import subprocess
+import sys
+import threading
 from platform import system
+from hydrant import tools, util
 from hydrant.docker_utils import connect_to_daemon
+from hydrant.util import FIXEDPATHS, JSONFormatter, LockTimeout, \
+                         WrappedColoredFormatter, find_tool, flush_logging, \
+                         initialize_user_dir, log_to_logfile, run_parallel, \
+                         user_lock
 from time import sleep
  
 # For now, launching the docker daemon only works on Mac OSX (Darwin). As more
@@ -33,3 +43,126 @@ def test_relaunch_docker_daemon():
                                       stderr=subprocess.STDOUT
                                       ).strip().split()[0]
         subprocess.check_call(['kill', pid])
+
+def test_run_parallel():
+    def square(x):
+        if x < 0:
+            raise ValueError(x)
+        return x * x
+    results = run_parallel(square, [(str(x), (x,)) for x in (3, -1, 2)], 2)
+    assert [result.name for result in results] == ['3', '-1', '2']
+    assert [result.result for result in results] == [9, None, 4]
+    assert isinstance(results[1].error, ValueError)
+
+def test_run_parallel_fail_fast():
+    def fail(x):
+        raise ValueError(x)
+    results = run_parallel(fail, [(str(x), (x,)) for x in range(5)], 1, True)
+    assert isinstance(results[0].error, ValueError)
+    assert all(result.error == 'cancelled' for result in results[1:])
+
+def test_user_lock():
+    with user_lock('test'):
+        with pytest.raises(LockTimeout):
+            with user_lock('test', timeout=0.2):
+                pass
+    with user_lock('test', timeout=0):
+        pass
+
+def test_find_tool_downloads_once(monkeypatch):
+    downloads = []
+    def download(url, local):
+        downloads.append(url)
+        sleep(0.2)
+        os.makedirs(os.path.dirname(local))
+        with open(local, 'w') as tool:
+            tool.write('jar')
+    monkeypatch.setattr(tools, 'download', download)
+    url = 'https://example.com/locked/tool.jar'
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(find_tool(url,
+                                                                      'tool')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert downloads == [url]
+    assert paths == [tools.tool_path(url)] * 8
+
+def test_initialize_user_dir_stamp(monkeypatch):
+    initialize_user_dir()
+    checks = []
+    initialize = util._initialize_user_dir
+    def counting_initialize(*args):
+        checks.append(args)
+        initialize(*args)
+    monkeypatch.setattr(util, '_initialize_user_dir', counting_initialize)
+    initialize_user_dir()
+    assert checks == []
+
+    # Adding or removing files in the user directory invalidates the stamp
+    templates = os.path.join(FIXEDPATHS.USERDIR, 'templates.py')
+    os.rename(templates, templates + '.moved')
+    initialize_user_dir()
+    assert len(checks) == 1 and os.path.isfile(templates)
+    os.remove(templates + '.moved')
+    initialize_user_dir()
+    initialize_user_dir()
+    assert len(checks) == 2
+
+def test_wrapped_formatter_threads():
+    formatter = WrappedColoredFormatter("%(message)s", reset=False, width=20,
+                                        indent=4)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1,
+                               "first line is long enough to wrap\nsecond",
+                               None, None)
+    expected = formatter.format(record)
+    assert expected.splitlines() == ['first line is long', '    enough to wrap',
+                                     '    second']
+    results = run_parallel(lambda: [formatter.format(record)
+                                    for _ in range(200)],
+                           [(str(num), ()) for num in range(8)], 8)
+    assert all(result.result == [expected] * 200 for result in results)
+
+def test_log_to_logfile(tmpdir, monkeypatch):
+    from six.moves import queue
+    from logging.handlers import QueueListener
+    log_queue = queue.Queue()
+    listener = QueueListener(log_queue, respect_handler_level=True)
+    monkeypatch.setattr(util, '_LOG_QUEUE', log_queue)
+    monkeypatch.setattr(util, '_LOG_LISTENER', listener)
+    logfile = str(tmpdir.join('hydrant.log'))
+    log_to_logfile(logfile)
+    logger = logging.getLogger('hydrant.test_util')
+    queue_handler = util.TracebackQueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    listener.start()
+    try:
+        logger.warning("built %s", 'image')
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logger.exception("failed")
+        flush_logging()
+        with open(logfile) as log:
+            entries = [json.loads(line) for line in log]
+    finally:
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    assert [(entry['level'], entry['message']) for entry in entries] == \
+           [('WARNING', 'built image'), ('ERROR', 'failed')]
+    assert 'exception' not in entries[0]
+    assert entries[1]['exception'].endswith('ValueError: broken')
+
+def test_json_formatter():
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        record = logging.LogRecord('test', logging.ERROR, __file__, 1, "%d",
+                                   (1,), sys.exc_info())
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry['message'] == '1' and entry['level'] == 'ERROR'
+    assert entry['exception'].endswith('ValueError: broken')
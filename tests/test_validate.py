@@ -18,3 +18,103 @@ def test_smoketest_wdl(workflows_dir):
                [line.rstrip(',') for line in inputs.readlines(False) \
                 if '(optional) ' not in line]
         inputs_bak.move(inputs)
+
+def test_cached_inputs(workflows_dir, tmpdir, monkeypatch):
+    wdltool = tmpdir.join('womtool.jar')
+    wdltool.write('')
+    wdl = str(workflows_dir.join('smoketest', 'smoketest.wdl'))
+    key = validate.cache_key(open(wdl, 'rb').read(),
+                             validate.file_identity(str(wdltool)))
+    validate.VALIDATIONS.put(key, {'inputs': '{}'})
+    def womtool(*args, **kwargs):
+        raise AssertionError("womtool should not be run")
+    monkeypatch.setattr(validate, 'womtool', womtool)
+    assert validate.womtool_inputs(str(wdltool), wdl) == '{}'
+    with pytest.raises(AssertionError):
+        validate.womtool_inputs(str(wdltool), wdl, use_cache=False)
+
+def test_cached_inputs_imports(tmpdir, monkeypatch):
+    wdltool = tmpdir.join('womtool.jar')
+    wdltool.write('')
+    tmpdir.join('lib.wdl').write('task lib_task {\n    command { true }\n}\n')
+    wdl = tmpdir.join('flow.wdl')
+    wdl.write('import "lib.wdl"\nworkflow flow {\n    call lib.lib_task\n}\n')
+    runs = []
+    monkeypatch.setattr(validate, 'womtool',
+                        lambda *args: runs.append(args) or '{}')
+    validate.womtool_inputs(str(wdltool), str(wdl))
+    validate.womtool_inputs(str(wdltool), str(wdl))
+    assert len(runs) == 1
+    # Changes to imported WDLs invalidate the cached validation
+    tmpdir.join('lib.wdl').write('task lib_task {\n    command { false }\n}\n')
+    validate.womtool_inputs(str(wdltool), str(wdl))
+    assert len(runs) == 2
+
+def test_merge_inputs():
+    template = {'wf.task.files': 'Array[File]',
+                'wf.task.header': '(optional) String?',
+                'wf.task.num': 'Int',
+                'wf.package': 'Boolean',
+                'wf.name': 'String'}
+    old = {'wf.task.files': ['a.txt', 'b.txt'],
+           'wf.task.header': '(optional) String?',
+           'wf.task.num': 3,
+           'wf.name': 'Array[String]',
+           'wf.removed': 'gone'}
+    merged = validate.merge_inputs(template, old)
+    assert list(merged.items()) == [('wf.name', 'String'),
+                                    ('wf.package', True),
+                                    ('wf.task.files', ['a.txt', 'b.txt']),
+                                    ('wf.task.header', '(optional) String?'),
+                                    ('wf.task.num', 3)]
+
+def test_workflow_dirs(tmpdir):
+    for flow in ('flow_a', 'group/flow_b', 'flow_a/nested'):
+        flow_dir = tmpdir.join(flow).ensure(dir=True)
+        flow_dir.join(flow_dir.basename + '.wdl').write('')
+    tmpdir.mkdir('not_a_flow')
+    assert list(validate.workflow_dirs(str(tmpdir))) == \
+           [str(tmpdir.join('flow_a')), str(tmpdir.join('group', 'flow_b'))]
+
+def test_validate_workflow_report(workflows_dir, tmpdir):
+    wdltool = tmpdir.join('womtool.jar')
+    wdltool.write('')
+    smoketest = workflows_dir.join('smoketest')
+    key = validate.cache_key(smoketest.join('smoketest.wdl').read_binary(),
+                             validate.file_identity(str(wdltool)))
+    validate.VALIDATIONS.put(key, {'inputs': '{"smoketest.package": ' +
+                                             '"Boolean"}'})
+    inputs = smoketest.join('tests', 'inputs.json')
+    saved = inputs.read()
+    try:
+        report = validate.validate_workflow(str(smoketest), str(wdltool))
+        assert report['status'] == 'pass' and report['error'] is None
+        assert inputs.read() == '{\n  "smoketest.package": true\n}\n'
+    finally:
+        inputs.write(saved)
+        smoketest.join('tests', 'inputs.json.bak').remove()
+    report = validate.validate_workflow(str(tmpdir), str(wdltool))
+    assert report['workflow'] == tmpdir.basename
+    assert report['status'] == 'fail' and report['error']
+
+def test_validate_all_worker_logging(tmpdir, monkeypatch, capfd):
+    import logging
+    from hydrant import util
+    flow = tmpdir.mkdir('flow')
+    flow.join('flow.wdl').write('workflow flow {}\n')
+    def womtool(*args, **kwargs):
+        raise validate.WomtoolError(1, 'womtool failed on flow')
+    monkeypatch.setattr(validate, 'womtool', womtool)
+    monkeypatch.setattr(validate, 'find_tool', lambda url, name: 'womtool.jar')
+
+    # Log through the queue and listener thread, as the hydrant command does
+    root = logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', [])
+    monkeypatch.setattr(util, '_LOG_QUEUE', None)
+    monkeypatch.setattr(util, '_LOG_LISTENER', None)
+    util.initialize_logging()
+    with pytest.raises(SystemExit):
+        validate.validate_all(str(tmpdir), jobs=1, report=str(
+            tmpdir.join('report.json')), use_cache=False)
+    util.flush_logging()
+    assert 'womtool failed on flow' in capfd.readouterr().err
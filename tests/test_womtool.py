@@ -0,0 +1,45 @@
+# encoding: utf-8
+
+import socket
+import threading
+import pytest
+from hydrant import womtool
+
+@pytest.fixture
+def fake_server(tmpdir, monkeypatch):
+    '''Stand-in for WomtoolServer.java speaking the same protocol'''
+    sock = str(tmpdir.join('womtool.sock'))
+    monkeypatch.setattr(womtool, 'socket_path', lambda jar: sock)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock)
+    server.listen(1)
+    requests = []
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            request = conn.makefile('rb').readline().decode('utf-8')
+            args = request.rstrip('\n').split('\0')
+            requests.append(args)
+            if args == ['shutdown']:
+                conn.sendall(b'0\n')
+                conn.close()
+                break
+            conn.sendall(('0\n' + ' '.join(args)).encode('utf-8'))
+            conn.close()
+        server.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    yield requests
+    thread.join(5)
+
+def test_server_requests(fake_server):
+    assert womtool.run_womtool('womtool.jar', ['inputs', '/tmp/a.wdl'],
+                               server=True) == (0, 'inputs /tmp/a.wdl')
+    assert womtool.womtool('womtool.jar', ['validate', '/tmp/a.wdl'],
+                           server=True) == 'validate /tmp/a.wdl'
+    womtool.stop_server('womtool.jar')
+    assert fake_server == [['inputs', '/tmp/a.wdl'],
+                           ['validate', '/tmp/a.wdl'], ['shutdown']]